@@ -0,0 +1,110 @@
+"""Concurrency benchmark. Measures the throughput of several reader processes
+while one writer process ingests proxies, with and without the sqlite
+performance profile (PROXY_DB_SQLITE_* environment variables).
+proxy-db must be importable (pip install -e .).
+
+Usage: python benchmarks/concurrency.py [--readers N] [--seconds S]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+DISABLED_PROFILE = {
+    'PROXY_DB_SQLITE_JOURNAL_MODE': 'DELETE',
+    'PROXY_DB_SQLITE_SYNCHRONOUS': 'FULL',
+    'PROXY_DB_SQLITE_BUSY_TIMEOUT': '0',
+    'PROXY_DB_SQLITE_MMAP_SIZE': '',
+    'PROXY_DB_SQLITE_CACHE_SIZE': '',
+}
+COUNTRIES = ['ES', 'US', 'FR', 'DE']
+
+
+def reader(seconds, results):
+    from sqlalchemy.exc import OperationalError
+    from proxy_db.models import create_session, Proxy
+    operations = errors = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        session = create_session()
+        try:
+            session.query(Proxy).filter(Proxy.country == COUNTRIES[operations % len(COUNTRIES)])\
+                .order_by(Proxy.votes.desc()).first()
+        except OperationalError:
+            errors += 1
+            session.rollback()
+        else:
+            operations += 1
+        finally:
+            session.close()
+    results.put(('reader', operations, errors))
+
+
+def writer(seconds, results):
+    from sqlalchemy.exc import OperationalError
+    from proxy_db.models import create_session
+    from proxy_db.providers import Provider
+    provider = Provider()
+    operations = errors = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        session = create_session()
+        proxies = [{'proxy': '10.{}.{}.{}:8080'.format(operations % 256, i // 256, i % 256),
+                    'country_code': COUNTRIES[i % len(COUNTRIES)]} for i in range(100)]
+        try:
+            provider.bulk_process_proxies(proxies, session)
+            session.commit()
+        except OperationalError:
+            errors += 1
+            session.rollback()
+        else:
+            operations += 1
+        finally:
+            session.close()
+    results.put(('writer', operations, errors))
+
+
+def run(readers, seconds, profile):
+    os.environ['PROXY_DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'db.sqlite3')
+    os.environ.pop('PROXY_DB_DB_URL', None)
+    os.environ.update(profile)
+    subprocess.check_call([sys.executable, '-c', 'import proxy_db; proxy_db.init()'])
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=reader, args=(seconds, results)) for _ in range(readers)]
+    processes.append(context.Process(target=writer, args=(seconds, results)))
+    for process in processes:
+        process.start()
+    totals = {'reader': [0, 0], 'writer': [0, 0]}
+    for _ in processes:
+        name, operations, errors = results.get()
+        totals[name][0] += operations
+        totals[name][1] += errors
+    for process in processes:
+        process.join()
+    for key in DISABLED_PROFILE:
+        os.environ.pop(key, None)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    print('{:<10} {:>12} {:>12} {:>14} {:>14}'.format('profile', 'reads/s', 'read errors',
+                                                      'writes/s', 'write errors'))
+    for name, profile in [('default', DISABLED_PROFILE), ('tuned', {})]:
+        totals = run(args.readers, args.seconds, profile)
+        print('{:<10} {:>12.1f} {:>12} {:>14.1f} {:>14}'.format(
+            name, totals['reader'][0] / args.seconds, totals['reader'][1],
+            totals['writer'][0] * 100 / args.seconds, totals['writer'][1],
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Export benchmark. Measures the rows per second and the peak memory of the
+``proxy-db list`` output formats with a database of N proxies.
+proxy-db must be importable (pip install -e .).
+
+Usage: python benchmarks/export.py [--proxies N] [--formats json ndjson csv ...]
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+EXPORT_STATEMENT = '''
+import resource, sys
+from proxy_db.management import cli
+cli(['list', '--format', sys.argv[1], '--output', sys.argv[2]], standalone_mode=False)
+sys.stderr.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+'''
+
+
+def create_proxies(env, n):
+    os.environ.update(env)
+    from proxy_db.models import create_session, Proxy, ProviderRequest, association_table
+
+    session = create_session()
+    now = datetime.datetime.now()
+    provider_request = ProviderRequest(provider='manual', request_id='None-None', results=n)
+    session.add(provider_request)
+    session.flush()
+    session.execute(Proxy.__table__.insert(), [
+        dict(id='http://10.{}.{}.{}:80'.format(i // 65536, i // 256 % 256, i % 256), votes=i % 10,
+             country='ES', protocol='http', created_at=now, updated_at=now, on_provider_at=now)
+        for i in range(n)
+    ])
+    session.execute(association_table.insert(), [
+        dict(provider_request_id=provider_request.id,
+             proxy_id='http://10.{}.{}.{}:80'.format(i // 65536, i // 256 % 256, i % 256))
+        for i in range(n)
+    ])
+    session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--proxies', type=int, default=100000)
+    parser.add_argument('--formats', nargs='+', default=['json', 'ndjson', 'csv', 'line', 'arrow', 'parquet'])
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, PROXY_DB_FILE=os.path.join(directory, 'db.sqlite3'))
+    env.pop('PROXY_DB_DB_URL', None)
+    subprocess.check_call([sys.executable, '-c', 'import proxy_db; proxy_db.init()'], env=env)
+    create_proxies(env, args.proxies)
+    print('{:<15} {:>12} {:>12} {:>12}'.format('format', 'rows/s', 'max rss MB', 'size MB'))
+    for export_format in args.formats:
+        output = os.path.join(directory, 'export.{}'.format(export_format))
+        start = time.time()
+        process = subprocess.run([sys.executable, '-c', EXPORT_STATEMENT, export_format, output], env=env,
+                                 stderr=subprocess.PIPE)
+        elapsed = time.time() - start
+        if process.returncode:
+            print('{:<15} {}'.format(export_format, process.stderr.decode().strip().splitlines()[-1]))
+            continue
+        print('{:<15} {:>12.0f} {:>12.1f} {:>12.1f}'.format(
+            export_format, args.proxies / elapsed, int(process.stderr.split()[-1]) / 1024,
+            os.path.getsize(output) / 1024 / 1024,
+        ))
+
+
+if __name__ == '__main__':
+    main()
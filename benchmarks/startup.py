@@ -0,0 +1,43 @@
+"""Startup time benchmark. Measures the time to import proxy-db in a new
+interpreter and the time of the first database use.
+proxy-db must be importable (pip install -e .).
+
+Usage: python benchmarks/startup.py [--repeat N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+STATEMENTS = [
+    ('import proxy_db', 'import proxy_db'),
+    ('import proxy_db.proxies', 'import proxy_db.proxies'),
+    ('import proxy_db.management', 'import proxy_db.management'),
+    ('first database use', 'from proxy_db.models import create_session, Proxy; create_session().query(Proxy).first()'),
+]
+
+
+def run_statement(statement, env):
+    return subprocess.check_call([sys.executable, '-c', statement], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, PROXY_DB_FILE=os.path.join(directory, 'db.sqlite3'))
+    env.pop('PROXY_DB_DB_URL', None)
+    run_statement('import proxy_db; proxy_db.init()', env)
+    baseline = min(timeit.repeat(lambda: run_statement('pass', env), number=1, repeat=args.repeat))
+    print('{:<30} {:>10}'.format('statement', 'ms'))
+    for name, statement in STATEMENTS:
+        elapsed = min(timeit.repeat(lambda: run_statement(statement, env), number=1, repeat=args.repeat))
+        print('{:<30} {:>10.1f}'.format(name, (elapsed - baseline) * 1000))
+
+
+if __name__ == '__main__':
+    main()
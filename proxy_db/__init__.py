@@ -9,3 +9,11 @@ __version__ = '0.3.1'
 
 logging.basicConfig()
 logging.getLogger('sqlalchemy').setLevel(logging.ERROR)
+
+
+def init(url=None):
+    """Initialize the database using the url. By default the database is initialized
+    on first use with the PROXY_DB_DB_URL environment variable.
+    """
+    from proxy_db.models import init as init_models
+    return init_models(url)
@@ -0,0 +1,201 @@
+"""Asyncio support. The database queries run in a thread pool and the provider
+pages are downloaded using aiohttp (if it is installed).
+"""
+import asyncio
+import json
+import warnings
+
+from requests import RequestException
+
+from proxy_db.exceptions import NoProvidersAvailable
+from proxy_db.providers import ManualProxyRequest
+from proxy_db.proxies import ProxiesList
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+_fetches = {}
+# Shared aiohttp session by event loop: [session, number of users].
+_sessions = {}
+
+
+class AsyncResponse(object):
+    """Response with the requests.Response attributes used by the providers."""
+    def __init__(self, url, status_code, text):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+async def make_request(provider_request, session=None):
+    """Download the provider page. The aiohttp session is closed after the request
+    if it is not given.
+    """
+    loop = asyncio.get_running_loop()
+    if aiohttp is None:
+        return await loop.run_in_executor(None, provider_request.make_request)
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await make_request(provider_request, session)
+    timeout = aiohttp.ClientTimeout(sock_connect=provider_request.connect_timeout, sock_read=provider_request.timeout)
+    async with session.request(provider_request.method, provider_request.url, data=provider_request.data,
+                               headers=provider_request.headers, timeout=timeout) as response:
+        response.raise_for_status()
+        return AsyncResponse(provider_request.url, response.status, await response.text())
+
+
+def acquire_session():
+    """Return the aiohttp session of the module for the running loop. It is closed
+    when all the users have called release_session(). None without aiohttp.
+    """
+    if aiohttp is None:
+        return None
+    loop = asyncio.get_running_loop()
+    entry = _sessions.get(loop)
+    if entry is None or entry[0].closed:
+        entry = _sessions[loop] = [aiohttp.ClientSession(), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+async def release_session(session):
+    if session is None:
+        return
+    loop = asyncio.get_running_loop()
+    entry = _sessions.get(loop)
+    if entry is None or entry[0] is not session:
+        # The session has been replaced after being closed.
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        del _sessions[loop]
+        await session.close()
+
+
+async def _fetch_provider_request(provider_request):
+    loop = asyncio.get_running_loop()
+    errors = (RequestException, asyncio.TimeoutError) + ((aiohttp.ClientError,) if aiohttp else ())
+    # The fetch is shared by several lists. The session of the module is used, so
+    # closing a list does not close the session of a running fetch.
+    session = acquire_session()
+    try:
+        response = await make_request(provider_request, session)
+    except errors:
+        provider_request.provider.logger.exception('Error on request to {}'.format(provider_request.url))
+        return None
+    finally:
+        await release_session(session)
+    proxies = await loop.run_in_executor(None, provider_request.provider.find_page_proxies, response)
+    return await loop.run_in_executor(None, provider_request.bulk_add_proxies, proxies)
+
+
+async def fetch_provider_request(provider_request):
+    """Async version of ProviderRequestBase.now(). The concurrent calls for the same
+    provider request share the same download, using the aiohttp session of the module.
+
+    :rtype: proxy_db.providers.IngestResult
+    """
+    if isinstance(provider_request, ManualProxyRequest):
+        return None
+    key = (asyncio.get_running_loop(), provider_request.provider.name, provider_request.id)
+    fetch = _fetches.get(key)
+    if fetch is None:
+        fetch = _fetches[key] = asyncio.ensure_future(_fetch_provider_request(provider_request))
+        fetch.add_done_callback(lambda _: _fetches.pop(key, None))
+    return await asyncio.shield(fetch)
+
+
+class AsyncProxiesList(object):
+    """Asyncio version of ProxiesList. It accepts the same arguments. The ProxiesList
+    is created in the thread pool on first use. The list keeps the aiohttp session of
+    the module open until it is closed::
+
+        async with AsyncProxiesList('es') as proxies:
+            async for proxy in proxies:
+                ...
+    """
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self.proxies_list = None
+        self._lock = None
+        self._session = None
+
+    def __del__(self):
+        if self._session is not None:
+            warnings.warn('Unclosed AsyncProxiesList {!r}. Use close() or "async with".'.format(self),
+                          ResourceWarning, source=self)
+
+    def get_session(self):
+        if self._session is None:
+            self._session = acquire_session()
+        return self._session
+
+    async def close(self):
+        session, self._session = self._session, None
+        await release_session(session)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def run(self, function, *args):
+        # The strategies are not thread safe. Only one query at the same time.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def _get_proxies_list(self):
+        if self.proxies_list is None:
+            self.proxies_list = ProxiesList(*self._args, **self._kwargs)
+        return self.proxies_list
+
+    async def get_proxies_list(self):
+        """Return the ProxiesList. It is created in the thread pool: it can initialize
+        the database.
+        """
+        return self.proxies_list or await self.run(self._get_proxies_list)
+
+    async def reload_provider(self):
+        proxies_list = await self.get_proxies_list()
+        try:
+            provider = await self.run(proxies_list.find_provider)
+        except NoProvidersAvailable:
+            return None
+        # Keep the session of the module open between the downloads of this list.
+        self.get_session()
+        result = await fetch_provider_request(provider.request(**proxies_list.request_options))
+        await self.run(proxies_list.rescan)
+        return result
+
+    async def take(self, limit):
+        proxies_list = await self.get_proxies_list()
+        proxies = await self.run(proxies_list.pop_db_proxies, limit)
+        if len(proxies) < limit and await self.run(proxies_list.requires_reload):
+            await self.reload_provider()
+            proxies.extend(await self.run(proxies_list.pop_db_proxies, limit - len(proxies)))
+        return proxies
+
+    get_many = take
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        proxies_list = await self.get_proxies_list()
+        proxy = await self.run(proxies_list.find_db_proxy)
+        if proxy is None and await self.run(proxies_list.requires_reload):
+            await self.reload_provider()
+            proxy = await self.run(proxies_list.find_db_proxy)
+        if proxy is None:
+            raise StopAsyncIteration
+        return proxy
@@ -0,0 +1,176 @@
+"""Proxy health checks. The proxies are checked concurrently using a thread pool:
+a request to ``PROXY_DB_CHECK_URL`` is made through each proxy. The results
+(success or failure, connect and response latency) are saved in the proxy and
+the votes are updated (+1 if it works, -1 if it fails). The proxies that cannot
+be checked (socks proxies without PySocks installed) are skipped. The proxies are
+read, checked and saved in chunks.
+"""
+import datetime
+import os
+import socket
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+import requests
+from sqlalchemy import bindparam, func, or_, and_
+from sqlalchemy.orm import selectinload
+
+from proxy_db._compat import urlparse
+from proxy_db.models import Proxy, ProviderRequest, create_session
+from proxy_db.utils import chunks
+
+try:
+    # Required by requests for the socks proxies
+    import socks
+except ImportError:
+    socks = None
+
+
+PROXY_DB_CHECK_URL = os.environ.get('PROXY_DB_CHECK_URL', 'http://httpbin.org/ip')
+PROXY_DB_CHECK_TIMEOUT = float(os.environ.get('PROXY_DB_CHECK_TIMEOUT', 10))
+PROXY_DB_CHECK_WORKERS = int(os.environ.get('PROXY_DB_CHECK_WORKERS', 32))
+PROXY_DB_CHECK_CHUNK_SIZE = int(os.environ.get('PROXY_DB_CHECK_CHUNK_SIZE', 500))
+# Weight of the last response latency in the latency moving average.
+PROXY_DB_CHECK_EWMA_ALPHA = float(os.environ.get('PROXY_DB_CHECK_EWMA_ALPHA', 0.3))
+
+logger = getLogger('proxy_db.checks')
+
+# success is None if the proxy has been skipped.
+CheckResult = namedtuple('CheckResult', ['proxy_id', 'success', 'connect_latency', 'latency', 'error'])
+
+
+def is_supported_scheme(scheme):
+    return scheme in ('http', 'https') or (scheme.startswith('socks') and socks is not None)
+
+
+def check_proxy(proxy, url=PROXY_DB_CHECK_URL, timeout=PROXY_DB_CHECK_TIMEOUT):
+    """Check a proxy (a Proxy instance or a proxy url). The connect latency is the time
+    to open a connection to the proxy and the latency the time of the request to url
+    through the proxy. The proxies with an unsupported scheme are skipped (success
+    is None).
+
+    :rtype: CheckResult
+    """
+    proxy_id = proxy.id if isinstance(proxy, Proxy) else proxy
+    proxy_url = str(proxy)
+    address = urlparse(proxy_url)
+    connect_latency = None
+    if not is_supported_scheme(address.scheme):
+        return CheckResult(proxy_id, None, None, None, 'Unsupported proxy scheme: {}'.format(address.scheme))
+    try:
+        start = time.monotonic()
+        socket.create_connection((address.hostname, address.port), timeout=timeout).close()
+        connect_latency = time.monotonic() - start
+        start = time.monotonic()
+        response = requests.get(url, proxies={'http': proxy_url, 'https': proxy_url}, timeout=timeout)
+        latency = time.monotonic() - start
+        response.raise_for_status()
+    except requests.exceptions.InvalidSchema as e:
+        return CheckResult(proxy_id, None, connect_latency, None, str(e))
+    except (OSError, requests.RequestException) as e:
+        return CheckResult(proxy_id, False, connect_latency, None, str(e))
+    return CheckResult(proxy_id, True, connect_latency, latency, None)
+
+
+def apply_check_results(results, session=None, alpha=PROXY_DB_CHECK_EWMA_ALPHA,
+                        failure_latency=PROXY_DB_CHECK_TIMEOUT):
+    """Save the check results and update the votes in one transaction. The failed
+    checks count as failure_latency seconds in the latency moving average. The skipped
+    proxies are not updated.
+    """
+    now = datetime.datetime.now()
+    successes = [{'b_id': result.proxy_id, 'b_connect_latency': result.connect_latency,
+                  'b_latency': result.latency} for result in results if result.success is True]
+    failures = [{'b_id': result.proxy_id, 'b_connect_latency': result.connect_latency}
+                for result in results if result.success is False]
+    if not successes and not failures:
+        return
+    session = session or create_session()
+    table = Proxy.__table__
+    if successes:
+        latency = bindparam('b_latency')
+        session.execute(table.update().where(table.c.id == bindparam('b_id')).values(
+            votes=table.c.votes + 1,
+            checked_at=now,
+            check_successes=table.c.check_successes + 1,
+            connect_latency=bindparam('b_connect_latency'),
+            latency=latency,
+            latency_ewma=func.coalesce(alpha * latency + (1 - alpha) * table.c.latency_ewma, latency),
+        ), successes)
+    if failures:
+        session.execute(table.update().where(table.c.id == bindparam('b_id')).values(
+            votes=table.c.votes - 1,
+            checked_at=now,
+            check_failures=table.c.check_failures + 1,
+            connect_latency=bindparam('b_connect_latency'),
+            # Without a previous latency the proxy is still not measured (NULL).
+            latency_ewma=alpha * failure_latency + (1 - alpha) * table.c.latency_ewma,
+        ), failures)
+    session.commit()
+
+
+def check_proxies(proxies, url=PROXY_DB_CHECK_URL, timeout=PROXY_DB_CHECK_TIMEOUT,
+                  max_workers=PROXY_DB_CHECK_WORKERS, update=True, session=None,
+                  chunk_size=PROXY_DB_CHECK_CHUNK_SIZE):
+    """Check the proxies concurrently, chunk_size proxies at a time. If update is True
+    the results of each chunk are saved in the database in one transaction, so an
+    interrupted run keeps the results of the chunks already checked. A failed check
+    counts as timeout seconds in the latency moving average.
+
+    :return: list of CheckResult in the proxies order.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in chunks(proxies, chunk_size):
+            chunk_results = list(executor.map(lambda proxy: check_proxy(proxy, url, timeout), chunk))
+            if update:
+                apply_check_results(chunk_results, session, failure_latency=timeout)
+            results.extend(chunk_results)
+    return results
+
+
+def get_proxies_to_check(session=None, country=None, protocol=None, provider=None,
+                         checked_before=None, limit=None, chunk_size=PROXY_DB_CHECK_CHUNK_SIZE):
+    """Proxies from the database to check (generator). checked_before is a datetime:
+    only the proxies not checked since this date are returned (the never checked first,
+    then the oldest). The proxies are read in chunks of chunk_size using keyset
+    pagination, so they can be updated between chunks. The proxies checked after the
+    first chunk has been read are not returned.
+    """
+    session = session or create_session()
+    now = datetime.datetime.now()
+    checked_before = min(checked_before, now) if checked_before else now
+    query = session.query(Proxy).options(selectinload(Proxy.provider_requests))
+    if country:
+        query = query.filter(Proxy.country == country.upper())
+    if protocol:
+        query = query.filter(Proxy.protocol == protocol.lower())
+    if provider:
+        query = query.filter(Proxy.provider_requests.any(ProviderRequest.provider == provider))
+    phases = [
+        (query.filter(Proxy.checked_at == None), None),  # noqa: E711
+        (query.filter(Proxy.checked_at < checked_before), Proxy.checked_at),
+    ]
+    credentials_cache = {}
+    returned = 0
+    for phase_query, column in phases:
+        order_by = [Proxy.id] if column is None else [column, Proxy.id]
+        cursor = None
+        while limit is None or returned < limit:
+            page_query = phase_query
+            if cursor is not None and column is None:
+                page_query = page_query.filter(Proxy.id > cursor[1])
+            elif cursor is not None:
+                page_query = page_query.filter(or_(column > cursor[0], and_(column == cursor[0], Proxy.id > cursor[1])))
+            page_limit = chunk_size if limit is None else min(chunk_size, limit - returned)
+            proxies = page_query.order_by(*order_by).limit(page_limit).all()
+            for proxy in proxies:
+                proxy._set_providers(credentials_cache)
+            if proxies:
+                cursor = (proxies[-1].checked_at, proxies[-1].id)
+            returned += len(proxies)
+            yield from proxies
+            if len(proxies) < page_limit:
+                break
@@ -0,0 +1,168 @@
+"""Client for the proxy-db daemon (``proxy-db serve``). RemoteProxiesList has the
+same API as ProxiesList but each call is a request to the daemon::
+
+    for proxy in RemoteProxiesList('es', address='unix:///run/proxy-db.sock'):
+        requests.get('http://site.to/request', proxies=proxy)
+"""
+import datetime
+import json
+import os
+import socket
+import threading
+from collections import namedtuple
+from http.client import HTTPConnection, HTTPException, RemoteDisconnected
+
+from proxy_db._compat import urlparse
+from proxy_db.exceptions import NoProxiesAvailable, ServerError
+
+
+# The client does not import the database modules (sqlalchemy).
+PROXY_DB_SERVER_ADDRESS = os.environ.get('PROXY_DB_SERVER_ADDRESS', 'http://127.0.0.1:8765')
+PROTOCOLS = ['http', 'https']
+
+Lease = namedtuple('Lease', ['proxy_id', 'owner', 'expires_at'])
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+
+class Client(object):
+    """Daemon client. Each thread uses its own persistent connection."""
+    def __init__(self, address=PROXY_DB_SERVER_ADDRESS, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def create_connection(self):
+        url = urlparse(self.address)
+        if url.scheme == 'unix':
+            return UnixHTTPConnection(url.path, self.timeout)
+        return HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+
+    def get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.create_connection()
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _request(self, method, options):
+        connection = self.get_connection()
+        connection.request('POST', '/{}'.format(method), json.dumps(options),
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or '{}')
+
+    def request(self, method, options):
+        """Make the request. The methods are not idempotent, so the request is only
+        retried once, on a new connection, if a reused connection has been closed or
+        reset by the server (stale keep-alive connection).
+        """
+        reused = self.get_connection().sock is not None
+        try:
+            return self._request(method, options)
+        except (RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            self.close()
+            if not reused:
+                raise
+        except (HTTPException, OSError):
+            self.close()
+            raise
+        return self._request(method, options)
+
+    def call(self, method, **options):
+        status, data = self.request(method, options)
+        if status == 404 and data.get('type') == 'NoProxiesAvailable':
+            raise NoProxiesAvailable(data['error'])
+        elif status != 200:
+            raise ServerError(data.get('error', 'Server error {}'.format(status)))
+        return data['result']
+
+
+class RemoteProxy(dict):
+    """Proxy returned by the daemon. Like Proxy it can be used as the requests
+    proxies argument.
+    """
+    def __init__(self, client, data):
+        super(RemoteProxy, self).__init__({protocol: data['url'] for protocol in PROTOCOLS})
+        self.client = client
+        self.id = data['id']
+        self.url = data['url']
+        self.country = data['country']
+        self.protocol = data['protocol']
+        self.votes = data['votes']
+        self.providers = set(data['providers'])
+        self.lease = None
+        if data.get('lease'):
+            expires_at = datetime.datetime.fromisoformat(data['lease']['expires_at'])
+            self.lease = Lease(self.id, data['lease']['owner'], expires_at)
+
+    def vote(self, vote):
+        self.client.call('vote', proxy=self.id, vote=vote)
+
+    def positive(self):
+        self.vote(1)
+
+    def negative(self):
+        self.vote(-1)
+
+    def __repr__(self):
+        return "<RemoteProxy {} ({})>".format(self, ','.join(self.providers))
+
+    def __str__(self):
+        return self.url
+
+
+class RemoteProxiesList(object):
+    """ProxiesList served by the daemon. The strategy is a name (proxy_db.proxies.STRATEGIES)."""
+    def __init__(self, country=None, provider=None, protocol=None, strategy=None,
+                 address=PROXY_DB_SERVER_ADDRESS, client=None):
+        self.client = client or Client(address)
+        self.options = dict(country=country.upper() if country else None, provider=provider,
+                            protocol=protocol, strategy=strategy)
+
+    def call(self, method, **options):
+        options.update(self.options)
+        return self.client.call(method, **options)
+
+    def take(self, limit):
+        return [RemoteProxy(self.client, data) for data in self.call('take', n=limit)]
+
+    get_many = take
+
+    def acquire(self, ttl=None):
+        """Lease a proxy. By default the ttl is PROXY_DB_LEASE_TTL of the daemon."""
+        return RemoteProxy(self.client, self.call('acquire', ttl=ttl))
+
+    def release(self, proxy, success=None):
+        if proxy.lease is None:
+            return False
+        released = self.client.call('release', proxy=proxy.id, owner=proxy.lease.owner, success=success)
+        proxy.lease = None
+        return released
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return RemoteProxy(self.client, self.call('next'))
+        except NoProxiesAvailable:
+            raise StopIteration
+
+    def next(self):
+        return self.__next__()
@@ -277,8 +277,12 @@ else:
     geoip2_manager = None
 
 
+def ip_country_available():
+    return geoip2_manager is not None and bool(geoip2_manager.is_license_key_available())
+
+
 def ip_country(ip):
-    if geoip2_manager is None or not geoip2_manager.is_license_key_available():
+    if not ip_country_available():
         return ''
     try:
         country = geoip2_manager['country'].reader.country(ip)
@@ -8,9 +8,17 @@ class NoProvidersAvailable(ProxyDB):
     pass
 
 
+class NoProxiesAvailable(ProxyDB):
+    pass
+
+
 class UnknownExportFormat(ProxyDB):
     pass
 
 
 class UnsupportedEngine(ProxyDB):
     pass
+
+
+class ServerError(ProxyDB):
+    pass
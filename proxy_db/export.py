@@ -1,7 +1,16 @@
+import csv
 import datetime
+import io
 import json
+from itertools import islice
+from operator import attrgetter, methodcaller
+
+from sqlalchemy import select, Integer, Float, DateTime
+from sqlalchemy.orm import Query, selectinload
 
 from proxy_db.exceptions import UnknownExportFormat
+from proxy_db.models import Proxy, ProviderRequest, association_table, get_provider_instance, \
+    get_proxy_with_credentials
 
 
 try:
@@ -9,10 +18,18 @@ try:
 except ImportError:
     tabulate = None
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 
 DEFAULT_COLUMNS = [
     'id', 'votes', 'country', 'protocol', 'created_at', 'updated_at', 'on_provider_at', 'providers'
 ]
+EXPORT_CHUNK_SIZE = 1000
 
 
 def value_to_string(value):
@@ -32,22 +49,147 @@ class JsonEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def compile_accessor(name, model=Proxy):
+    """Function to get the column value of a model instance. It is the same value
+    as model.get_param(name), but the name is parsed once instead of once per cell.
+    """
+    attribute, _, related = name.partition('__')
+    if related:
+        related_accessor = compile_accessor(related, model.__mapper__.relationships[attribute].mapper.class_)
+        return lambda item: {related_accessor(value) for value in getattr(item, attribute)}
+    elif callable(getattr(model, attribute, None)):
+        return methodcaller(attribute)
+    return attrgetter(attribute)
+
+
+class ColumnsProjection(object):
+    """The export columns compiled once. When the data is a Proxy query and all the
+    columns are Proxy table columns, provider_requests__<column>, providers or
+    proxy_with_credentials, only the required columns are selected and no Proxy
+    instances are created. The provider requests are loaded with one query per
+    chunk. Otherwise the values are read from the Proxy instances using
+    precompiled accessors. The rows are tuples with the columns values converted
+    using the convert function.
+    """
+    def __init__(self, columns, convert=value_to_string):
+        self.columns = list(columns)
+        self.convert = convert
+        self.proxy_columns = ['id']
+        self.request_columns = ['provider']
+        self.credentials_cache = {}
+        self.getters = [self.compile_getter(name) for name in self.columns]
+        self.sql = None not in self.getters
+        self.use_requests = len(self.request_columns) > 1 or any(
+            name in ('providers', 'proxy_with_credentials') for name in self.columns
+        )
+        self.accessors = [compile_accessor(name) for name in self.columns]
+
+    def compile_getter(self, name):
+        """Function to get the column value from the selected proxy columns and the
+        proxy provider requests. None if the column is not available.
+        """
+        attribute, _, related = name.partition('__')
+        if attribute in Proxy.__table__.columns and not related:
+            if attribute not in self.proxy_columns:
+                self.proxy_columns.append(attribute)
+            i = self.proxy_columns.index(attribute)
+            return lambda row, requests: row[i]
+        elif attribute == 'provider_requests' and related in ProviderRequest.__table__.columns:
+            if related not in self.request_columns:
+                self.request_columns.append(related)
+            i = self.request_columns.index(related)
+            return lambda row, requests: {request[i] for request in requests}
+        elif name == 'providers':
+            return lambda row, requests: {request[0] for request in requests}
+        elif name == 'proxy_with_credentials':
+            return lambda row, requests: get_proxy_with_credentials(row[0], self.get_credentials(requests))
+        return None
+
+    def get_credentials(self, requests):
+        """Credentials of the first provider with credentials."""
+        for request in requests:
+            if request[0] not in self.credentials_cache:
+                self.credentials_cache[request[0]] = get_provider_instance(request[0]).credentials()
+            if self.credentials_cache[request[0]]:
+                return self.credentials_cache[request[0]]
+        return ()
+
+    def get_requests(self, session, proxy_ids):
+        """Provider requests columns by proxy id."""
+        table = ProviderRequest.__table__
+        statement = select(association_table.c.proxy_id, *[table.c[name] for name in self.request_columns])\
+            .select_from(association_table.join(table, table.c.id == association_table.c.provider_request_id))\
+            .where(association_table.c.proxy_id.in_(proxy_ids)).order_by(table.c.id)
+        requests = {}
+        for request in session.execute(statement):
+            requests.setdefault(request[0], []).append(request[1:])
+        return requests
+
+    def get_query_chunks(self, query, size):
+        query = query.with_entities(*[getattr(Proxy, name) for name in self.proxy_columns])
+        rows = iter(query.yield_per(size))
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                break
+            requests = self.get_requests(query.session, [row[0] for row in chunk]) if self.use_requests else {}
+            yield [tuple([self.convert(getter(row, requests.get(row[0], ()))) for getter in self.getters])
+                   for row in chunk]
+
+    def get_chunks(self, data, size=EXPORT_CHUNK_SIZE):
+        if isinstance(data, Query) and self.sql:
+            yield from self.get_query_chunks(data, size)
+            return
+        elif isinstance(data, Query):
+            data = data.options(selectinload(Proxy.provider_requests)).yield_per(size)
+        items = iter(data)
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
+                break
+            for item in chunk:
+                item._set_providers(self.credentials_cache)
+            yield [tuple([self.convert(accessor(item)) for accessor in self.accessors]) for item in chunk]
+
+
 class OutputBase:
     name = None
     default_columns = DEFAULT_COLUMNS
+    chunk_size = EXPORT_CHUNK_SIZE
+    binary = False
 
     def __init__(self, data, columns=None):
+        """The data can be a Proxy query or an iterable of Proxy instances."""
         self.data = data
         self.columns = columns or self.default_columns
+        self.projection = ColumnsProjection(self.columns, self.convert_value)
+
+    @staticmethod
+    def convert_value(value):
+        return value_to_string(value)
+
+    def get_chunks(self):
+        return self.projection.get_chunks(self.data, self.chunk_size)
 
     def get_rows(self):
-        for item in self.data:
-            item._set_providers()
-            yield {key: value_to_string(item.get_param(key)) for key in self.columns}
+        for chunk in self.get_chunks():
+            yield from chunk
 
-    def render(self):
+    def stream(self):
+        """Generator with the output text in parts. The rows are rendered as they are
+        read, the parts joined are the render() output.
+        """
         raise NotImplementedError
 
+    def render(self):
+        return ''.join(self.stream())
+
+    def write(self, file):
+        """Write the output to a file opened in text mode (binary mode for binary outputs)."""
+        for part in self.stream():
+            file.write(part)
+        file.write('\n')
+
     def __str__(self):
         return self.render()
 
@@ -56,31 +198,170 @@ class LineOutput(OutputBase):
     name = 'line'
     default_columns = ['proxy_with_credentials']
 
-    def render(self):
-        return '\n'.join([' '.join(row.values()) for row in self.get_rows()])
+    def stream(self):
+        separator = ''
+        for chunk in self.get_chunks():
+            yield separator + '\n'.join([' '.join(row) for row in chunk])
+            separator = '\n'
 
 
 class JsonOutput(OutputBase):
+    """The output is the same as json.dumps(rows, sort_keys=True, indent=4) but
+    the array is written item by item.
+    """
     name = 'json'
     default_columns = OutputBase.default_columns + ['provider_requests__provider']
 
-    def render(self):
-        return json.dumps(list(self.get_rows()), cls=JsonEncoder, sort_keys=True, indent=4)
+    def dumps(self, row):
+        return json.dumps(dict(zip(self.columns, row)), cls=JsonEncoder, sort_keys=True, indent=4)
+
+    def stream(self):
+        separator = '[\n    '
+        for chunk in self.get_chunks():
+            # The json strings do not contain line breaks. Indent the items one level.
+            yield separator + ',\n    '.join([self.dumps(row).replace('\n', '\n    ') for row in chunk])
+            separator = ',\n    '
+        yield '[]' if separator.startswith('[') else '\n]'
 
 
 class TabulateBaseOutput(OutputBase):
+    """Tabulate needs all the rows to calculate the columns width. The rows are
+    read in chunks but rendered in a single table.
+    """
+    def stream(self):
+        yield tabulate.tabulate(list(self.get_rows()), headers=self.columns, tablefmt=self.name.split('-')[0])
+
+
+class CsvOutput(OutputBase):
+    """CSV with a header row. The dates are in ISO 8601 format."""
+    name = 'csv'
+
+    @staticmethod
+    def convert_value(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        return value_to_string(value)
+
+    def stream(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(self.columns)
+        for chunk in self.get_chunks():
+            writer.writerows(chunk)
+            # The last line break is written with the next chunk, or by write() or echo().
+            yield buffer.getvalue()[:-1]
+            buffer.seek(0)
+            buffer.truncate()
+            buffer.write('\n')
+        yield buffer.getvalue()[:-1]
+
+
+class NdjsonOutput(OutputBase):
+    """Newline delimited JSON. One compact JSON object per proxy."""
+    name = 'ndjson'
+    default_columns = JsonOutput.default_columns
+
+    def stream(self):
+        encoder = JsonEncoder(separators=(',', ':'))
+        separator = ''
+        for chunk in self.get_chunks():
+            yield separator + '\n'.join([encoder.encode(dict(zip(self.columns, row))) for row in chunk])
+            separator = '\n'
+
+
+def get_arrow_type(name):
+    """Arrow type of the export column. The relationships are lists and the
+    unknown columns are strings.
+    """
+    attribute, _, related = name.partition('__')
+    if related or name == 'providers':
+        column = ProviderRequest.__table__.columns.get(related or 'provider')
+        return pyarrow.list_(get_column_arrow_type(column))
+    return get_column_arrow_type(Proxy.__table__.columns.get(attribute))
+
+
+def get_column_arrow_type(column):
+    column_type = getattr(column, 'type', None)
+    if isinstance(column_type, Integer):
+        return pyarrow.int64()
+    elif isinstance(column_type, Float):
+        return pyarrow.float64()
+    elif isinstance(column_type, DateTime):
+        return pyarrow.timestamp('us')
+    return pyarrow.string()
+
+
+def value_to_arrow(value):
+    if isinstance(value, set):
+        return sorted(value, key=lambda x: (x is None, x))
+    return value
+
+
+class ArrowBaseOutput(OutputBase):
+    """Binary columnar output (pyarrow). Each chunk is written as a record batch."""
+    binary = True
+
+    @staticmethod
+    def convert_value(value):
+        return value_to_arrow(value)
+
+    def get_schema(self):
+        return pyarrow.schema([(name, get_arrow_type(name)) for name in self.columns])
+
+    def get_batches(self, schema):
+        string_columns = [i for i, field in enumerate(schema) if field.type == pyarrow.string()]
+        for chunk in self.get_chunks():
+            columns = [list(values) for values in zip(*chunk)]
+            for i in string_columns:
+                columns[i] = [value if value is None or isinstance(value, str) else str(value)
+                              for value in columns[i]]
+            yield pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+    def create_writer(self, file, schema):
+        raise NotImplementedError
+
+    def write(self, file):
+        schema = self.get_schema()
+        writer = self.create_writer(file, schema)
+        try:
+            for batch in self.get_batches(schema):
+                writer.write_batch(batch)
+        finally:
+            writer.close()
+
     def render(self):
-        return tabulate.tabulate(self.get_rows(), headers="keys", tablefmt=self.name.split('-')[0])
+        buffer = io.BytesIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+
+class ArrowOutput(ArrowBaseOutput):
+    """Arrow IPC file (Feather v2)."""
+    name = 'arrow'
+
+    def create_writer(self, file, schema):
+        return pyarrow.ipc.new_file(file, schema)
+
+
+class ParquetOutput(ArrowBaseOutput):
+    name = 'parquet'
+
+    def create_writer(self, file, schema):
+        return pyarrow.parquet.ParquetWriter(file, schema)
 
 
 EXPORT_OUTPUTS = [
     LineOutput,
     JsonOutput,
+    CsvOutput,
+    NdjsonOutput,
 ]
 
 
 def get_export_output_classes():
-    classes = EXPORT_OUTPUTS
+    classes = list(EXPORT_OUTPUTS)
+    if pyarrow is not None:
+        classes.extend([ArrowOutput, ParquetOutput])
     tabulate_formats = []
     if tabulate is not None:
         tabulate_formats = tabulate._table_formats.keys()
@@ -0,0 +1,292 @@
+"""Rotating forward proxy. The gateway listens as an HTTP proxy (including CONNECT
+tunnels for HTTPS) and forwards each incoming connection through an upstream proxy
+from a ProxiesList. If the upstream proxy fails to connect, it is voted negative
+and the connection is retried using another upstream proxy. The other CONNECT
+responses of the upstream proxy (for example 403) are relayed to the client.
+"""
+import asyncio
+import base64
+import os
+from logging import getLogger
+
+from proxy_db._compat import urlparse
+from proxy_db.aio import AsyncProxiesList
+from proxy_db.exceptions import ProxyDB
+from proxy_db.proxies import STRATEGIES
+
+
+PROXY_DB_GATEWAY_RETRIES = int(os.environ.get('PROXY_DB_GATEWAY_RETRIES', 3))
+PROXY_DB_GATEWAY_TIMEOUT = float(os.environ.get('PROXY_DB_GATEWAY_TIMEOUT', 10))
+# The upstream proxies are dialled as plain HTTP proxies.
+UPSTREAM_PROTOCOLS = ('http',)
+# CONNECT response statuses of an upstream proxy that cannot reach the target.
+UPSTREAM_ERROR_STATUSES = (502, 503, 504)
+MAX_HEAD_SIZE = 65536
+BUFFER_SIZE = 65536
+
+logger = getLogger('proxy_db.gateway')
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamResponse(Exception):
+    """The upstream proxy has refused the CONNECT tunnel with a response for the client."""
+    def __init__(self, status, head, reader, writer):
+        super(UpstreamResponse, self).__init__('CONNECT response status {}'.format(status))
+        self.head = head
+        self.reader = reader
+        self.writer = writer
+
+
+def get_proxy_authorization(proxy_url):
+    url = urlparse(proxy_url)
+    if not url.username:
+        return None
+    credentials = '{}:{}'.format(url.username, url.password or '')
+    return 'Basic {}'.format(base64.b64encode(credentials.encode('utf-8')).decode('ascii'))
+
+
+def build_head(request_line, headers):
+    return '\r\n'.join([request_line] + ['{}: {}'.format(name, value) for name, value in headers] + ['', ''])\
+        .encode('latin-1')
+
+
+def parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    headers = []
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def get_body_length(headers):
+    """Length of the request body. None for chunked bodies."""
+    headers = {name.lower(): value for name, value in headers}
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        return None
+    length = int(headers.get('content-length') or 0)
+    if length < 0:
+        raise ValueError('Invalid Content-Length: {}'.format(length))
+    return length
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        close_writer(writer)
+
+
+def close_writer(writer):
+    try:
+        writer.close()
+    except (ConnectionError, RuntimeError):
+        pass
+
+
+class Gateway(object):
+    """Forward proxy using the proxies of a ProxiesList as upstream proxies. The
+    strategy is a name of proxy_db.proxies.STRATEGIES. By default the proxies are
+    used in round robin order. Only the http proxies can be used as upstream proxies.
+    """
+    def __init__(self, country=None, provider=None, protocol='http', strategy='round-robin',
+                 retries=PROXY_DB_GATEWAY_RETRIES, timeout=PROXY_DB_GATEWAY_TIMEOUT, prefetch=100):
+        if protocol is not None and protocol not in UPSTREAM_PROTOCOLS:
+            raise ProxyDB('Unsupported upstream protocol: {}. Options: {}'.format(
+                protocol, ', '.join(UPSTREAM_PROTOCOLS)))
+        self.list_options = dict(country=country, provider=provider, protocol=protocol)
+        self.strategy = strategy
+        self.retries = retries
+        self.timeout = timeout
+        self.prefetch = prefetch
+        self.proxies_list = None
+
+    def create_proxies_list(self):
+        return AsyncProxiesList(strategy=STRATEGIES[self.strategy](), prefetch=self.prefetch, **self.list_options)
+
+    async def get_upstream(self):
+        """Return the next upstream proxy. The list is created again when all the
+        proxies have been returned (strategies without repetition).
+        """
+        for new_list in (self.proxies_list is None, True):
+            if new_list:
+                if self.proxies_list is not None:
+                    await self.proxies_list.close()
+                self.proxies_list = self.create_proxies_list()
+            try:
+                return await self.proxies_list.__anext__()
+            except StopAsyncIteration:
+                pass
+        raise UpstreamError('There are no proxies available.')
+
+    async def vote_negative(self, proxy):
+        await asyncio.get_running_loop().run_in_executor(None, proxy.negative)
+
+    async def open_upstream(self, proxy, target=None):
+        """Connect to the upstream proxy. If target (host:port) is set, open a tunnel
+        to the target using CONNECT.
+        """
+        url = urlparse(str(proxy))
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(url.hostname, url.port), self.timeout)
+        if target is None:
+            return reader, writer
+        headers = [('Host', target)]
+        authorization = get_proxy_authorization(str(proxy))
+        if authorization:
+            headers.append(('Proxy-Authorization', authorization))
+        writer.write(build_head('CONNECT {} HTTP/1.1'.format(target), headers))
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+            status_line, _ = parse_head(head)
+            status = int(status_line.split()[1])
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, IndexError, ValueError):
+            close_writer(writer)
+            raise UpstreamError('Invalid CONNECT response')
+        if status in UPSTREAM_ERROR_STATUSES:
+            close_writer(writer)
+            raise UpstreamError('CONNECT response status {}'.format(status))
+        elif not 200 <= status < 300:
+            raise UpstreamResponse(status, head, reader, writer)
+        return reader, writer
+
+    async def connect_upstream(self, target=None):
+        """Open a connection to an upstream proxy. The failed upstream proxies are voted
+        negative and another upstream proxy is used (up to retries times). The CONNECT
+        responses for the client raise UpstreamResponse.
+
+        :return: (proxy, reader, writer)
+        """
+        for _ in range(self.retries):
+            proxy = await self.get_upstream()
+            if urlparse(str(proxy)).scheme not in UPSTREAM_PROTOCOLS:
+                # The proxy may work for other clients. Do not vote it.
+                logger.debug('Upstream proxy {} skipped: unsupported protocol'.format(proxy))
+                continue
+            try:
+                reader, writer = await self.open_upstream(proxy, target)
+            except (OSError, asyncio.TimeoutError, UpstreamError) as e:
+                logger.debug('Upstream proxy {} failed: {}'.format(proxy, e))
+                await self.vote_negative(proxy)
+                continue
+            return proxy, reader, writer
+        raise UpstreamError('The upstream proxies have failed.')
+
+    async def handle(self, client_reader, client_writer):
+        try:
+            await self.handle_request(client_reader, client_writer)
+        except Exception:
+            # Unexpected errors (for example, in the database). Do not leave the client waiting.
+            logger.exception('Error handling a gateway connection')
+            close_writer(client_writer)
+
+    async def handle_request(self, client_reader, client_writer):
+        try:
+            head = await asyncio.wait_for(client_reader.readuntil(b'\r\n\r\n'), self.timeout)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            close_writer(client_writer)
+            return
+        request_line, headers = parse_head(head)
+        parts = request_line.split()
+        if len(parts) != 3:
+            await self.send_error(client_writer, 400, 'Bad Request')
+            return
+        method, target, version = parts
+        connect = method.upper() == 'CONNECT'
+        try:
+            length = None if connect else get_body_length(headers)
+        except ValueError:
+            await self.send_error(client_writer, 400, 'Bad Request')
+            return
+        try:
+            proxy, reader, writer = await self.connect_upstream(target if connect else None)
+        except UpstreamError as e:
+            logger.warning('{} {}: {}'.format(method, target, e))
+            await self.send_error(client_writer, 502, 'Bad Gateway')
+            return
+        except UpstreamResponse as e:
+            logger.debug('{} {}: {}'.format(method, target, e))
+            await self.relay_response(e, client_writer)
+            return
+        if connect:
+            client_writer.write('{} 200 Connection established\r\n\r\n'.format(version).encode('latin-1'))
+            await asyncio.gather(pipe(client_reader, writer), pipe(reader, client_writer))
+            return
+        # The Proxy-* headers are for the gateway. Use the upstream credentials. Only
+        # this request is rewritten, so the connection is closed after the response.
+        headers = [(name, value) for name, value in headers
+                   if not name.lower().startswith('proxy-') and name.lower() not in ('connection', 'keep-alive')]
+        authorization = get_proxy_authorization(str(proxy))
+        if authorization:
+            headers.append(('Proxy-Authorization', authorization))
+        headers.append(('Connection', 'close'))
+        writer.write(build_head(request_line, headers))
+        await asyncio.gather(self.forward_body(client_reader, writer, length), pipe(reader, client_writer))
+        close_writer(writer)
+
+    async def forward_body(self, reader, writer, length):
+        """Forward the request body. The data after the body (other requests on a
+        keep-alive connection) is not sent to the upstream proxy. If the length is
+        None (chunked body) the data is forwarded until the client closes.
+        """
+        if length is None:
+            await pipe(reader, writer)
+            return
+        try:
+            while length > 0:
+                data = await reader.read(min(length, BUFFER_SIZE))
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+                length -= len(data)
+        except ConnectionError:
+            close_writer(writer)
+
+    async def relay_response(self, response, client_writer):
+        """Send the upstream response to the client. Without Content-Length the body
+        is forwarded until the upstream proxy closes the connection.
+        """
+        _, headers = parse_head(response.head)
+        try:
+            has_length = any(name.lower() == 'content-length' for name, _ in headers)
+            length = get_body_length(headers) if has_length else None
+        except ValueError:
+            length = None
+        client_writer.write(response.head)
+        await self.forward_body(response.reader, client_writer, length)
+        close_writer(response.writer)
+        close_writer(client_writer)
+
+    async def send_error(self, writer, status, reason):
+        body = reason.encode('latin-1')
+        writer.write(build_head('HTTP/1.1 {} {}'.format(status, reason), [
+            ('Content-Length', len(body)), ('Connection', 'close'),
+        ]) + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        close_writer(writer)
+
+    async def start(self, host='127.0.0.1', port=8080):
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_HEAD_SIZE)
+
+    async def serve_forever(self, host='127.0.0.1', port=8080):
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.proxies_list is not None:
+                await self.proxies_list.close()
@@ -0,0 +1,80 @@
+"""Proxy leases. A leased proxy is not returned to other threads or processes
+until it is released or the lease expires. The leases are stored in the database
+and acquired using atomic statements, so the processes that share the database
+never use the same proxy at the same time.
+"""
+import datetime
+import os
+import uuid
+from collections import namedtuple
+
+from sqlalchemy import exists, and_
+from sqlalchemy.exc import IntegrityError
+
+from proxy_db.models import Proxy, ProxyLease, create_session
+
+
+PROXY_DB_LEASE_TTL = float(os.environ.get('PROXY_DB_LEASE_TTL', 300))  # seconds
+
+Lease = namedtuple('Lease', ['proxy_id', 'owner', 'expires_at'])
+
+
+def not_leased(now=None):
+    """Filter for the proxies without an active lease."""
+    now = now or datetime.datetime.now()
+    return ~exists().where(and_(ProxyLease.proxy_id == Proxy.id, ProxyLease.expires_at > now))
+
+
+def acquire_lease(proxy_id, ttl=PROXY_DB_LEASE_TTL, owner=None, session=None):
+    """Lease the proxy for ttl seconds. An expired lease is reclaimed.
+
+    :return: the Lease or None if the proxy is leased by another owner.
+    :rtype: Lease
+    """
+    session = session or create_session()
+    owner = owner or uuid.uuid4().hex
+    now = datetime.datetime.now()
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    table = ProxyLease.__table__
+    values = dict(owner=owner, acquired_at=now, expires_at=expires_at)
+    result = session.execute(table.update().where(
+        table.c.proxy_id == proxy_id, table.c.expires_at <= now,
+    ).values(**values))
+    if not result.rowcount:
+        try:
+            session.execute(table.insert().values(proxy_id=proxy_id, **values))
+        except IntegrityError:
+            # Leased by another owner
+            session.rollback()
+            return None
+    session.commit()
+    return Lease(proxy_id, owner, expires_at)
+
+
+def renew_lease(lease, ttl=PROXY_DB_LEASE_TTL, session=None):
+    """Extend the lease ttl seconds from now.
+
+    :return: the new Lease or None if the lease has been lost.
+    :rtype: Lease
+    """
+    session = session or create_session()
+    expires_at = datetime.datetime.now() + datetime.timedelta(seconds=ttl)
+    table = ProxyLease.__table__
+    result = session.execute(table.update().where(
+        table.c.proxy_id == lease.proxy_id, table.c.owner == lease.owner,
+    ).values(expires_at=expires_at))
+    session.commit()
+    return lease._replace(expires_at=expires_at) if result.rowcount else None
+
+
+def release_lease(lease, session=None):
+    """Release the lease. Return False if the lease had expired and it has been
+    acquired by another owner.
+    """
+    session = session or create_session()
+    table = ProxyLease.__table__
+    result = session.execute(table.delete().where(
+        table.c.proxy_id == lease.proxy_id, table.c.owner == lease.owner,
+    ))
+    session.commit()
+    return bool(result.rowcount)
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-import string
+import asyncio
+import datetime
+import gzip
+import io
+import os
+from contextlib import contextmanager, nullcontext
 
 import click
 
@@ -7,26 +12,79 @@ from proxy_db.export import get_export_output, DEFAULT_COLUMNS
 from proxy_db.models import Proxy, create_session, ProviderRequest
 from proxy_db.providers import ManualProxy
 from proxy_db.export import get_export_output_classes
-from proxy_db._compat import urlparse, filterfalse
+from proxy_db.checks import check_proxies, get_proxies_to_check, PROXY_DB_CHECK_URL, PROXY_DB_CHECK_TIMEOUT, \
+    PROXY_DB_CHECK_WORKERS
+from proxy_db.gateway import Gateway, PROXY_DB_GATEWAY_RETRIES, PROXY_DB_GATEWAY_TIMEOUT
+from proxy_db.proxies import STRATEGIES
+from proxy_db.refresh import BackgroundRefresher, REFRESH_INTERVAL, REFRESH_MARGIN_MINUTES
+from proxy_db.server import create_server, get_server_address, ProxyDBService, PROXY_DB_SERVER_ADDRESS, \
+    PROXY_DB_SERVER_PREFETCH
+from proxy_db.votes import enable_vote_buffer, disable_vote_buffer
+from proxy_db.utils import chunks
+from proxy_db._compat import urlparse
 
 
-def proxy_is_valid(proxy):
-    return proxy.scheme and proxy.netloc
+ADD_CHUNK_SIZE = int(os.environ.get('PROXY_DB_ADD_CHUNK_SIZE', 10000))
+GZIP_MAGIC = b'\x1f\x8b'
 
 
-def strip_chars(text, remove_chars=string.whitespace):
-    length = len(text)
-    start = 0
-    end = length
-    for i, char in enumerate(text):
-        if char not in remove_chars:
-            break
-        start = i + 1
-    for i, char in enumerate(reversed(text)):
-        if char not in remove_chars:
-            break
-        end = length - i - 1
-    return text[start:end]
+@contextmanager
+def open_proxies_file(path):
+    """Text stream with the lines of the file. Use - for stdin. The gzip files
+    (by content, not by name) are decompressed. Stdin is not closed on exit.
+    """
+    stdin = click.get_binary_stream('stdin') if path == '-' else None
+    stream = stdin or open(path, 'rb')
+    buffered = stream if hasattr(stream, 'peek') else io.BufferedReader(stream)
+    decompressed = gzip.GzipFile(fileobj=buffered) if buffered.peek(2)[:2] == GZIP_MAGIC else buffered
+    lines = io.TextIOWrapper(decompressed, encoding='utf-8')
+    try:
+        yield lines
+    finally:
+        if stdin is None:
+            lines.close()
+        else:
+            # Release the streams created over stdin without closing it.
+            lines.detach()
+            if decompressed is not buffered:
+                # The file object given to GzipFile is not closed
+                decompressed.close()
+            if buffered is not stdin:
+                buffered.detach()
+
+
+def split_proxy(line):
+    """(scheme, netloc) of the proxy url. The same result as urlparse() but faster
+    for the usual <protocol>://<address> urls.
+    """
+    scheme, separator, rest = line.partition('://')
+    if not separator or not scheme.isalnum() or not scheme[0].isalpha():
+        proxy = urlparse(line)
+        return proxy.scheme, proxy.netloc
+    for char in '/?#':
+        rest = rest.split(char, 1)[0]
+    return scheme.lower(), rest
+
+
+def parse_proxies(lines):
+    """Parse the lines with proxies. The empty lines are skipped.
+
+    :return: (proxies data for bulk_add_proxies, invalid lines)
+    """
+    proxies_data = {}
+    invalid_proxies = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        elif line in proxies_data:
+            continue
+        protocol, netloc = split_proxy(line)
+        if protocol and netloc:
+            proxies_data[line] = {'protocol': protocol, 'proxy': netloc}
+        else:
+            invalid_proxies.append(line)
+    return list(proxies_data.values()), invalid_proxies
 
 
 @click.group()
@@ -35,32 +93,45 @@ def cli():
 
 
 @cli.command(name='add')
-@click.option('--file', help='Path to the file with the proxies.',
-              type=click.File('r'), required=False)
+@click.option('--file', help='Path to the file with the proxies (one per line). Use - for stdin. '
+                             'The gzip files are decompressed.',
+              type=click.Path(exists=True, dir_okay=False, allow_dash=True), required=False)
 @click.option('--votes', default=10, type=int,
               help='Default votes score. This counter sets the order in which the proxies will be obtained.')
 @click.option('--provider', default='manual', type=str,
               help='Provider name for proxies. It allows to know the origin of the proxies and search by provider.')
+@click.option('--chunk-size', default=ADD_CHUNK_SIZE, type=int,
+              help='Proxies written to the database in each transaction.')
 @click.argument('proxies', type=str, required=False, nargs=-1)
-def add_command(file=None, votes=10, provider='manual', proxies=None):
+def add_command(file=None, votes=10, provider='manual', proxies=None, chunk_size=ADD_CHUNK_SIZE):
     """Add proxies in <protocol>://<address>:<port> format or <protocol>://<username>:<password>@<address>:<port>
     format.'"""
+    if proxies == ('-',):
+        file, proxies = '-', None
     if not file and not proxies:
         click.echo('Trying to read proxies from stdin. Use Ctrl + C to cancel. '
                    'To add proxies in another way use --help.')
-        proxies = click.get_text_stream('stdin')
-    elif file:
-        proxies = file.read()
-    parsed_proxies = set([urlparse(strip_chars(proxy)) for proxy in proxies])
-    invalid_proxies = set(filterfalse(proxy_is_valid, parsed_proxies))
-    if invalid_proxies:
-        click.echo('Invalid proxies entered: {}'.format(
-            ', '.join(map(lambda x: x.geturl(), invalid_proxies))), err=True)
-    parsed_proxies -= invalid_proxies
-    proxies_data = [{'protocol': proxy.scheme, 'proxy': proxy.netloc} for proxy in parsed_proxies]
-    proxy_instances = ManualProxy(provider).add_proxies(proxies_data, votes)
-    created = filter(lambda x: x.updated_at is None, proxy_instances)
-    click.echo('Read {} proxies. {} new proxies have been created.'.format(len(parsed_proxies), len(list(created))))
+        file = '-'
+    manual_proxy = ManualProxy(provider)
+    session = create_session()
+    read = created = 0
+    try:
+        with (open_proxies_file(file) if file else nullcontext(proxies)) as lines:
+            # The proxies are read, validated and written in chunks. The duplicated
+            # proxies are only removed within each chunk.
+            for chunk in chunks(lines, chunk_size):
+                proxies_data, invalid_proxies = parse_proxies(chunk)
+                if invalid_proxies:
+                    click.echo('Invalid proxies entered: {}'.format(', '.join(invalid_proxies)), err=True)
+                if not proxies_data:
+                    continue
+                result = manual_proxy.bulk_add_proxies(proxies_data, session, votes, read + len(proxies_data))
+                read += len(result.ids)
+                created += result.created
+                click.echo('{} proxies added...'.format(read), err=True)
+    finally:
+        session.close()
+    click.echo('Read {} proxies. {} new proxies have been created.'.format(read, created))
 
 
 @cli.command(name='list')
@@ -74,7 +145,9 @@ def add_command(file=None, votes=10, provider='manual', proxies=None):
 @click.option('--country', help='2 character country code to filter. For example US.', default='')
 @click.option('--protocol', help='Proxy protocol name. Examples: http, https, socks5.', default='')
 @click.option('--provider', help='Provider name to filter.', default='')
-def list_command(format, columns, min_votes, country, protocol, provider):
+@click.option('--output', help='Write the output to this file. By default stdout.',
+              type=click.Path(dir_okay=False), default=None)
+def list_command(format, columns, min_votes, country, protocol, provider, output=None):
     """List proxies registered in proxy-db.'"""
     columns = [c.strip() for c in columns.split(',')] if columns else []
     session = create_session()
@@ -86,12 +159,112 @@ def list_command(format, columns, min_votes, country, protocol, provider):
     if protocol:
         proxies = proxies.filter(Proxy.protocol == protocol.lower())
     if provider:
-        proxies = proxies.join(Proxy.provider_requests).filter(
-            ProviderRequest.provider == provider,
-        )
-    proxies = proxies.all()
-    output = get_export_output(format, proxies, columns)
-    click.echo(output)
+        proxies = proxies.filter(Proxy.provider_requests.any(ProviderRequest.provider == provider))
+    # The output selects the columns and reads the query in chunks.
+    export_output = get_export_output(format, proxies, columns)
+    if output:
+        kwargs = {} if export_output.binary else {'encoding': 'utf-8', 'newline': ''}
+        with open(output, 'wb' if export_output.binary else 'w', **kwargs) as file:
+            export_output.write(file)
+    elif export_output.binary:
+        export_output.write(click.get_binary_stream('stdout'))
+    else:
+        for part in export_output.stream():
+            click.echo(part, nl=False)
+        click.echo()
+
+
+@cli.command(name='refresh')
+@click.option('--daemon', is_flag=True, help='Keep running and refresh the providers every interval seconds.')
+@click.option('--interval', default=REFRESH_INTERVAL, type=float,
+              help='Seconds between checks in daemon mode.')
+@click.option('--margin', default=REFRESH_MARGIN_MINUTES, type=int,
+              help='Refresh the providers that will expire in these minutes.')
+def refresh_command(daemon=False, interval=REFRESH_INTERVAL, margin=REFRESH_MARGIN_MINUTES):
+    """Refresh the providers before they expire."""
+    refresher = BackgroundRefresher(interval, margin)
+    if daemon:
+        refresher.run()
+    else:
+        results = refresher.refresh()
+        click.echo('{} provider requests refreshed.'.format(len(results)))
+
+
+@cli.command(name='check')
+@click.option('--url', default=PROXY_DB_CHECK_URL, help='Url to request through the proxies.')
+@click.option('--timeout', default=PROXY_DB_CHECK_TIMEOUT, type=float, help='Timeout in seconds of each check.')
+@click.option('--workers', default=PROXY_DB_CHECK_WORKERS, type=int, help='Proxies checked at the same time.')
+@click.option('--limit', default=None, type=int, help='Maximum number of proxies to check.')
+@click.option('--older-than', default=None, type=int,
+              help='Only check the proxies not checked in these minutes.')
+@click.option('--country', help='2 character country code to filter. For example US.', default='')
+@click.option('--protocol', help='Proxy protocol name. Examples: http, https, socks5.', default='')
+@click.option('--provider', help='Provider name to filter.', default='')
+def check_command(url, timeout, workers, limit, older_than, country, protocol, provider):
+    """Check the proxies and update their votes and latency."""
+    checked_before = None
+    if older_than is not None:
+        checked_before = datetime.datetime.now() - datetime.timedelta(minutes=older_than)
+    session = create_session()
+    proxies = get_proxies_to_check(session, country, protocol, provider, checked_before, limit)
+    results = check_proxies(proxies, url, timeout, workers, session=session)
+    successes = sum(result.success is True for result in results)
+    failures = sum(result.success is False for result in results)
+    click.echo('{} proxies checked: {} working, {} failed, {} skipped.'.format(
+        len(results), successes, failures, len(results) - successes - failures,
+    ))
+
+
+@cli.command(name='serve')
+@click.option('--address', default=PROXY_DB_SERVER_ADDRESS,
+              help='Listen address: http://<host>:<port> or unix://<socket path>.')
+@click.option('--prefetch', default=PROXY_DB_SERVER_PREFETCH, type=int,
+              help='Proxies kept in memory for each proxies list.')
+@click.option('--flush-interval', default=5, type=float, help='Seconds between votes writes.')
+@click.option('--refresh/--no-refresh', default=True,
+              help='Refresh the providers in background before they expire.')
+def serve_command(address, prefetch, flush_interval, refresh):
+    """Serve the proxies to the workers (proxy_db.client) over HTTP or a Unix socket."""
+    refresher = BackgroundRefresher() if refresh else None
+    server = create_server(address, ProxyDBService(prefetch, refresher))
+    enable_vote_buffer(flush_interval)
+    if refresher is not None:
+        refresher.start()
+    click.echo('Listening on {}'.format(get_server_address(server)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if refresher is not None:
+            refresher.stop(wait=False)
+        disable_vote_buffer()
+
+
+@cli.command(name='gateway')
+@click.option('--host', default='127.0.0.1', help='Listen host.')
+@click.option('--port', default=8080, type=int, help='Listen port.')
+@click.option('--strategy', default='round-robin', type=click.Choice(list(STRATEGIES)),
+              help='Strategy to choose the upstream proxies.')
+@click.option('--retries', default=PROXY_DB_GATEWAY_RETRIES, type=int,
+              help='Upstream proxies to try for each connection.')
+@click.option('--timeout', default=PROXY_DB_GATEWAY_TIMEOUT, type=float,
+              help='Timeout in seconds to connect to the upstream proxies.')
+@click.option('--country', help='2 character country code to filter. For example US.', default=None)
+@click.option('--protocol', help='Upstream proxies protocol. Only http is supported.', default='http')
+@click.option('--provider', help='Provider name to filter.', default=None)
+def gateway_command(host, port, strategy, retries, timeout, country, protocol, provider):
+    """Rotating HTTP/HTTPS proxy. Each connection uses an upstream proxy from proxy-db."""
+    gateway = Gateway(country, provider, protocol, strategy, retries, timeout)
+    enable_vote_buffer()
+    click.echo('Listening on http://{}:{}'.format(host, port))
+    try:
+        asyncio.run(gateway.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        disable_vote_buffer()
 
 
 if __name__ == '__main__':
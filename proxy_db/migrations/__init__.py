@@ -4,29 +4,45 @@ from proxy_db.utils import import_string
 class MigrateVersion(object):
     versions = [
         '0.3.0',
+        '0.4.0',
+        '0.5.0',
+        '0.6.0',
+        '0.7.0',
+        '0.8.0',
+        '0.9.0',
     ]
 
+    def __init__(self, session_maker=None, proxy_db_file=None, db_url=None):
+        """By default the database initialized in proxy_db.models is used."""
+        self.session_maker = session_maker
+        self.proxy_db_file = proxy_db_file
+        self.db_url = db_url
+
+    def create_session(self):
+        from proxy_db.models import create_session
+        return self.session_maker() if self.session_maker is not None else create_session()
+
     def is_last_version(self):
-        from proxy_db.models import create_session, Version
-        session = create_session()
+        from proxy_db.models import Version
+        session = self.create_session()
         version = session.query(Version).order_by(Version.id.desc()).first()
         return version.version == self.versions[-1] if version else False
 
     def pending_versions(self):
-        from proxy_db.models import create_session, Version
-        session = create_session()
+        from proxy_db.models import Version
+        session = self.create_session()
         migrated_versions = session.query(Version).order_by(Version.id.asc()).all()
         migrated_versions = set([version.version for version in migrated_versions])
         return set(self.versions) - migrated_versions
 
     def migrate_pending_versions(self):
-        for version in self.pending_versions():
+        for version in sorted(self.pending_versions(), key=self.versions.index):
             self.migrate_version(version)
 
     def create_all_versions(self):
         for version in self.versions:
             migration_cls = self.import_migration(version)
-            migration_cls().create_version_row()
+            migration_cls(self.proxy_db_file, self.db_url).create_version_row()
 
     def import_migration(self, version):
         version_alias = version.replace('.', '_')
@@ -34,4 +50,4 @@ class MigrateVersion(object):
 
     def migrate_version(self, version):
         migration_cls = self.import_migration(version)
-        migration_cls().migrate()
+        migration_cls(self.proxy_db_file, self.db_url).migrate()
@@ -0,0 +1,21 @@
+from proxy_db.migrations.migration_base import MigrateSchemaBase
+from proxy_db.models import Proxy, association_table
+
+
+class Migrate(MigrateSchemaBase):
+    """Indexes for the proxies selection query (filters by provider, country and
+    protocol sorted by votes or creation date).
+    """
+    version = '0.4.0'
+    indexes = [
+        'ix_proxy_provider_request_proxy',
+        'ix_proxy_provider_request_provider_request',
+        'ix_proxies_country_protocol_votes',
+        'ix_proxies_protocol_votes',
+        'ix_proxies_votes',
+        'ix_proxies_created_at',
+    ]
+
+    def migrate_schema(self, engine):
+        indexes = {index.name: index for table in [Proxy.__table__, association_table] for index in table.indexes}
+        self.create_indexes(engine, [indexes[name] for name in self.indexes])
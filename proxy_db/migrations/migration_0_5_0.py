@@ -0,0 +1,18 @@
+from proxy_db.migrations.migration_base import MigrateSchemaBase
+from proxy_db.models import Proxy
+
+
+class Migrate(MigrateSchemaBase):
+    """Health check columns for the proxies."""
+    version = '0.5.0'
+    columns = [
+        'checked_at',
+        'check_successes',
+        'check_failures',
+        'connect_latency',
+        'latency',
+        'latency_ewma',
+    ]
+
+    def migrate_schema(self, engine):
+        self.add_columns(engine, [Proxy.__table__.c[name] for name in self.columns])
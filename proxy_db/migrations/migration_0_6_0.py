@@ -0,0 +1,16 @@
+from proxy_db.migrations.migration_base import MigrateSchemaBase
+from proxy_db.models import Proxy
+
+
+class Migrate(MigrateSchemaBase):
+    """Indexes for the proxies selection sorted by latency (FastestListingStrategy)."""
+    version = '0.6.0'
+    indexes = [
+        'ix_proxies_country_protocol_latency',
+        'ix_proxies_protocol_latency',
+        'ix_proxies_latency',
+    ]
+
+    def migrate_schema(self, engine):
+        indexes = {index.name: index for index in Proxy.__table__.indexes}
+        self.create_indexes(engine, [indexes[name] for name in self.indexes])
@@ -0,0 +1,10 @@
+from proxy_db.migrations.migration_base import MigrateSchemaBase
+from proxy_db.models import ProxyLease
+
+
+class Migrate(MigrateSchemaBase):
+    """Proxy leases table."""
+    version = '0.7.0'
+
+    def migrate_schema(self, engine):
+        self.create_tables(engine, [ProxyLease.__table__])
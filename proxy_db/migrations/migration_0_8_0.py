@@ -0,0 +1,13 @@
+from proxy_db.migrations.migration_base import MigrateSchemaBase
+from proxy_db.models import ProviderRequest
+
+
+class Migrate(MigrateSchemaBase):
+    """Download time of the provider requests."""
+    version = '0.8.0'
+    columns = [
+        'fetch_seconds',
+    ]
+
+    def migrate_schema(self, engine):
+        self.add_columns(engine, [ProviderRequest.__table__.c[name] for name in self.columns])
@@ -1,8 +1,9 @@
 import shutil
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 
+from proxy_db import models
 from proxy_db.models import PROXY_DB_FILE, PROXY_DB_DB_URL, Base, Version
 
 
@@ -10,8 +11,9 @@ class MigrateBase(object):
     tables = []
     version = None
 
-    def __init__(self, proxy_db_file=None):
-        self.proxy_db_file = proxy_db_file or PROXY_DB_FILE
+    def __init__(self, proxy_db_file=None, db_url=None):
+        self.proxy_db_file = proxy_db_file or models.db_file or PROXY_DB_FILE
+        self.db_url = db_url or models.db_url or PROXY_DB_DB_URL
 
     def get_backup_path_file(self):
         return '{}.bak'.format(self.proxy_db_file)
@@ -20,12 +22,12 @@ class MigrateBase(object):
         shutil.move(self.proxy_db_file, self.get_backup_path_file())
 
     def create_new_database(self):
-        engine = create_engine(PROXY_DB_DB_URL)
+        engine = create_engine(self.db_url)
         Base.metadata.create_all(engine)
         return sessionmaker(bind=engine)()
 
     def get_backup_database(self):
-        url = '{}.bak'.format(PROXY_DB_DB_URL)
+        url = '{}.bak'.format(self.db_url)
         engine = create_engine(url)
         return sessionmaker(bind=engine)()
 
@@ -50,3 +52,40 @@ class MigrateBase(object):
         self.create_backup_file()
         self.migrate_data()
         self.create_version_row()
+
+
+class MigrateSchemaBase(MigrateBase):
+    """Migrate the database schema in place, without the backup and copy of the
+    data used by MigrateBase.
+    """
+    def migrate_schema(self, engine):
+        raise NotImplementedError
+
+    def create_indexes(self, engine, indexes):
+        for index in indexes:
+            existing = {existing['name'] for existing in inspect(engine).get_indexes(index.table.name)}
+            if index.name not in existing:
+                index.create(engine)
+
+    def create_tables(self, engine, tables):
+        for table in tables:
+            table.create(engine, checkfirst=True)
+
+    def add_columns(self, engine, columns):
+        for column in columns:
+            existing = {existing['name'] for existing in inspect(engine).get_columns(column.table.name)}
+            if column.name in existing:
+                continue
+            sql = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                column.table.name, column.name, column.type.compile(engine.dialect),
+            )
+            if column.server_default is not None:
+                sql += ' DEFAULT {}'.format(column.server_default.arg)
+            with engine.begin() as connection:
+                connection.execute(text(sql))
+
+    def migrate(self):
+        engine = create_engine(self.db_url)
+        self.migrate_schema(engine)
+        engine.dispose()
+        self.create_version_row()
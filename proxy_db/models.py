@@ -1,6 +1,10 @@
 import os
+import threading
+
 from sqlalchemy import create_engine, Integer, Column, String, Sequence, DateTime, func, Table, ForeignKey, \
-    UniqueConstraint
+    UniqueConstraint, inspect, event, Index, Float
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from proxy_db._compat import urlparse
@@ -8,6 +12,14 @@ from proxy_db._compat import urlparse
 
 PROXY_DB_FILE = os.environ.get('PROXY_DB_FILE', os.path.expanduser('~/.local/var/lib/proxy-db/db.sqlite3'))
 PROXY_DB_DB_URL = os.environ.get('PROXY_DB_DB_URL', 'sqlite:///{}'.format(PROXY_DB_FILE))
+PROXY_DB_POOL_SIZE = int(os.environ.get('PROXY_DB_POOL_SIZE', 5))
+PROXY_DB_POOL_MAX_OVERFLOW = int(os.environ.get('PROXY_DB_POOL_MAX_OVERFLOW', 10))
+# Sqlite performance profile. Use an empty value to keep the sqlite default.
+PROXY_DB_SQLITE_JOURNAL_MODE = os.environ.get('PROXY_DB_SQLITE_JOURNAL_MODE', 'WAL')
+PROXY_DB_SQLITE_SYNCHRONOUS = os.environ.get('PROXY_DB_SQLITE_SYNCHRONOUS', 'NORMAL')
+PROXY_DB_SQLITE_BUSY_TIMEOUT = os.environ.get('PROXY_DB_SQLITE_BUSY_TIMEOUT', '30000')  # milliseconds
+PROXY_DB_SQLITE_MMAP_SIZE = os.environ.get('PROXY_DB_SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))  # bytes
+PROXY_DB_SQLITE_CACHE_SIZE = os.environ.get('PROXY_DB_SQLITE_CACHE_SIZE', '-16000')  # negative: KiB
 PROTOCOLS = ['http', 'https']
 
 
@@ -15,10 +27,37 @@ Base = declarative_base()
 
 association_table = Table('proxy_provider_request', Base.metadata,
                           Column('proxy_id', String(255), ForeignKey('proxies.id')),
-                          Column('provider_request_id', Integer, ForeignKey('provider_requests.id'))
+                          Column('provider_request_id', Integer, ForeignKey('provider_requests.id')),
+                          Index('ix_proxy_provider_request_proxy', 'proxy_id', 'provider_request_id'),
+                          Index('ix_proxy_provider_request_provider_request', 'provider_request_id', 'proxy_id'),
                           )
 
 
+_provider_instances = {}
+
+
+def get_provider_instance(name):
+    """Provider instance by name. The names that are not in PROVIDERS are manual
+    providers. The instances are created once per name.
+    """
+    provider = _provider_instances.get(name)
+    if provider is None:
+        from proxy_db.providers import PROVIDERS, ManualProxy
+        provider = next(filter(lambda x: x.name == name, PROVIDERS), None) or ManualProxy(name)
+        provider = _provider_instances.setdefault(name, provider)
+    return provider
+
+
+def get_proxy_with_credentials(proxy_id, credentials):
+    if credentials:
+        url_result = urlparse(proxy_id)
+        return '{url_result.scheme}://{username}:{password}@{url_result.netloc}'.format(
+            username=credentials[0], password=credentials[1],
+            url_result=url_result
+        )
+    return proxy_id
+
+
 class ModelMixin:
     def get_param(self, name):
         param_parts = name.split('__', 1)
@@ -43,19 +82,27 @@ class ProviderRequest(ModelMixin, Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     results = Column(Integer)
+    fetch_seconds = Column(Float)
     proxies = relationship("Proxy", secondary=association_table, backref="provider_requests")
 
     def get_provider_instance(self):
-        from proxy_db.providers import PROVIDERS, ManualProxy
-        provider = next(filter(lambda x: x.name == self.provider, PROVIDERS), None)
-        if provider is None:
-            return ManualProxy(self.provider)
-        return provider
+        return get_provider_instance(self.provider)
 
 
 class Proxy(ModelMixin, Base):
     __tablename__ = 'proxies'
+    __table_args__ = (Index('ix_proxies_country_protocol_votes', 'country', 'protocol', 'votes', 'id'),
+                      Index('ix_proxies_country_votes', 'country', 'votes', 'id'),
+                      Index('ix_proxies_protocol_votes', 'protocol', 'votes', 'id'),
+                      Index('ix_proxies_votes', 'votes', 'id'),
+                      Index('ix_proxies_created_at', 'created_at', 'id'),
+                      Index('ix_proxies_country_protocol_latency', 'country', 'protocol', 'latency_ewma', 'id'),
+                      Index('ix_proxies_country_latency', 'country', 'latency_ewma', 'id'),
+                      Index('ix_proxies_protocol_latency', 'protocol', 'latency_ewma', 'id'),
+                      Index('ix_proxies_latency', 'latency_ewma', 'id'),
+                      )
     _proxies_list = None
+    lease = None
 
     id = Column(String(255), primary_key=True)
     votes = Column(Integer, default=0)
@@ -64,6 +111,13 @@ class Proxy(ModelMixin, Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     on_provider_at = Column(DateTime(timezone=True))
+    # Health checks (proxy_db.checks). Latencies in seconds.
+    checked_at = Column(DateTime(timezone=True))
+    check_successes = Column(Integer, default=0, server_default='0')
+    check_failures = Column(Integer, default=0, server_default='0')
+    connect_latency = Column(Float)
+    latency = Column(Float)
+    latency_ewma = Column(Float)
     providers = {}
     credentials = ()
 
@@ -77,10 +131,8 @@ class Proxy(ModelMixin, Base):
         return session.query(Proxy).filter_by(id=self.id).first()
 
     def vote(self, vote):
-        session = create_session()
-        instance = self.get_updated_proxy(session)
-        instance.votes += vote
-        session.commit()
+        from proxy_db.votes import add_vote
+        add_vote(self.id, vote)
 
     def positive(self):
         self.vote(1)
@@ -108,29 +160,44 @@ class Proxy(ModelMixin, Base):
     def copy(self):
         return {key: str(self) for key in PROTOCOLS}
 
-    def _set_providers(self):
-        provider_instances = map(lambda x: x.get_provider_instance(), self.provider_requests)
-        credential_provider = next(filter(lambda x: x.has_credentials(), provider_instances), None)
-        if credential_provider:
-            self.credentials = credential_provider.credentials()
+    def _set_providers(self, credentials_cache=None):
+        """Set the providers names and the credentials of the first provider with
+        credentials. Use the same credentials_cache dict for a batch of proxies to
+        resolve the credentials once per provider name.
+        """
+        credentials_cache = {} if credentials_cache is None else credentials_cache
+        for provider_request in self.provider_requests:
+            if provider_request.provider not in credentials_cache:
+                credentials_cache[provider_request.provider] = \
+                    provider_request.get_provider_instance().credentials()
+            if credentials_cache[provider_request.provider]:
+                self.credentials = credentials_cache[provider_request.provider]
+                break
         self.providers = {proxy.provider for proxy in self.provider_requests}
 
     def __repr__(self):
         return "<Proxy {} ({})>".format(self, ','.join(self.providers))
 
     def proxy_with_credentials(self):
-        if self.credentials:
-            url_result = urlparse(self.id)
-            return '{url_result.scheme}://{username}:{password}@{url_result.netloc}'.format(
-                username=self.credentials[0], password=self.credentials[1],
-                url_result=url_result
-            )
-        return self.id
+        return get_proxy_with_credentials(self.id, self.credentials)
 
     def __str__(self):
         return self.proxy_with_credentials()
 
 
+class ProxyLease(Base):
+    """A proxy in use by an owner until expires_at (see proxy_db.leases)."""
+    __tablename__ = 'proxy_leases'
+
+    proxy_id = Column(String(255), ForeignKey('proxies.id'), primary_key=True)
+    owner = Column(String(64))
+    acquired_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True), index=True)
+
+    def __repr__(self):
+        return "<ProxyLease {} ({})>".format(self.proxy_id, self.owner)
+
+
 class Version(Base):
     __tablename__ = 'versions'
     _proxies_list = None
@@ -146,31 +213,102 @@ class Version(Base):
         return self.version
 
 
-proxy_db_dir = os.path.dirname(PROXY_DB_FILE)
-if not os.path.lexists(proxy_db_dir):
-    os.makedirs(proxy_db_dir)
-
-db_created = not os.path.lexists(PROXY_DB_FILE)
-engine = create_engine(PROXY_DB_DB_URL,
-                       connect_args={'check_same_thread': False} if PROXY_DB_DB_URL.startswith('sqlite://') else {})
-Base.metadata.create_all(engine)
+engine = None
+session_maker = None
+db_url = None
+db_file = None
+_init_lock = threading.RLock()
+
+
+def get_sqlite_file(url):
+    """Return the database file path for sqlite urls or None."""
+    url = make_url(url)
+    if not url.drivername.startswith('sqlite') or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+
+def get_sqlite_pragmas():
+    pragmas = [
+        ('journal_mode', PROXY_DB_SQLITE_JOURNAL_MODE),
+        ('synchronous', PROXY_DB_SQLITE_SYNCHRONOUS),
+        ('busy_timeout', PROXY_DB_SQLITE_BUSY_TIMEOUT),
+        ('mmap_size', PROXY_DB_SQLITE_MMAP_SIZE),
+        ('cache_size', PROXY_DB_SQLITE_CACHE_SIZE),
+    ]
+    return [(name, value) for name, value in pragmas if value]
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in get_sqlite_pragmas():
+        cursor.execute('PRAGMA {}={}'.format(name, value))
+    cursor.close()
+
+
+def create_db_engine(url):
+    """Create the engine. Sqlite engines can be shared between threads and use the
+    sqlite performance profile (PROXY_DB_SQLITE_* environment variables).
+    """
+    if not url.startswith('sqlite'):
+        return create_engine(url)
+    if get_sqlite_file(url):
+        options = dict(poolclass=QueuePool, pool_size=PROXY_DB_POOL_SIZE, max_overflow=PROXY_DB_POOL_MAX_OVERFLOW)
+    else:
+        # In memory database. All the threads must use the same connection.
+        options = dict(poolclass=StaticPool)
+    new_engine = create_engine(url, connect_args={'check_same_thread': False}, **options)
+    event.listen(new_engine, 'connect', set_sqlite_pragmas)
+    return new_engine
+
+
+def init(url=None):
+    """Create the database engine, create the missing tables and apply the pending
+    migrations. By default the PROXY_DB_DB_URL url is used. This function is called
+    on the first use of the database, it is only necessary to call it to change the url.
+    """
+    global engine, session_maker, db_url, db_file
+    from proxy_db.migrations import MigrateVersion
+    with _init_lock:
+        new_db_url = url or PROXY_DB_DB_URL
+        new_db_file = get_sqlite_file(new_db_url)
+        if new_db_file and not os.path.lexists(os.path.dirname(os.path.abspath(new_db_file))):
+            os.makedirs(os.path.dirname(os.path.abspath(new_db_file)))
+        new_engine = create_db_engine(new_db_url)
+        db_created = Proxy.__tablename__ not in inspect(new_engine).get_table_names()
+        Base.metadata.create_all(new_engine)
+        new_session_maker = sessionmaker(bind=new_engine)
+        migrate_version = MigrateVersion(new_session_maker, new_db_file, new_db_url)
+        if db_created:
+            migrate_version.create_all_versions()
+        elif migrate_version.pending_versions():
+            # Migrations can replace the database file. Close the connections
+            # (and checkpoint the WAL file) before and after migrating.
+            new_engine.dispose()
+            migrate_version.migrate_pending_versions()
+            new_engine.dispose()
+        # The database is ready. Other threads can use it now.
+        engine, session_maker, db_url, db_file = new_engine, new_session_maker, new_db_url, new_db_file
+    return new_engine
+
+
+def get_engine():
+    with _init_lock:
+        if engine is None:
+            init()
+        return engine
 
 
 def create_session_maker():
-    return sessionmaker(bind=engine)
+    return sessionmaker(bind=get_engine())
 
 
-session_maker = create_session_maker()
+def get_session_maker():
+    with _init_lock:
+        if session_maker is None:
+            init()
+        return session_maker
 
 
 def create_session():
-    return session_maker()
-
-
-from proxy_db.migrations import MigrateVersion
-
-
-if db_created:
-    MigrateVersion().create_all_versions()
-else:
-    MigrateVersion().migrate_pending_versions()
+    return get_session_maker()()
@@ -8,16 +8,22 @@ import copy
 import datetime
 import os
 import re
+import threading
+import time
+from collections import namedtuple, OrderedDict
 from logging import getLogger
 
 import requests
 from bs4 import BeautifulSoup
 from requests import RequestException
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam
+from urllib3.util.retry import Retry
 
-from proxy_db.countries import ip_country, COUNTRIES
+from proxy_db.countries import ip_country, ip_country_available, COUNTRIES
 from proxy_db.db import get_or_create
-from proxy_db.models import create_session, Proxy, ProviderRequest
-from proxy_db.utils import get_domain
+from proxy_db.models import create_session, Proxy, ProviderRequest, association_table
+from proxy_db.utils import get_domain, chunks
 
 try:
     import lxml
@@ -27,16 +33,29 @@ else:
     lxml_available = True
 
 PROVIDER_REQUIRES_UPDATE_MINUTES = 45
+PROVIDER_REQUEST_TIMEOUT = float(os.environ.get('PROXY_DB_PROVIDER_TIMEOUT', 30))  # read timeout
+PROVIDER_CONNECT_TIMEOUT = float(os.environ.get('PROXY_DB_PROVIDER_CONNECT_TIMEOUT', 10))
+PROVIDER_RETRIES = int(os.environ.get('PROXY_DB_PROVIDER_RETRIES', 3))
+PROVIDER_RETRY_BACKOFF = float(os.environ.get('PROXY_DB_PROVIDER_RETRY_BACKOFF', 0.5))
+PROVIDER_RETRY_STATUSES = (429, 500, 502, 503, 504)
+PROVIDER_POOL_SIZE = 10
 SIMPLE_IP_PATTERN = re.compile('(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
 IP_PORT_PATTERN_GLOBAL = re.compile(
     r'(?P<ip>(?:(?:25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(?:25[0-5]|2[0-4]\d|[01]?\d\d?))'  # noqa
     r'(?=.*?(?:(?:(?:(?:25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(?:25[0-5]|2[0-4]\d|[01]?\d\d?))|(?P<port>\d{2,5})))',  # noqa
     flags=re.DOTALL)
 UPDATE_VOTES = 3
+BULK_CHUNK_SIZE = 500
+
+
+IngestResult = namedtuple('IngestResult', ['ids', 'created', 'updated'])
 
 
 class ProviderRequestBase(object):
     headers = {'user-agent': 'Mozilla/5.0 (Windows NT x.y; Win64; x64; rv:10.0) Gecko/20100101 Firefox/10.0'}
+    timeout = PROVIDER_REQUEST_TIMEOUT
+    connect_timeout = PROVIDER_CONNECT_TIMEOUT
+    fetch_seconds = None
 
     def __init__(self, provider, url, method='GET', data=None, headers=None, options=None):
         self.provider = provider
@@ -47,7 +66,18 @@ class ProviderRequestBase(object):
         self.options = options or {}
 
     def make_request(self):
-        return requests.request(self.method, self.url)
+        """Request the provider page using the provider http session. The time of the
+        request (including the retries) is saved in fetch_seconds.
+        """
+        start = time.monotonic()
+        try:
+            return self.provider.get_http_session().request(
+                self.method, self.url, headers=self.headers, data=self.data,
+                timeout=(self.connect_timeout, self.timeout),
+            )
+        finally:
+            self.fetch_seconds = time.monotonic() - start
+            self.provider.logger.debug('Request to {} in {:.3f}s'.format(self.url, self.fetch_seconds))
 
     def now(self):
         session = create_session()
@@ -56,8 +86,8 @@ class ProviderRequestBase(object):
         except RequestException:
             self.provider.logger.exception('Error on request to {}'.format(self.url))
             return
-        proxies = self.provider.process_page(response, session)
-        self.add_proxies(proxies, session)
+        proxies = self.provider.find_page_proxies(response)
+        return self.bulk_add_proxies(proxies, session)
 
     def add_proxies(self, proxies, session=None):
         session = session or create_session()
@@ -66,11 +96,32 @@ class ProviderRequestBase(object):
             provider_request.proxies.append(proxy)
         session.commit()
 
-    def requires_update(self):
+    def bulk_add_proxies(self, proxies, session=None, update_votes=UPDATE_VOTES, results=None):
+        """Insert or update the proxies (dicts returned by find_page_proxies) and link
+        them to this provider request using a few queries per chunk of proxies. By
+        default the provider request results are the number of proxies.
+
+        :rtype: IngestResult
+        """
+        session = session or create_session()
+        results = len(proxies) if results is None else results
+        provider_request, exists = self.get_or_create(session, {'results': results})
+        if exists:
+            provider_request.results = results
+            provider_request.updated_at = datetime.datetime.now()
+        if self.fetch_seconds is not None:
+            provider_request.fetch_seconds = self.fetch_seconds
+        session.flush()
+        result = self.provider.bulk_process_proxies(proxies, session, update_votes, provider_request)
+        session.commit()
+        return result
+
+    def requires_update(self, margin_minutes=0):
+        """The provider request has expired or it will expire in margin_minutes."""
         instance, exists = self.get_or_create()
         return not exists or \
                datetime.datetime.now() > \
-               instance.updated_at + datetime.timedelta(minutes=PROVIDER_REQUIRES_UPDATE_MINUTES)
+               instance.updated_at + datetime.timedelta(minutes=PROVIDER_REQUIRES_UPDATE_MINUTES - margin_minutes)
 
     def get_or_create(self, session=None, update_defaults=None):
         session = session or create_session()
@@ -112,10 +163,39 @@ class ProviderCredentialMixin:
 class Provider(object):
     name = 'Provider'
     base_url = None
+    retries = PROVIDER_RETRIES
+    retry_backoff = PROVIDER_RETRY_BACKOFF
+    pool_size = PROVIDER_POOL_SIZE
 
     def __init__(self, base_url=None):
         self.base_url = base_url or self.base_url
         self.logger = getLogger('proxy_db.providers.{}'.format(self.lowercase_name()))
+        self.http_session = None
+        self._http_session_lock = threading.Lock()
+
+    def create_http_session(self):
+        """Create the requests session used for the provider requests. The connections
+        are reused (keep-alive) and the connection errors and transient error statuses
+        are retried with backoff. Only the idempotent methods are retried (urllib3
+        defaults), so the POST requests are not sent twice. Override it to customize
+        the transport.
+
+        :rtype: requests.Session
+        """
+        retry = Retry(total=self.retries, backoff_factor=self.retry_backoff, status_forcelist=PROVIDER_RETRY_STATUSES,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        http_session = requests.Session()
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+        return http_session
+
+    def get_http_session(self):
+        if self.http_session is None:
+            with self._http_session_lock:
+                if self.http_session is None:
+                    self.http_session = self.create_http_session()
+        return self.http_session
 
     def is_available(self):
         return True
@@ -153,6 +233,66 @@ class Provider(object):
         session.commit()
         return proxy_instances
 
+    def bulk_process_proxies(self, proxies, session=None, update_votes=UPDATE_VOTES, provider_request=None):
+        """Bulk version of process_proxies. The proxies are deduplicated and processed in
+        chunks: one query to find the existing proxies, one insert for the new ones, one
+        update for the votes and one insert for the missing provider request links.
+        The session is not committed.
+
+        :rtype: IngestResult
+        """
+        session = session or create_session()
+        rows = OrderedDict()
+        for proxy in proxies:
+            protocol = proxy.get('protocol', 'http')
+            proxy_id = '{}://{}'.format(protocol, proxy['proxy'])
+            rows.setdefault(proxy_id, dict(proxy, protocol=protocol))
+        created = updated = 0
+        for chunk in chunks(rows.keys(), BULK_CHUNK_SIZE):
+            existing = dict(session.query(Proxy.id, Proxy.country).filter(Proxy.id.in_(chunk)))
+            new_proxies = [
+                {'id': proxy_id, 'votes': update_votes, 'protocol': rows[proxy_id]['protocol'],
+                 'country': self.detect_country(proxy_id, rows[proxy_id])}
+                for proxy_id in chunk if proxy_id not in existing
+            ]
+            if new_proxies:
+                session.execute(Proxy.__table__.insert(), new_proxies)
+            if existing:
+                self.bulk_update_proxies(session, existing, rows, update_votes)
+            if provider_request is not None:
+                self.bulk_link_proxies(session, chunk, provider_request)
+            created += len(new_proxies)
+            updated += len(existing)
+        return IngestResult(list(rows.keys()), created, updated)
+
+    def bulk_update_proxies(self, session, existing, rows, update_votes):
+        table = Proxy.__table__
+        session.execute(table.update().where(table.c.id.in_(list(existing))).values(
+            votes=table.c.votes + update_votes,
+        ))
+        countries = [{'b_id': proxy_id, 'b_country': self.detect_country(proxy_id, rows[proxy_id])}
+                     for proxy_id, country in existing.items() if not country]
+        if countries:
+            session.execute(table.update().where(table.c.id == bindparam('b_id')).values(
+                country=bindparam('b_country'),
+            ), countries)
+
+    def bulk_link_proxies(self, session, proxy_ids, provider_request):
+        linked = session.query(association_table.c.proxy_id).filter(
+            association_table.c.provider_request_id == provider_request.id,
+            association_table.c.proxy_id.in_(proxy_ids),
+        )
+        linked = {proxy_id for proxy_id, in linked}
+        links = [{'proxy_id': proxy_id, 'provider_request_id': provider_request.id}
+                 for proxy_id in proxy_ids if proxy_id not in linked]
+        if links:
+            session.execute(association_table.insert(), links)
+
+    def detect_country(self, proxy_id, proxy):
+        # Avoid parsing the proxy url if the geoip database is not available.
+        country = ip_country(get_domain(proxy_id)) if ip_country_available() else ''
+        return country or proxy.get('country_code') or ''
+
     def get_provider_request(self, url, country, protocol):
         return ProviderRequestBase(self, url, options={'country': country, 'protocol': protocol})
 
@@ -267,7 +407,7 @@ class ManualProxyRequest(ProviderRequestBase):
     def now(self):
         pass
 
-    def requires_update(self):
+    def requires_update(self, margin_minutes=0):
         return False
 
 
@@ -294,6 +434,13 @@ class ManualProxy(ProviderCredentialMixin, Provider):
         self.get_provider_request(None, None, None).add_proxies(proxy_instances, session)
         return proxy_instances
 
+    def bulk_add_proxies(self, proxies, session=None, update_votes=UPDATE_VOTES, results=None):
+        """Bulk version of add_proxies. Same arguments as ProviderRequestBase.bulk_add_proxies.
+
+        :rtype: IngestResult
+        """
+        return self.get_provider_request(None, None, None).bulk_add_proxies(proxies, session, update_votes, results)
+
 
 PROVIDERS = [
     NordVpn(),
@@ -1,9 +1,21 @@
+import datetime
+import random
+import threading
+import time
+from collections import deque
+
 import six
-from sqlalchemy import exists, func
+from sqlalchemy import exists, func, or_, and_, tuple_, type_coerce, Column, String
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import QueryableAttribute
+from sqlalchemy.sql import operators
 
-from proxy_db.exceptions import NoProvidersAvailable, UnsupportedEngine
+from proxy_db.exceptions import NoProvidersAvailable, UnsupportedEngine, NoProxiesAvailable
+from proxy_db.leases import PROXY_DB_LEASE_TTL, not_leased, acquire_lease, release_lease, renew_lease
 from proxy_db.models import Proxy, ProviderRequest, create_session
 from proxy_db.providers import PROVIDERS, ManualProxy
+from proxy_db.refresh import refresh_provider_requests
+from proxy_db.utils import AliasTable
 
 
 class NONE:
@@ -11,11 +23,20 @@ class NONE:
 
 
 class ListingStrategy(object):
+    # Minimum number of proxies read per query when the proxies already returned are
+    # skipped, instead of one query per proxy.
+    page_size = 100
+    # Seconds between the scans from the start of the list to find new proxies, or
+    # proxies whose position has changed, before the cursor.
+    rescan_seconds = 30
+
     def __init__(self, filters=None, order_by=None, no_repeat=True):
         self.filters = filters
         self.order_by = order_by
         self.no_repeat = no_repeat
         self._proxies = set()
+        self._cursor = None
+        self._scanned_at = None
 
     def get_default_filters(self):
         return []
@@ -26,27 +47,112 @@ class ListingStrategy(object):
         else:
             return Proxy.created_at.desc()
 
-    def get_filters(self, query):
+    def get_keyset_columns(self, query):
+        """Return the (column, descending) pairs used to sort the proxies, using the
+        proxy id to break ties. The id is sorted in the same direction, so an index on
+        (column, id) can be used. Return None if the order cannot be used as a keyset
+        cursor (for example a random order).
+        """
+        order_by = self.get_order_by(query)
+        descending = False
+        if getattr(order_by, 'modifier', None) in (operators.desc_op, operators.asc_op):
+            descending = order_by.modifier is operators.desc_op
+            order_by = order_by.element
+        if not isinstance(order_by, (QueryableAttribute, Column)):
+            return None
+        return [(order_by, descending), (Proxy.id, descending)]
+
+    def get_keyset_filter(self, query, keyset_columns):
+        """Filter to return the proxies sorted after the cursor (the last proxy seen).
+        A row value comparison is used if the engine supports it: the OR version is
+        not used as a range of the index by sqlite when the values are parameters.
+        """
+        (column, descending), (id_column, _) = keyset_columns
+        value, proxy_id = self._cursor
+        engine_name = query.session.get_bind().name
+        if engine_name == 'sqlite' and isinstance(value, datetime.datetime):
+            # The server default dates are stored without microseconds (CURRENT_TIMESTAMP).
+            column, value = type_coerce(column, String), str(value)
+        if engine_name in ['sqlite', 'postgresql', 'mysql']:
+            columns, values = tuple_(column, id_column), tuple_(value, proxy_id)
+            return columns < values if descending else columns > values
+        if descending:
+            return or_(column < value, and_(column == value, id_column < proxy_id))
+        return or_(column > value, and_(column == value, id_column > proxy_id))
+
+    def get_filters(self, query, keyset_columns=None):
         filters = list(self.filters or [])
         filters.extend(self.get_default_filters())
-        if self.no_repeat:
+        if self.no_repeat and keyset_columns is not None and self._cursor is not None:
+            filters.append(self.get_keyset_filter(query, keyset_columns))
+        elif self.no_repeat and keyset_columns is None and self._proxies:
             filters.append(~Proxy.id.in_(self._returned_proxies()))
         return filters
 
     def _returned_proxies(self):
-        return [proxy.id for proxy in self._proxies]
+        return list(self._proxies)
 
-    def get_query(self, query):
-        return query.filter(*self.get_filters(query)).order_by(self.get_order_by(query))
+    def get_query(self, query, keyset_columns=None):
+        if keyset_columns is None:
+            order_by = [self.get_order_by(query)]
+        else:
+            order_by = [column.desc() if descending else column.asc() for column, descending in keyset_columns]
+        return query.filter(*self.get_filters(query, keyset_columns)).order_by(*order_by)
 
     def next(self, query):
-        query = self.get_query(query)
-        proxy = query.first()
-        if proxy is not None and self.no_repeat:
-            self._proxies.add(proxy)
-        if proxy is not None:
-            proxy._set_providers()
-        return proxy
+        proxies = self.next_many(query, 1)
+        return proxies[0] if proxies else None
+
+    def rescan(self):
+        """Scan again from the start of the list on the next call, without waiting
+        rescan_seconds. Used after adding new proxies.
+        """
+        self._scanned_at = None
+
+    def requires_rescan(self):
+        return self._scanned_at is None or time.time() - self._scanned_at >= self.rescan_seconds
+
+    def next_many(self, query, limit):
+        if self._cursor is None:
+            self._scanned_at = time.time()
+        proxies = self._next_many(query, limit)
+        if len(proxies) < limit and self._cursor is not None and self.requires_rescan():
+            # Nothing left after the cursor. Start again to find new proxies or
+            # proxies whose position has changed (the returned ones are skipped).
+            # The cursor is kept where this scan stops.
+            self._cursor = None
+            self._scanned_at = time.time()
+            proxies.extend(self._next_many(query, limit - len(proxies)))
+        return proxies
+
+    def _next_many(self, query, limit):
+        keyset_columns = self.get_keyset_columns(query) if self.no_repeat else None
+        proxies = []
+        credentials_cache = {}
+        page_limit = limit
+        while len(proxies) < limit:
+            page = list(self.get_query(query, keyset_columns).limit(page_limit))
+            skipped = False
+            for proxy in page:
+                if len(proxies) >= limit:
+                    # The cursor is the last proxy used. The rest of the page is read again.
+                    break
+                if keyset_columns is not None:
+                    self._cursor = (getattr(proxy, keyset_columns[0][0].key), proxy.id)
+                if proxy.id in self._proxies or proxy in proxies:
+                    # Already returned, or a join in the query has returned the
+                    # same proxy twice.
+                    skipped = True
+                    continue
+                if self.no_repeat:
+                    self._proxies.add(proxy.id)
+                proxy._set_providers(credentials_cache)
+                proxies.append(proxy)
+            if len(page) < page_limit or keyset_columns is None:
+                break
+            # Read bigger pages while the proxies already returned are skipped.
+            page_limit = max(limit - len(proxies), self.page_size if skipped else 0)
+        return proxies
 
 
 class VotesListingStrategy(ListingStrategy):
@@ -58,9 +164,45 @@ class VotesListingStrategy(ListingStrategy):
         return [Proxy.votes >= self.min_votes]
 
 
+class FastestListingStrategy(ListingStrategy):
+    """Return the proxies with the lowest response latency first (moving average of
+    the health checks latencies, see proxy_db.checks). Only the checked proxies are
+    returned. ``min_success_rate`` (0-1) is the minimum ratio of successful checks and
+    ``max_latency`` the maximum average latency in seconds.
+    """
+    def __init__(self, filters=None, min_success_rate=None, max_latency=None, min_votes=None):
+        super().__init__(filters, Proxy.latency_ewma.asc())
+        self.min_success_rate = min_success_rate
+        self.max_latency = max_latency
+        self.min_votes = min_votes
+
+    def get_default_filters(self):
+        filters = [Proxy.latency_ewma.isnot(None)]
+        if self.max_latency is not None:
+            filters.append(Proxy.latency_ewma <= self.max_latency)
+        if self.min_success_rate is not None:
+            checks = Proxy.check_successes + Proxy.check_failures
+            filters.append(Proxy.check_successes >= checks * self.min_success_rate)
+        if self.min_votes is not None:
+            filters.append(Proxy.votes >= self.min_votes)
+        return filters
+
+
 class RandomListingStrategy(ListingStrategy):
-    def __init__(self, filters=None):
-        super().__init__(filters, None)
+    """Return the proxies in random order. The ids of the candidate proxies are loaded
+    once and shuffled in memory, so the cost of each proxy does not depend on the number
+    of proxies. The proxies created after loading the ids are added every
+    ``refresh_seconds`` seconds. The ids are loaded again only if the query changes or
+    after rescan() (new proxies in the pool).
+    """
+    def __init__(self, filters=None, no_repeat=True, refresh_seconds=30):
+        super().__init__(filters, None, no_repeat)
+        self.refresh_seconds = refresh_seconds
+        self._ids = []
+        self._known_ids = set()
+        self._ids_key = None
+        self._ids_created_at = None
+        self._ids_refreshed_at = 0
 
     def get_order_by(self, query):
         engine_name = query.session.get_bind().name
@@ -75,9 +217,320 @@ class RandomListingStrategy(ListingStrategy):
                 '{engine_name} engine does not support random ordering.'.format(**locals())
             )
 
+    def get_filters(self, query, keyset_columns=None):
+        # The returned proxies are removed from the ids list.
+        filters = list(self.filters or [])
+        filters.extend(self.get_default_filters())
+        return filters
+
+    def get_ids_query(self, query):
+        return query.filter(*self.get_filters(query)).with_entities(Proxy.id, Proxy.created_at)
+
+    def add_ids(self, rows):
+        new_ids = []
+        for proxy_id, created_at in rows:
+            if created_at is not None and (self._ids_created_at is None or created_at > self._ids_created_at):
+                self._ids_created_at = created_at
+            if proxy_id in self._known_ids:
+                continue
+            self._known_ids.add(proxy_id)
+            if not self.no_repeat or proxy_id not in self._proxies:
+                new_ids.append(proxy_id)
+        if len(new_ids) > len(self._ids):
+            self._ids.extend(new_ids)
+            random.shuffle(self._ids)
+            return
+        for proxy_id in new_ids:
+            # Insert in a random position
+            self._ids.insert(random.randint(0, len(self._ids)), proxy_id)
+
+    def load_ids(self, query):
+        self._ids = []
+        self._known_ids = set()
+        self._ids_created_at = None
+        self._ids_refreshed_at = time.time()
+        self.add_ids(self.get_ids_query(query))
+
+    def refresh_ids(self, query):
+        self._ids_refreshed_at = time.time()
+        ids_query = self.get_ids_query(query)
+        if self._ids_created_at is not None:
+            # Margin for databases that store the dates without microseconds (sqlite)
+            ids_query = ids_query.filter(Proxy.created_at >= self._ids_created_at - datetime.timedelta(seconds=1))
+        self.add_ids(ids_query)
+
+    def get_ids_key(self, query):
+        compiled = query.statement.compile()
+        return str(compiled), repr(sorted(compiled.params.items()))
+
+    def restart_ids(self):
+        """Return again the proxies already returned (no_repeat disabled) using the
+        cached ids.
+        """
+        self._ids = list(self._known_ids)
+        random.shuffle(self._ids)
+
+    def rescan(self):
+        super().rescan()
+        self._ids_key = None
+
+    def next_many(self, query, limit):
+        ids_key = self.get_ids_key(query)
+        if ids_key != self._ids_key:
+            self._ids_key = ids_key
+            self.load_ids(query)
+        elif time.time() - self._ids_refreshed_at > self.refresh_seconds:
+            self.refresh_ids(query)
+        if not self._ids and not self.no_repeat:
+            self.restart_ids()
+        proxies = []
+        while self._ids and len(proxies) < limit:
+            ids = [self._ids.pop() for _ in range(min(limit - len(proxies), len(self._ids)))]
+            proxies.extend(self.get_proxies(query, ids))
+        return proxies
+
+    def get_proxies(self, query, ids):
+        """Return the proxies with the ids in the same order. The proxies can be changed
+        after loading the ids, so the filters are used again.
+        """
+        found = {proxy.id: proxy for proxy in query.filter(*self.get_filters(query)).filter(Proxy.id.in_(ids))}
+        proxies = []
+        credentials_cache = {}
+        for proxy_id in filter(lambda x: x in found, ids):
+            proxy = found[proxy_id]
+            if self.no_repeat:
+                self._proxies.add(proxy.id)
+            proxy._set_providers(credentials_cache)
+            proxies.append(proxy)
+        return proxies
+
+
+class WeightedRandomListingStrategy(RandomListingStrategy):
+    """Return random proxies with a probability proportional to ``weight(votes)``.
+    By default the weight is the number of positive votes plus one.
+
+    The proxies are chosen in O(1) using an alias table built from the candidate
+    proxies. Every ``refresh_seconds`` the total votes and the number of candidates
+    are checked and the table is rebuilt if the votes have changed more than
+    ``rebuild_threshold`` (ratio) or the candidates have changed. Unlike the other
+    strategies, by default the same proxy can be returned several times.
+    """
+    def __init__(self, filters=None, no_repeat=False, weight=None, refresh_seconds=30,
+                 rebuild_threshold=0.1, max_rejections=10):
+        super().__init__(filters, no_repeat, refresh_seconds)
+        self.weight = weight or (lambda votes: max(votes or 0, 0) + 1)
+        self.rebuild_threshold = rebuild_threshold
+        self.max_rejections = max_rejections
+        self._table = None
+        self._table_ids = []
+        self._table_totals = None
+
+    def get_totals_query(self, query):
+        return query.filter(*self.get_filters(query)).with_entities(func.count(Proxy.id), func.sum(Proxy.votes))
+
+    def build_table(self, query):
+        self._ids_refreshed_at = time.time()
+        rows = query.filter(*self.get_filters(query)).with_entities(Proxy.id, Proxy.votes)
+        candidates = {}
+        count = votes = 0
+        for proxy_id, proxy_votes in rows:
+            count += 1
+            votes += proxy_votes or 0
+            if not self.no_repeat or proxy_id not in self._proxies:
+                candidates[proxy_id] = self.weight(proxy_votes)
+        self._table_ids = [proxy_id for proxy_id, weight in candidates.items() if weight > 0]
+        self._table = AliasTable([candidates[proxy_id] for proxy_id in self._table_ids])
+        self._table_totals = (count, votes)
+
+    def requires_rebuild(self, query):
+        self._ids_refreshed_at = time.time()
+        count, votes = self.get_totals_query(query).one()
+        table_count, table_votes = self._table_totals
+        return count != table_count or \
+            abs((votes or 0) - table_votes) > self.rebuild_threshold * max(abs(table_votes), table_count, 1)
+
+    def update_table(self, query):
+        ids_key = self.get_ids_key(query)
+        if ids_key != self._ids_key or self._table is None:
+            self._ids_key = ids_key
+            self.build_table(query)
+        elif time.time() - self._ids_refreshed_at > self.refresh_seconds and self.requires_rebuild(query):
+            self.build_table(query)
+
+    def sample_ids(self, limit, exclude):
+        ids = []
+        rejections = 0
+        while len(ids) < limit and rejections <= self.max_rejections and len(self._table):
+            proxy_id = self._table_ids[self._table.choice()]
+            if proxy_id in ids or proxy_id in exclude or (self.no_repeat and proxy_id in self._proxies):
+                rejections += 1
+                continue
+            ids.append(proxy_id)
+        return ids
+
+    def next_many(self, query, limit):
+        self.update_table(query)
+        proxies = []
+        for rebuilt in (False, True):
+            ids = self.sample_ids(limit - len(proxies), {proxy.id for proxy in proxies})
+            found = self.get_proxies(query, ids)
+            proxies.extend(found)
+            if rebuilt or len(proxies) >= limit or (len(found) == len(ids) and not self.no_repeat):
+                break
+            # Proxies changed since the table was built or too many proxies
+            # already returned. Rebuild the table.
+            self.build_table(query)
+        return proxies
+
+
+class RoundRobinListingStrategy(ListingStrategy):
+    """Walk all the proxies in a stable order (by default votes and id) and start again
+    at the end. The proxies are read in pages using keyset pagination, so the cost of
+    each page does not depend on the position in the list.
+    """
+    def __init__(self, filters=None, order_by=None, page_size=50):
+        super().__init__(filters, Proxy.votes.desc() if order_by is None else order_by, no_repeat=False)
+        self.page_size = page_size
+        self._page = deque()
+
+    def get_filters(self, query, keyset_columns=None):
+        filters = list(self.filters or [])
+        filters.extend(self.get_default_filters())
+        if keyset_columns is not None and self._cursor is not None:
+            filters.append(self.get_keyset_filter(query, keyset_columns))
+        return filters
+
+    def fetch_page(self, query):
+        keyset_columns = self.get_keyset_columns(query)
+        if keyset_columns is None:
+            raise ValueError('RoundRobinListingStrategy requires a column in order_by.')
+        page = []
+        for proxy in self.get_query(query, keyset_columns).limit(self.page_size):
+            if not page or page[-1] is not proxy:
+                # A join in the query can return the same proxy twice
+                page.append(proxy)
+        if page:
+            self._cursor = (getattr(page[-1], keyset_columns[0][0].key), page[-1].id)
+        return page
+
+    def next_many(self, query, limit):
+        proxies = []
+        proxy_ids = set()
+        credentials_cache = {}
+        wrapped = False
+        while len(proxies) < limit:
+            if not self._page:
+                page = self.fetch_page(query)
+                if not page and self._cursor is not None and not wrapped:
+                    # End of the list. Start again.
+                    self._cursor = None
+                    wrapped = True
+                    continue
+                elif not page:
+                    break
+                self._page.extend(page)
+            if self._page[0].id in proxy_ids:
+                # There are less proxies than the limit. The proxies in the page
+                # can be instances of a previous session: compare the ids.
+                break
+            proxy = self._page.popleft()
+            proxy._set_providers(credentials_cache)
+            proxies.append(proxy)
+            proxy_ids.add(proxy.id)
+        return proxies
+
+
+STRATEGIES = {
+    'votes': VotesListingStrategy,
+    'newest': ListingStrategy,
+    'random': RandomListingStrategy,
+    'weighted-random': WeightedRandomListingStrategy,
+    'round-robin': RoundRobinListingStrategy,
+    'fastest': FastestListingStrategy,
+}
+
+
+class ProxyPrefetcher(object):
+    """In-memory buffer of candidate proxies. The buffer is filled using batches of
+    ``size`` proxies and it is refilled in a background thread when the number of
+    buffered proxies drops to ``watermark``.
+    """
+    def __init__(self, fetch, size, watermark=None):
+        self.fetch = fetch
+        self.size = size
+        self.watermark = size // 4 if watermark is None else watermark
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._exhausted = False
+
+    def refill(self):
+        with self._lock:
+            limit = self.size - len(self._buffer)
+            proxies = self.fetch(limit)
+            self._exhausted = len(proxies) < limit
+            self._buffer.extend(proxies)
+
+    def _background_refill(self):
+        try:
+            self.refill()
+        except Exception:
+            # The next synchronous refill will raise the error to the consumer.
+            self._exhausted = True
+
+    def refill_background(self):
+        if self._exhausted or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._background_refill)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self):
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def pop(self):
+        if not self._buffer:
+            self.wait()
+        if not self._buffer:
+            self.refill()
+        try:
+            proxy = self._buffer.popleft()
+        except IndexError:
+            return None
+        if len(self._buffer) <= self.watermark:
+            self.refill_background()
+        return proxy
+
+    def pop_many(self, limit):
+        self.wait()
+        proxies = []
+        while self._buffer and len(proxies) < limit:
+            proxies.append(self._buffer.popleft())
+        if len(proxies) < limit:
+            with self._lock:
+                proxies.extend(self.fetch(limit - len(proxies)))
+        if len(self._buffer) <= self.watermark:
+            self.refill_background()
+        return proxies
+
+    def reset(self):
+        """Wait for the refill in progress and refill again after reaching the end of
+        the proxies. The buffered proxies are kept: the strategy has already returned them.
+        """
+        self.wait()
+        self._exhausted = False
+
+    def __len__(self):
+        return len(self._buffer)
+
 
 class ProxiesList(object):
-    def __init__(self, country=None, provider=None, protocol=None, strategy=None):
+    lease_candidates = 10
+
+    def __init__(self, country=None, provider=None, protocol=None, strategy=None,
+                 prefetch=None, prefetch_watermark=None, parallel_refresh=False, refresher=None):
         if isinstance(country, six.string_types):
             country = country.upper()
         self.request_options = dict(
@@ -98,6 +551,14 @@ class ProxiesList(object):
             # Is a class without initialize. Instance now.
             strategy = strategy()
         self.strategy = strategy or VotesListingStrategy()
+        self.parallel_refresh = parallel_refresh
+        self.refresher = refresher
+        if refresher is not None:
+            for available_provider in self.available_providers():
+                refresher.watch(available_provider, **self.request_options)
+        self.prefetcher = None
+        if prefetch:
+            self.prefetcher = ProxyPrefetcher(self.find_db_proxies, prefetch, prefetch_watermark)
 
     def available_providers(self):
         providers = PROVIDERS
@@ -105,17 +566,128 @@ class ProxiesList(object):
             providers = [self.provider]
         return filter(lambda x: x.is_available(), providers)
 
-    def find_db_proxy(self):
-        query = create_session().query(Proxy).join(Proxy.provider_requests).filter(
+    def get_db_query(self):
+        # The provider requests are loaded using one query for all the proxies. The
+        # providers are filtered using EXISTS, so the proxies indexes can be used for
+        # the order.
+        query = create_session().query(Proxy).options(selectinload(Proxy.provider_requests))
+        query = query.filter(Proxy.provider_requests.any(
             ProviderRequest.provider.in_([x.name for x in self.available_providers()]),
-        )
+        ))
         country = self.request_options['country']
         protocol = self.request_options['protocol']
         if country:
             query = query.filter(Proxy.country == country)
         if protocol:
             query = query.filter(Proxy.protocol == protocol)
-        return self.strategy.next(query)
+        return query
+
+    def find_db_proxy(self):
+        if self.prefetcher is not None:
+            return self.prefetcher.pop()
+        proxies = self.find_db_proxies(1)
+        return proxies[0] if proxies else None
+
+    def find_db_proxies(self, limit):
+        query = self.get_db_query()
+        try:
+            return self.strategy.next_many(query, limit)
+        finally:
+            # Return the connection to the pool. The proxies are already loaded.
+            query.session.close()
+
+    def pop_db_proxies(self, limit):
+        """Return up to limit proxies from the database, using the prefetch buffer
+        if it is enabled.
+
+        :rtype: list
+        """
+        if self.prefetcher is not None:
+            return self.prefetcher.pop_many(limit)
+        return self.find_db_proxies(limit)
+
+    def take(self, limit):
+        """Return up to limit proxies using a single query. If there are not enough
+        proxies the providers are reloaded once.
+
+        :rtype: list
+        """
+        proxies = self.pop_db_proxies(limit)
+        if len(proxies) < limit and self.requires_reload():
+            self.reload_provider_without_error()
+            proxies.extend(self.pop_db_proxies(limit - len(proxies)))
+        return proxies
+
+    get_many = take
+
+    def has_db_proxies(self):
+        """There are proxies in the database for the filters (returned or not)."""
+        query = self.get_db_query()
+        try:
+            return query.with_entities(Proxy.id).first() is not None
+        finally:
+            query.session.close()
+
+    def requires_reload(self):
+        """With a background refresher the providers are only reloaded if there are
+        no proxies for the filters."""
+        return self.refresher is None or not self.has_db_proxies()
+
+    def find_lease_candidates(self, exclude=()):
+        """Proxies without an active lease sorted using the strategy order. The
+        no repeat option of the strategy is not used: the released proxies can
+        be leased again.
+        """
+        query = self.get_db_query()
+        order_by = self.strategy.get_order_by(query)
+        query = query.filter(*(self.strategy.filters or [])).filter(*self.strategy.get_default_filters())
+        query = query.filter(not_leased())
+        if exclude:
+            query = query.filter(~Proxy.id.in_(list(exclude)))
+        try:
+            return list(query.order_by(order_by).limit(self.lease_candidates))
+        finally:
+            query.session.close()
+
+    def acquire(self, ttl=PROXY_DB_LEASE_TTL, retry=True):
+        """Return a proxy not used by other threads or processes until it is released
+        using release() or ttl seconds have passed. The lease is in proxy.lease.
+
+        :rtype: Proxy
+        """
+        tried = set()
+        candidates = self.find_lease_candidates()
+        while candidates:
+            for proxy in candidates:
+                tried.add(proxy.id)
+                lease = acquire_lease(proxy.id, ttl)
+                if lease is not None:
+                    proxy.lease = lease
+                    proxy._set_providers()
+                    return proxy
+            candidates = self.find_lease_candidates(tried)
+        if retry and self.requires_reload():
+            self.reload_provider_without_error()
+            return self.acquire(ttl, retry=False)
+        raise NoProxiesAvailable('There are no proxies available to lease.')
+
+    def renew(self, proxy, ttl=PROXY_DB_LEASE_TTL):
+        """Extend the lease of the proxy. Return False if the lease has been lost."""
+        proxy.lease = renew_lease(proxy.lease, ttl) if proxy.lease else None
+        return proxy.lease is not None
+
+    def release(self, proxy, success=None):
+        """Release the lease of the proxy. The proxy is voted positive or negative
+        if success is True or False. Return False if the lease had expired and
+        it was leased by another owner.
+        """
+        released = release_lease(proxy.lease) if proxy.lease else False
+        proxy.lease = None
+        if success is True:
+            proxy.positive()
+        elif success is False:
+            proxy.negative()
+        return released
 
     def find_provider(self):
         for provider in self.available_providers():
@@ -124,9 +696,35 @@ class ProxiesList(object):
                 return provider
         raise NoProvidersAvailable
 
+    def find_provider_requests(self):
+        """Return the provider requests that require an update for all the available providers."""
+        provider_requests = [provider.request(**self.request_options) for provider in self.available_providers()]
+        return [provider_request for provider_request in provider_requests if provider_request.requires_update()]
+
     def reload_provider(self):
+        if self.parallel_refresh:
+            return self.reload_providers()
         provider = self.find_provider()
         provider.request(**self.request_options).now()
+        self.rescan()
+
+    def reload_providers(self, timeout=None):
+        """Reload concurrently all the providers that require an update."""
+        provider_requests = self.find_provider_requests()
+        if not provider_requests:
+            raise NoProvidersAvailable
+        refresh_provider_requests(provider_requests, timeout=timeout)
+        self.rescan()
+
+    def rescan(self):
+        """Look for the new proxies after adding proxies. The strategy scans again from
+        the start and the prefetcher, stopped after reaching the end of the proxies, is
+        reset.
+        """
+        if self.prefetcher is not None:
+            # The strategy is not thread safe. Wait for the background refill first.
+            self.prefetcher.reset()
+        self.strategy.rescan()
 
     def reload_provider_without_error(self):
         try:
@@ -142,8 +740,10 @@ class ProxiesList(object):
         proxy = self.find_db_proxy()
         if proxy:
             return proxy
-        elif retry:
+        elif retry and self.requires_reload():
             self.reload_provider_without_error()
+        elif retry:
+            retry = False
         if retry:
             return self.try_get_proxy(retry=False)
         else:
@@ -0,0 +1,121 @@
+"""Refresh the providers concurrently."""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from logging import getLogger
+
+PROXY_DB_REFRESH_WORKERS = int(os.environ.get('PROXY_DB_REFRESH_WORKERS', 8))
+REFRESH_INTERVAL = 60
+REFRESH_MARGIN_MINUTES = 10
+
+logger = getLogger('proxy_db.refresh')
+
+
+def refresh_provider_requests(provider_requests, max_workers=PROXY_DB_REFRESH_WORKERS, timeout=None):
+    """Download the provider requests concurrently using a thread pool. Each provider
+    request adds its proxies to the database as soon as it is downloaded. Each download
+    uses the timeout of its provider request, ``timeout`` limits the total time.
+
+    :return: dict with the IngestResult (or None if it fails) by provider request.
+    """
+    provider_requests = list(provider_requests)
+    results = {}
+    if not provider_requests:
+        return results
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(provider_requests)))
+    futures = {executor.submit(provider_request.now): provider_request for provider_request in provider_requests}
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            provider_request = futures[future]
+            try:
+                results[provider_request] = future.result()
+            except Exception:
+                logger.exception('Error refreshing {}'.format(provider_request.url))
+                results[provider_request] = None
+    except TimeoutError:
+        logger.warning('Timeout refreshing the providers. {} of {} completed.'.format(
+            len(results), len(provider_requests),
+        ))
+    finally:
+        executor.shutdown(wait=False)
+    return results
+
+
+class BackgroundRefresher(object):
+    """Refresh the provider requests in a background thread before they expire
+    (margin_minutes before). The refresher checks the watched provider requests
+    every interval seconds: the (provider, country, protocol) requests used by the
+    proxies lists with this refresher, the requests already in the database and the
+    default request of each available provider.
+    """
+    def __init__(self, interval=REFRESH_INTERVAL, margin_minutes=REFRESH_MARGIN_MINUTES,
+                 max_workers=PROXY_DB_REFRESH_WORKERS, providers=None):
+        self.interval = interval
+        self.margin_minutes = margin_minutes
+        self.max_workers = max_workers
+        self.providers = providers
+        self._watched = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_providers(self):
+        from proxy_db.providers import PROVIDERS
+        return [provider for provider in (self.providers or PROVIDERS) if provider.is_available()]
+
+    def watch(self, provider, country=None, protocol=None):
+        with self._lock:
+            self._watched.add((provider, country, protocol))
+
+    def get_db_options(self):
+        """Return the (provider name, country, protocol) of the provider requests in the database."""
+        from proxy_db.models import create_session, ProviderRequest
+        session = create_session()
+        try:
+            rows = session.query(ProviderRequest.provider, ProviderRequest.request_id).all()
+        finally:
+            session.close()
+        for provider_name, request_id in rows:
+            options = [None if option == 'None' else option for option in (request_id or '').split('-', 1)]
+            if len(options) == 2:
+                yield (provider_name,) + tuple(options)
+
+    def get_provider_requests(self):
+        providers = {provider.name: provider for provider in self.get_providers()}
+        with self._lock:
+            watched = set(self._watched)
+        watched.update((provider, None, None) for provider in providers.values())
+        watched.update((providers[name], country, protocol) for name, country, protocol in self.get_db_options()
+                       if name in providers)
+        return [provider.request(country=country, protocol=protocol) for provider, country, protocol in watched]
+
+    def get_expiring_requests(self):
+        return [provider_request for provider_request in self.get_provider_requests()
+                if provider_request.requires_update(self.margin_minutes)]
+
+    def refresh(self):
+        return refresh_provider_requests(self.get_expiring_requests(), self.max_workers)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Error refreshing the providers')
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='proxy-db-refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
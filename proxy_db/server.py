@@ -0,0 +1,174 @@
+"""proxy-db daemon. The daemon owns the database and serves the proxies to the
+workers (proxy_db.client) over local HTTP or a Unix socket. The proxies lists are
+kept in memory (with prefetch) and shared by all the clients, and the votes are
+written in batches using the votes buffer.
+
+All the calls are ``POST /<method>`` with a JSON body: next, take, acquire,
+release and vote.
+"""
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging import getLogger
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from proxy_db._compat import urlparse
+from proxy_db.client import PROXY_DB_SERVER_ADDRESS
+from proxy_db.exceptions import ProxyDB, NoProxiesAvailable
+from proxy_db.leases import PROXY_DB_LEASE_TTL, Lease, release_lease
+from proxy_db.proxies import ProxiesList, STRATEGIES
+from proxy_db.votes import add_vote
+
+
+PROXY_DB_SERVER_PREFETCH = int(os.environ.get('PROXY_DB_SERVER_PREFETCH', 100))
+LIST_OPTIONS = ('country', 'provider', 'protocol', 'strategy')
+
+logger = getLogger('proxy_db.server')
+
+
+def proxy_to_dict(proxy):
+    data = {
+        'id': proxy.id,
+        'url': str(proxy),
+        'country': proxy.country,
+        'protocol': proxy.protocol,
+        'votes': proxy.votes,
+        'providers': sorted(proxy.providers),
+    }
+    if proxy.lease is not None:
+        data['lease'] = {'owner': proxy.lease.owner, 'expires_at': proxy.lease.expires_at.isoformat()}
+    return data
+
+
+class ProxyDBService(object):
+    """The daemon methods. One proxies list is shared by the calls with the same
+    options (country, provider, protocol and strategy name).
+    """
+    def __init__(self, prefetch=PROXY_DB_SERVER_PREFETCH, refresher=None):
+        self.prefetch = prefetch
+        self.refresher = refresher
+        self.lists = {}
+        self._lock = threading.Lock()
+
+    def create_proxies_list(self, country=None, provider=None, protocol=None, strategy=None):
+        if strategy is not None and strategy not in STRATEGIES:
+            raise ProxyDB('Invalid strategy: {}. Options: {}'.format(strategy, ', '.join(STRATEGIES)))
+        strategy = STRATEGIES[strategy]() if strategy else None
+        return ProxiesList(country, provider, protocol, strategy, prefetch=self.prefetch, refresher=self.refresher)
+
+    def get_proxies_list(self, options, new=False):
+        """Return the (lock, proxies list) for the options. Use new to replace the list."""
+        key = tuple(options.get(name) or None for name in LIST_OPTIONS)
+        with self._lock:
+            if new or key not in self.lists:
+                self.lists[key] = (threading.Lock(), self.create_proxies_list(*key))
+            return self.lists[key]
+
+    def next(self, options):
+        lock, proxies_list = self.get_proxies_list(options)
+        with lock:
+            try:
+                return proxy_to_dict(next(proxies_list))
+            except StopIteration:
+                pass
+        # All the proxies of the list have been returned. Start again.
+        lock, proxies_list = self.get_proxies_list(options, new=True)
+        with lock:
+            try:
+                return proxy_to_dict(proxies_list.try_get_proxy(retry=False))
+            except StopIteration:
+                raise NoProxiesAvailable('There are no proxies available.')
+
+    def take(self, options):
+        lock, proxies_list = self.get_proxies_list(options)
+        with lock:
+            return [proxy_to_dict(proxy) for proxy in proxies_list.take(int(options.get('n', 1)))]
+
+    def acquire(self, options):
+        # Leases are safe between threads. The strategy is only used to sort.
+        lock, proxies_list = self.get_proxies_list(options)
+        return proxy_to_dict(proxies_list.acquire(float(options.get('ttl') or PROXY_DB_LEASE_TTL)))
+
+    def release(self, options):
+        released = release_lease(Lease(options['proxy'], options['owner'], None))
+        self.vote({'proxy': options['proxy'], 'vote': {True: 1, False: -1}.get(options.get('success'), 0)})
+        return released
+
+    def vote(self, options):
+        if options.get('vote'):
+            add_vote(options['proxy'], int(options['vote']))
+        return True
+
+
+class ProxyDBRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    methods = ('next', 'take', 'acquire', 'release', 'vote')
+
+    def do_POST(self):
+        method = self.path.strip('/')
+        try:
+            options = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or '{}')
+        except ValueError:
+            return self.send_json(400, {'error': 'Invalid JSON body.'})
+        if method not in self.methods:
+            return self.send_json(404, {'error': 'Unknown method: {}'.format(method)})
+        try:
+            result = getattr(self.server.service, method)(options)
+        except NoProxiesAvailable as e:
+            return self.send_json(404, {'error': str(e), 'type': 'NoProxiesAvailable'})
+        except (ProxyDB, KeyError, ValueError, TypeError) as e:
+            return self.send_json(400, {'error': '{}: {}'.format(e.__class__.__name__, e)})
+        except Exception as e:
+            logger.exception('Error on {} call'.format(method))
+            return self.send_json(500, {'error': str(e)})
+        self.send_json(200, {'result': result})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+
+
+def create_server(address=PROXY_DB_SERVER_ADDRESS, service=None):
+    """Create the daemon server. The address can be ``http://<host>:<port>`` or
+    ``unix://<socket path>``. Use serve_forever() to start it.
+    """
+    url = urlparse(address)
+    if url.scheme == 'unix':
+        server = ThreadingUnixHTTPServer(url.path, ProxyDBRequestHandler)
+    elif url.scheme == 'http':
+        server = ThreadingHTTPServer((url.hostname or '127.0.0.1', url.port or 8765), ProxyDBRequestHandler)
+    else:
+        raise ProxyDB('Invalid server address: {}'.format(address))
+    server.service = service or ProxyDBService()
+    return server
+
+
+def get_server_address(server):
+    if server.address_family == getattr(socket, 'AF_UNIX', None):
+        return 'unix://{}'.format(server.server_address)
+    return 'http://{}:{}'.format(*server.server_address[:2])
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
+import random
 from importlib import import_module
+from itertools import islice
 from six import raise_from
 
 from proxy_db._compat import urlparse
@@ -10,6 +12,44 @@ def get_domain(address):
     return netloc.split('@')[-1].split(':')[0]
 
 
+def chunks(iterable, size):
+    """Split the iterable in lists with a maximum length of size."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class AliasTable(object):
+    """Walker's alias method. Choose an index with probability proportional to its
+    weight in O(1). The table is built in O(n).
+    """
+    def __init__(self, weights):
+        weights = list(weights)
+        total = float(sum(weights))
+        size = len(weights)
+        self.probabilities = [weight * size / total for weight in weights] if total > 0 else []
+        self.aliases = list(range(len(self.probabilities)))
+        small = [i for i, probability in enumerate(self.probabilities) if probability < 1]
+        large = [i for i, probability in enumerate(self.probabilities) if probability >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.aliases[less] = more
+            self.probabilities[more] += self.probabilities[less] - 1
+            (small if self.probabilities[more] < 1 else large).append(more)
+        for i in small + large:
+            self.probabilities[i] = 1
+
+    def choice(self):
+        i = random.randrange(len(self.probabilities))
+        return i if random.random() < self.probabilities[i] else self.aliases[i]
+
+    def __len__(self):
+        return len(self.probabilities)
+
+
 def import_string(dotted_path):
     """
     Import a dotted module path and return the attribute/class designated by the
@@ -0,0 +1,125 @@
+"""Proxy votes. The votes are added to the database using atomic updates
+(``votes = votes + delta``). Optionally the votes can be accumulated in memory
+and written in a single transaction (write-behind) using a VoteBuffer.
+"""
+import atexit
+import os
+import threading
+from collections import defaultdict
+from logging import getLogger
+
+from sqlalchemy import bindparam
+
+from proxy_db.models import Proxy, create_session
+
+
+PROXY_DB_VOTES_FLUSH_INTERVAL = float(os.environ.get('PROXY_DB_VOTES_FLUSH_INTERVAL', 0))
+PROXY_DB_VOTES_FLUSH_SIZE = int(os.environ.get('PROXY_DB_VOTES_FLUSH_SIZE', 1000))
+
+vote_buffer = None
+logger = getLogger('proxy_db.votes')
+
+
+def apply_votes(votes, session=None):
+    """Add the votes deltas ({proxy_id: delta}) in one transaction."""
+    votes = [{'b_id': proxy_id, 'b_delta': delta} for proxy_id, delta in votes.items() if delta]
+    if not votes:
+        return
+    session = session or create_session()
+    table = Proxy.__table__
+    session.execute(table.update().where(table.c.id == bindparam('b_id')).values(
+        votes=table.c.votes + bindparam('b_delta'),
+    ), votes)
+    session.commit()
+
+
+class VoteBuffer(object):
+    """Accumulate the votes per proxy in memory. The votes are written to the
+    database every flush_interval seconds, or when there are max_size proxies
+    with pending votes.
+    """
+    def __init__(self, flush_interval=PROXY_DB_VOTES_FLUSH_INTERVAL or 5, max_size=PROXY_DB_VOTES_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._votes = defaultdict(int)
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, proxy_id, vote):
+        with self._lock:
+            self._votes[proxy_id] += vote
+            size = len(self._votes)
+        if size >= self.max_size:
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.flush_interval, self._timer_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            votes, self._votes = self._votes, defaultdict(int)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        try:
+            apply_votes(votes)
+        except Exception:
+            # Keep the votes to retry on the next flush.
+            with self._lock:
+                for proxy_id, delta in votes.items():
+                    self._votes[proxy_id] += delta
+            raise
+
+    def _timer_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Error writing the votes to the database')
+        finally:
+            # The votes are kept on error. Retry on the next interval.
+            if len(self):
+                self._schedule_flush()
+
+    def __len__(self):
+        return len(self._votes)
+
+
+def get_vote_buffer():
+    return vote_buffer
+
+
+def enable_vote_buffer(flush_interval=PROXY_DB_VOTES_FLUSH_INTERVAL or 5, max_size=PROXY_DB_VOTES_FLUSH_SIZE):
+    """Accumulate the votes in memory. The pending votes are flushed at exit."""
+    global vote_buffer
+    disable_vote_buffer()
+    vote_buffer = VoteBuffer(flush_interval, max_size)
+    atexit.register(vote_buffer.flush)
+    return vote_buffer
+
+
+def disable_vote_buffer():
+    """Flush the pending votes and write the next votes immediately."""
+    global vote_buffer
+    if vote_buffer is None:
+        return
+    atexit.unregister(vote_buffer.flush)
+    vote_buffer.flush()
+    vote_buffer = None
+
+
+def add_vote(proxy_id, vote):
+    if vote_buffer is not None:
+        vote_buffer.add(proxy_id, vote)
+    else:
+        apply_votes({proxy_id: vote})
+
+
+if PROXY_DB_VOTES_FLUSH_INTERVAL:
+    enable_vote_buffer()
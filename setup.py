@@ -138,6 +138,8 @@ setup(
     install_requires=read_requirement_file(REQUIREMENT_FILE),
     extras_require={
         'geoip': ["geoip2", 'geoip2-tools'],
+        'async': ['aiohttp'],
+        'arrow': ['pyarrow'],
     },
 
 # entry_points={},
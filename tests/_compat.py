@@ -1,5 +1,5 @@
 
 try:
-    from mock import patch, Mock, mock_open, call
+    from mock import patch, Mock, mock_open, call, ANY
 except ImportError:
-    from unittest.mock import patch, Mock, mock_open, call
+    from unittest.mock import patch, Mock, mock_open, call, ANY
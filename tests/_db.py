@@ -0,0 +1,26 @@
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from proxy_db.models import Base
+
+
+class DatabaseMixin(object):
+    """In-memory sqlite database with the tables created. The engine and an open
+    session are in self.engine and self.session.
+    """
+    def setUp(self):
+        super(DatabaseMixin, self).setUp()
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.addCleanup(self.engine.dispose)
+        self.addCleanup(self.session.close)
+
+
+def temporary_directory(test_case):
+    """Create a temporary directory removed after the test."""
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    return directory.name
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import unittest
+import warnings
+
+import requests_mock
+
+from proxy_db.aio import AsyncProxiesList, fetch_provider_request
+from proxy_db.exceptions import NoProvidersAvailable
+from proxy_db.providers import Provider, ProviderRequestBase, ManualProxy
+from ._compat import patch, Mock, ANY
+
+URL = 'https://domain.com/'
+
+
+class TestFetchProviderRequest(unittest.TestCase):
+    @patch('proxy_db.aio.aiohttp', None)
+    @patch('proxy_db.providers.ProviderRequestBase.bulk_add_proxies')
+    def test_fetch(self, m):
+        provider_request = ProviderRequestBase(Provider(URL), URL)
+        with requests_mock.Mocker() as session_mock:
+            session_mock.get(URL, text='Proxy: 12.131.91.51:8888')
+            result = asyncio.run(fetch_provider_request(provider_request))
+        self.assertEqual(result, m.return_value)
+        m.assert_called_once_with([{'proxy': ('12.131.91.51', '8888')}])
+
+    @patch('proxy_db.aio._fetch_provider_request')
+    def test_shared_fetch(self, m):
+        async def fetch(provider_request):
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def fetch_all():
+            provider_request = ProviderRequestBase(Provider(URL), URL)
+            return await asyncio.gather(*[fetch_provider_request(provider_request) for _ in range(5)])
+
+        m.side_effect = fetch
+        self.assertEqual(asyncio.run(fetch_all()), ['result'] * 5)
+        m.assert_called_once()
+
+    @patch('proxy_db.aio._fetch_provider_request')
+    def test_manual_provider(self, m):
+        provider_request = ManualProxy('manual').request()
+        self.assertIsNone(asyncio.run(fetch_provider_request(provider_request)))
+        m.assert_not_called()
+
+
+class TestAsyncProxiesList(unittest.TestCase):
+    @patch('proxy_db.aio.fetch_provider_request')
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxy', side_effect=['proxy1', None, 'proxy2', None, None])
+    @patch('proxy_db.proxies.ProxiesList.find_provider')
+    def test_async_iter(self, m1, m2, m3):
+        async def get_proxies():
+            return [proxy async for proxy in AsyncProxiesList()]
+
+        self.assertEqual(asyncio.run(get_proxies()), ['proxy1', 'proxy2'])
+        self.assertEqual(m3.call_count, 2)
+
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxies', side_effect=[['proxy1'], ['proxy2']])
+    @patch('proxy_db.proxies.ProxiesList.find_provider', side_effect=NoProvidersAvailable)
+    def test_take(self, m1, m2):
+        self.assertEqual(asyncio.run(AsyncProxiesList().take(2)), ['proxy1', 'proxy2'])
+
+    @patch('proxy_db.aio.fetch_provider_request')
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxy', side_effect=[None, None])
+    @patch('proxy_db.proxies.ProxiesList.find_provider')
+    @patch('proxy_db.aio.aiohttp')
+    def test_session(self, m1, m2, m3, m4):
+        async def get_proxies():
+            async with AsyncProxiesList() as proxies:
+                self.assertIsNone(await proxies.reload_provider())
+                return [proxy async for proxy in proxies]
+
+        async def coroutine(*args):
+            return None
+
+        m1.ClientSession.return_value.closed = False
+        m1.ClientSession.return_value.close = Mock(side_effect=coroutine)
+        m4.side_effect = coroutine
+        self.assertEqual(asyncio.run(get_proxies()), [])
+        m1.ClientSession.assert_called_once_with()
+        m1.ClientSession.return_value.close.assert_called_once_with()
+        m4.assert_called_with(ANY)
+
+    @patch('proxy_db.aio.make_request')
+    @patch('proxy_db.aio.aiohttp')
+    def test_shared_session(self, m1, m2):
+        async def make_request(provider_request, session):
+            # The list that started the fetch is closed during the download.
+            await proxies.close()
+            self.assertFalse(session.close.called)
+            raise asyncio.TimeoutError
+
+        async def coroutine(*args):
+            return None
+
+        async def fetch():
+            proxies.get_session()
+            return await fetch_provider_request(ProviderRequestBase(Provider(URL), URL))
+
+        proxies = AsyncProxiesList()
+        m1.ClientError = type('ClientError', (Exception,), {})
+        m1.ClientSession.return_value.closed = False
+        m1.ClientSession.return_value.close = Mock(side_effect=coroutine)
+        m2.side_effect = make_request
+        self.assertIsNone(asyncio.run(fetch()))
+        m1.ClientSession.assert_called_once_with()
+        m1.ClientSession.return_value.close.assert_called_once_with()
+
+    @patch('proxy_db.aio.aiohttp')
+    def test_unclosed_warning(self, m):
+        async def get_session():
+            AsyncProxiesList().get_session()
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            asyncio.run(get_session())
+        self.assertIn(ResourceWarning, [warning.category for warning in caught])
+
+    @patch('proxy_db.proxies.ProxyPrefetcher.pop_many', return_value=['proxy1', 'proxy2'])
+    def test_take_prefetch(self, m):
+        with patch('proxy_db.aio.ProxiesList.find_provider', side_effect=NoProvidersAvailable):
+            self.assertEqual(asyncio.run(AsyncProxiesList(prefetch=10).take(2)), ['proxy1', 'proxy2'])
+        m.assert_called_once_with(2)
+
+    @patch('proxy_db.aio.ProxiesList')
+    def test_init_executor(self, m):
+        threads = []
+        m.side_effect = lambda *args, **kwargs: threads.append(threading.current_thread()) or Mock()
+
+        async def get_proxies_list():
+            proxies = AsyncProxiesList('es', prefetch=10)
+            self.assertEqual(threads, [])
+            await proxies.get_proxies_list()
+            await proxies.get_proxies_list()
+
+        asyncio.run(get_proxies_list())
+        m.assert_called_once_with('es', prefetch=10)
+        self.assertNotEqual(threads, [threading.main_thread()])
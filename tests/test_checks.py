@@ -0,0 +1,190 @@
+import datetime
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from proxy_db.checks import check_proxy, check_proxies, apply_check_results, get_proxies_to_check, CheckResult
+from proxy_db.models import Proxy, ProviderRequest
+from ._compat import patch
+from ._db import DatabaseMixin
+
+
+class StubProxyHandler(BaseHTTPRequestHandler):
+    """Proxy server stub. It responds to the proxied requests without forwarding them."""
+    status = 200
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.send_response(self.status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class ErrorProxyHandler(StubProxyHandler):
+    status = 502
+
+
+def start_stub_proxy(handler=StubProxyHandler):
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def get_closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class StubProxyMixin(object):
+    def setUp(self):
+        self.server = start_stub_proxy()
+        self.error_server = start_stub_proxy(ErrorProxyHandler)
+        self.proxy = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.error_proxy = 'http://127.0.0.1:{}'.format(self.error_server.server_address[1])
+        self.dead_proxy = 'http://127.0.0.1:{}'.format(get_closed_port())
+
+    def tearDown(self):
+        for server in [self.server, self.error_server]:
+            server.shutdown()
+            server.server_close()
+
+
+class TestCheckProxy(StubProxyMixin, unittest.TestCase):
+    def test_success(self):
+        result = check_proxy(self.proxy, 'http://example.com/ip', timeout=5)
+        self.assertTrue(result.success)
+        self.assertEqual(result.proxy_id, self.proxy)
+        self.assertGreaterEqual(result.latency, 0)
+        self.assertGreaterEqual(result.connect_latency, 0)
+        self.assertEqual(self.server.paths, ['http://example.com/ip'])
+
+    def test_dead_proxy(self):
+        result = check_proxy(self.dead_proxy, 'http://example.com/ip', timeout=5)
+        self.assertFalse(result.success)
+        self.assertIsNone(result.connect_latency)
+        self.assertIsNone(result.latency)
+        self.assertTrue(result.error)
+
+    @patch('proxy_db.checks.socks', None)
+    def test_unsupported_scheme(self):
+        result = check_proxy('socks5://127.0.0.1:1080', 'http://example.com/ip', timeout=5)
+        self.assertIsNone(result.success)
+        self.assertTrue(result.error)
+
+    def test_error_status(self):
+        result = check_proxy(self.error_proxy, 'http://example.com/ip', timeout=5)
+        self.assertFalse(result.success)
+        self.assertIsNotNone(result.connect_latency)
+
+
+class TestCheckProxies(DatabaseMixin, StubProxyMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestCheckProxies, self).setUp()
+        self.session.add_all([Proxy(id=proxy, votes=10) for proxy in [self.proxy, self.dead_proxy]])
+        self.session.commit()
+
+    def test_check_proxies(self):
+        proxies = self.session.query(Proxy).order_by(Proxy.id).all()
+        results = check_proxies(proxies, 'http://example.com/ip', timeout=5, session=self.session)
+        self.assertEqual([result.proxy_id for result in results], [proxy.id for proxy in proxies])
+        self.session.expire_all()
+        proxy, dead_proxy = self.session.get(Proxy, self.proxy), self.session.get(Proxy, self.dead_proxy)
+        self.assertEqual((proxy.votes, proxy.check_successes, proxy.check_failures), (11, 1, 0))
+        self.assertEqual((dead_proxy.votes, dead_proxy.check_successes, dead_proxy.check_failures), (9, 0, 1))
+        self.assertIsNotNone(proxy.latency_ewma)
+        self.assertIsNone(dead_proxy.latency)
+        self.assertIsNotNone(dead_proxy.checked_at)
+
+    def test_commit_per_chunk(self):
+        proxies = self.session.query(Proxy).order_by(Proxy.id).all()
+        with patch('proxy_db.checks.apply_check_results') as apply_mock:
+            check_proxies(proxies, 'http://example.com/ip', timeout=5, session=self.session, chunk_size=1)
+        self.assertEqual([[result.proxy_id for result in call[0][0]] for call in apply_mock.call_args_list],
+                         [[proxy.id] for proxy in proxies])
+
+    def test_failure_latency(self):
+        self.session.get(Proxy, self.dead_proxy).latency_ewma = 1.0
+        self.session.commit()
+        check_proxies([self.dead_proxy], 'http://example.com/ip', timeout=5, session=self.session)
+        self.session.expire_all()
+        self.assertGreater(self.session.get(Proxy, self.dead_proxy).latency_ewma, 1.0)
+
+    def test_no_update(self):
+        check_proxies([self.proxy], 'http://example.com/ip', timeout=5, update=False, session=self.session)
+        self.assertIsNone(self.session.get(Proxy, self.proxy).checked_at)
+
+    def test_empty(self):
+        self.assertEqual(check_proxies([]), [])
+
+
+class TestApplyCheckResults(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestApplyCheckResults, self).setUp()
+        self.session.add(Proxy(id='http://1.1.1.1:80', votes=0))
+        self.session.commit()
+
+    def test_latency_ewma(self):
+        apply_check_results([CheckResult('http://1.1.1.1:80', True, 0.1, 1.0, None)], self.session, alpha=0.5)
+        apply_check_results([CheckResult('http://1.1.1.1:80', True, 0.1, 2.0, None)], self.session, alpha=0.5)
+        apply_check_results([CheckResult('http://1.1.1.1:80', False, None, None, 'error')], self.session, alpha=0.5,
+                            failure_latency=4.5)
+        apply_check_results([CheckResult('http://1.1.1.1:80', None, None, None, 'skipped')], self.session)
+        self.session.expire_all()
+        proxy = self.session.get(Proxy, 'http://1.1.1.1:80')
+        self.assertAlmostEqual(proxy.latency_ewma, 3.0)
+        self.assertEqual(proxy.latency, 2.0)
+        self.assertEqual((proxy.votes, proxy.check_successes, proxy.check_failures), (1, 2, 1))
+
+
+class TestGetProxiesToCheck(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestGetProxiesToCheck, self).setUp()
+        now = datetime.datetime.now()
+        self.session.add_all([
+            Proxy(id='http://1.1.1.1:80', country='ES', checked_at=now),
+            Proxy(id='http://2.2.2.2:80', country='ES', checked_at=now - datetime.timedelta(hours=1)),
+            Proxy(id='http://3.3.3.3:80', country='ES'),
+            Proxy(id='http://4.4.4.4:80', country='US'),
+        ])
+        self.session.add(ProviderRequest(provider='manual', request_id='None-None',
+                                         proxies=[self.session.get(Proxy, 'http://4.4.4.4:80')]))
+        self.session.commit()
+
+    def test_order(self):
+        proxies = get_proxies_to_check(self.session, country='es')
+        self.assertEqual([proxy.id for proxy in proxies],
+                         ['http://3.3.3.3:80', 'http://2.2.2.2:80', 'http://1.1.1.1:80'])
+
+    def test_checked_before(self):
+        checked_before = datetime.datetime.now() - datetime.timedelta(minutes=5)
+        proxies = get_proxies_to_check(self.session, checked_before=checked_before, limit=2)
+        self.assertEqual([proxy.id for proxy in proxies], ['http://3.3.3.3:80', 'http://4.4.4.4:80'])
+
+    def test_chunk_size(self):
+        proxies = get_proxies_to_check(self.session, chunk_size=1)
+        self.assertEqual([proxy.id for proxy in proxies],
+                         ['http://3.3.3.3:80', 'http://4.4.4.4:80', 'http://2.2.2.2:80', 'http://1.1.1.1:80'])
+
+    def test_checked_during_run(self):
+        proxies = get_proxies_to_check(self.session, chunk_size=1)
+        for proxy in proxies:
+            proxy.checked_at = datetime.datetime.now() + datetime.timedelta(seconds=1)
+            self.session.commit()
+            if proxy.id == 'http://4.4.4.4:80':
+                break
+        self.assertEqual([proxy.id for proxy in proxies], ['http://2.2.2.2:80', 'http://1.1.1.1:80'])
+
+    def test_provider(self):
+        proxies = get_proxies_to_check(self.session, provider='manual')
+        self.assertEqual([proxy.id for proxy in proxies], ['http://4.4.4.4:80'])
@@ -1,7 +1,7 @@
 import unittest
 
 
-from proxy_db.countries import ip_country, geoip2_manager
+from proxy_db.countries import ip_country, ip_country_available, geoip2_manager
 from ._compat import patch
 
 
@@ -28,3 +28,8 @@ class TestIpCountry(unittest.TestCase):
             return
         m.__getitem__.side_effect = AddressNotFoundError
         self.assertEqual(ip_country('proxy'), '')
+
+    @patch('proxy_db.countries.geoip2_manager', None)
+    def test_not_available(self):
+        self.assertFalse(ip_country_available())
+        self.assertEqual(ip_country('proxy'), '')
@@ -0,0 +1,187 @@
+import csv
+import datetime
+import io
+import json
+import os
+import unittest
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from proxy_db.export import OutputBase, ColumnsProjection, JsonOutput, LineOutput, JsonEncoder, get_export_output, \
+    get_export_output_classes, EXPORT_OUTPUTS, tabulate, pyarrow
+from proxy_db.management import list_command
+from proxy_db.models import Base, Proxy, ProviderRequest
+from ._compat import patch
+from ._db import temporary_directory
+
+
+def get_proxies(n):
+    return [Proxy(id='http://1.1.{}.{}:80'.format(i // 256, i % 256), votes=i, country='ES', protocol='http',
+                  created_at=datetime.datetime(2020, 1, 1)) for i in range(n)]
+
+
+class TestJsonOutput(unittest.TestCase):
+    def assertJsonEqual(self, proxies):
+        output = JsonOutput(proxies)
+        rows = [dict(zip(output.columns, row)) for row in JsonOutput(proxies).get_rows()]
+        self.assertEqual(output.render(), json.dumps(rows, cls=JsonEncoder, sort_keys=True, indent=4))
+
+    def test_empty(self):
+        self.assertJsonEqual([])
+
+    def test_rows(self):
+        self.assertJsonEqual(get_proxies(3))
+
+    @patch.object(OutputBase, 'chunk_size', 2)
+    def test_chunks(self):
+        self.assertJsonEqual(get_proxies(5))
+
+    def test_stream(self):
+        proxies = iter(get_proxies(3))
+        stream = JsonOutput(proxies).stream()
+        next(stream)
+        # The input is consumed as the output is written.
+        with self.assertRaises(StopIteration):
+            next(proxies)
+
+
+class TestLineOutput(unittest.TestCase):
+    @patch.object(OutputBase, 'chunk_size', 2)
+    def test_chunks(self):
+        self.assertEqual(LineOutput(get_proxies(3)).render(),
+                         'http://1.1.0.0:80\nhttp://1.1.0.1:80\nhttp://1.1.0.2:80')
+
+    def test_empty(self):
+        self.assertEqual(LineOutput([]).render(), '')
+
+
+@unittest.skipIf(tabulate is None, 'tabulate is not installed')
+class TestTabulateOutput(unittest.TestCase):
+    @patch.object(OutputBase, 'chunk_size', 2)
+    def test_chunks(self):
+        parts = list(get_export_output('plain-table', get_proxies(3), ['id']).stream())
+        self.assertEqual(parts, ['id\nhttp://1.1.0.0:80\nhttp://1.1.0.1:80\nhttp://1.1.0.2:80'])
+
+
+class TestListQueries(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///{}'.format(os.path.join(temporary_directory(self), 'db.sqlite3')))
+        Base.metadata.create_all(self.engine)
+        self.session_maker = sessionmaker(bind=self.engine)
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def add_proxies(self, start, end):
+        session = self.session_maker()
+        proxies = get_proxies(end)[start:]
+        session.add_all(proxies)
+        request_id = '{}-{}'.format(start, end)
+        session.add(ProviderRequest(provider='manual', request_id=request_id, proxies=proxies))
+        session.add(ProviderRequest(provider='other', request_id=request_id, proxies=proxies[:1]))
+        session.commit()
+
+    def list_statements(self, *args):
+        self.statements = []
+        with patch('proxy_db.management.create_session', side_effect=self.session_maker):
+            result = CliRunner().invoke(list_command, list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output, len(self.statements)
+
+    def test_constant_statements(self):
+        self.add_proxies(0, 2)
+        _, statements = self.list_statements('--format', 'json')
+        self.add_proxies(2, 22)
+        output, more_statements = self.list_statements('--format', 'json')
+        self.assertEqual(statements, more_statements)
+        self.assertEqual(len(json.loads(output)), 22)
+
+    def test_provider_filter(self):
+        self.add_proxies(0, 3)
+        output, _ = self.list_statements('--provider', 'other')
+        self.assertEqual(output, 'http://1.1.0.0:80\n')
+
+    def test_projection(self):
+        self.add_proxies(0, 3)
+        columns = ['id', 'votes', 'providers', 'proxy_with_credentials', 'provider_requests__request_id']
+        projection = ColumnsProjection(columns)
+        self.assertTrue(projection.sql)
+        query = self.session_maker().query(Proxy).order_by(Proxy.id)
+        sql_rows = list(OutputBase(query, columns).get_rows())
+        self.assertEqual(sql_rows[0][:2] + sql_rows[0][3:], ('http://1.1.0.0:80', '0', 'http://1.1.0.0:80', '0-3'))
+        self.assertEqual(set(sql_rows[0][2].split(', ')), {'manual', 'other'})
+        # The same rows using the Proxy instances (the providers order can change).
+        self.assertEqual([row[:2] + row[3:] for row in OutputBase(query.all(), columns).get_rows()],
+                         [row[:2] + row[3:] for row in sql_rows])
+
+    def test_instances_projection(self):
+        self.add_proxies(0, 2)
+        projection = ColumnsProjection(['id', 'credentials'])
+        self.assertFalse(projection.sql)
+        query = self.session_maker().query(Proxy).order_by(Proxy.id)
+        self.assertEqual(list(OutputBase(query, ['id', 'credentials']).get_rows()),
+                         [('http://1.1.0.0:80', ()), ('http://1.1.0.1:80', ())])
+
+
+class TestGetExportOutputClasses(unittest.TestCase):
+    def test_not_modified(self):
+        outputs = list(EXPORT_OUTPUTS)
+        get_export_output_classes()
+        get_export_output_classes()
+        self.assertEqual(EXPORT_OUTPUTS, outputs)
+
+
+class TestCsvOutput(unittest.TestCase):
+    def test_render(self):
+        output = get_export_output('csv', get_proxies(2), ['id', 'votes', 'created_at'])
+        self.assertEqual(output.render(), 'id,votes,created_at\n'
+                                          'http://1.1.0.0:80,0,2020-01-01T00:00:00\n'
+                                          'http://1.1.0.1:80,1,2020-01-01T00:00:00')
+
+    @patch.object(OutputBase, 'chunk_size', 2)
+    def test_chunks(self):
+        output = get_export_output('csv', get_proxies(3), ['id'])
+        self.assertEqual(list(csv.reader(io.StringIO(output.render()))),
+                         [['id'], ['http://1.1.0.0:80'], ['http://1.1.0.1:80'], ['http://1.1.0.2:80']])
+
+    def test_empty(self):
+        self.assertEqual(get_export_output('csv', [], ['id', 'votes']).render(), 'id,votes')
+
+
+class TestNdjsonOutput(unittest.TestCase):
+    @patch.object(OutputBase, 'chunk_size', 2)
+    def test_render(self):
+        lines = get_export_output('ndjson', get_proxies(3), ['id', 'votes']).render().split('\n')
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'id': 'http://1.1.0.{}:80'.format(i), 'votes': str(i)} for i in range(3)
+        ])
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestArrowOutput(unittest.TestCase):
+    columns = ['id', 'votes', 'created_at', 'latency', 'providers', 'credentials']
+
+    def get_table(self, format, read):
+        proxies = get_proxies(3)
+        for proxy in proxies:
+            proxy.provider_requests = [ProviderRequest(provider='manual')]
+        with patch.object(OutputBase, 'chunk_size', 2):
+            data = get_export_output(format, proxies, self.columns).render()
+        return read(pyarrow.BufferReader(data))
+
+    def assertTable(self, table):
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column('votes').to_pylist(), [0, 1, 2])
+        self.assertEqual(table.column('created_at').to_pylist()[0], datetime.datetime(2020, 1, 1))
+        self.assertEqual(table.column('providers').to_pylist()[0], ['manual'])
+        self.assertEqual(table.column('credentials').to_pylist()[0], '()')
+
+    def test_arrow(self):
+        self.assertTable(self.get_table('arrow', lambda source: pyarrow.ipc.open_file(source).read_all()))
+
+    def test_parquet(self):
+        self.assertTable(self.get_table('parquet', pyarrow.parquet.read_table))
@@ -0,0 +1,99 @@
+import os
+import threading
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from proxy_db.exceptions import NoProxiesAvailable
+from proxy_db.leases import acquire_lease, release_lease, renew_lease
+from proxy_db.models import Base, Proxy, ProviderRequest, ProxyLease
+from proxy_db.proxies import ProxiesList
+from ._compat import patch
+from ._db import DatabaseMixin, temporary_directory
+
+
+class TestLeases(DatabaseMixin, unittest.TestCase):
+    def test_acquire(self):
+        lease = acquire_lease('http://1.1.1.1:80', 60, session=self.session)
+        self.assertEqual(lease.proxy_id, 'http://1.1.1.1:80')
+        self.assertIsNone(acquire_lease('http://1.1.1.1:80', 60, session=self.session))
+        self.assertIsNotNone(acquire_lease('http://2.2.2.2:80', 60, session=self.session))
+
+    def test_reclaim_expired(self):
+        lease = acquire_lease('http://1.1.1.1:80', -1, session=self.session)
+        new_lease = acquire_lease('http://1.1.1.1:80', 60, session=self.session)
+        self.assertIsNotNone(new_lease)
+        self.assertFalse(release_lease(lease, session=self.session))
+        self.assertIsNone(renew_lease(lease, session=self.session))
+        self.assertTrue(release_lease(new_lease, session=self.session))
+        self.assertEqual(self.session.query(ProxyLease).count(), 0)
+
+    def test_renew(self):
+        lease = acquire_lease('http://1.1.1.1:80', 1, session=self.session)
+        new_lease = renew_lease(lease, 60, session=self.session)
+        self.assertGreater(new_lease.expires_at, lease.expires_at)
+        self.assertEqual(new_lease.owner, lease.owner)
+
+
+class TestProxiesListLeases(unittest.TestCase):
+    def setUp(self):
+        directory = temporary_directory(self)
+        engine = create_engine('sqlite:///{}'.format(os.path.join(directory, 'db.sqlite3')),
+                               connect_args={'timeout': 30})
+        Base.metadata.create_all(engine)
+        self.session_maker = sessionmaker(bind=engine)
+        session = self.session_maker()
+        proxies = [Proxy(id='http://1.1.1.{}:80'.format(i), votes=i) for i in range(10)]
+        session.add_all(proxies)
+        session.add(ProviderRequest(provider='manual', request_id='None-None', proxies=proxies))
+        session.commit()
+        self.patches = [patch('proxy_db.{}.create_session'.format(module), side_effect=self.session_maker)
+                        for module in ['proxies', 'leases', 'votes']]
+        for p in self.patches:
+            p.start()
+        self.proxies_list = ProxiesList(provider='manual')
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_acquire_release(self):
+        proxy = self.proxies_list.acquire()
+        self.assertEqual(proxy.id, 'http://1.1.1.9:80')
+        self.assertEqual(self.proxies_list.acquire().id, 'http://1.1.1.8:80')
+        self.assertTrue(self.proxies_list.release(proxy, success=True))
+        self.assertIsNone(proxy.lease)
+        self.assertEqual(self.session_maker().get(Proxy, proxy.id).votes, 10)
+        self.assertEqual(self.proxies_list.acquire().id, 'http://1.1.1.9:80')
+
+    def test_renew(self):
+        proxy = self.proxies_list.acquire(ttl=1)
+        expires_at = proxy.lease.expires_at
+        self.assertTrue(self.proxies_list.renew(proxy, 60))
+        self.assertGreater(proxy.lease.expires_at, expires_at)
+
+    def test_expired(self):
+        proxy = self.proxies_list.acquire(ttl=-1)
+        self.assertEqual(self.proxies_list.acquire().id, proxy.id)
+
+    def test_exhausted(self):
+        for _ in range(10):
+            self.proxies_list.acquire()
+        with self.assertRaises(NoProxiesAvailable):
+            self.proxies_list.acquire()
+
+    def test_threads(self):
+        proxies = []
+
+        def acquire():
+            proxies_list = ProxiesList(provider='manual')
+            for _ in range(2):
+                proxies.append(proxies_list.acquire().id)
+
+        threads = [threading.Thread(target=acquire) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(proxies)), 10)
@@ -1,26 +1,62 @@
 import datetime
+import gc
+import gzip
+import io
+import os
 import unittest
 
 from click.testing import CliRunner
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
 from proxy_db.exceptions import UnknownExportFormat
-from proxy_db.management import add_command, list_command
-from proxy_db.models import Proxy
-from tests._compat import patch
+from proxy_db.management import add_command, list_command, refresh_command, check_command, serve_command, \
+    gateway_command
+from proxy_db.checks import CheckResult
+from proxy_db.models import Base, Proxy, ProviderRequest
+from proxy_db.providers import IngestResult
+from tests._compat import patch, ANY
+from tests._db import temporary_directory
 
 
 class TestAdd(unittest.TestCase):
 
+    @patch('proxy_db.management.create_session')
     @patch('proxy_db.management.ManualProxy')
-    def test_add_proxies(self, m):
-        CliRunner().invoke(add_command, ['http://1.2.3.4:999'])
+    def test_add_proxies(self, m, _):
+        m.return_value.bulk_add_proxies.return_value = IngestResult(['http://1.2.3.4:999'], 1, 0)
+        result = CliRunner().invoke(add_command, ['http://1.2.3.4:999'])
         m.assert_called_once_with('manual')
-        m.return_value.add_proxies.assert_called_once_with([{'protocol': 'http', 'proxy': '1.2.3.4:999'}], 10)
+        m.return_value.bulk_add_proxies.assert_called_once_with(
+            [{'protocol': 'http', 'proxy': '1.2.3.4:999'}], ANY, 10, 1,
+        )
+        self.assertIn('Read 1 proxies. 1 new proxies have been created.', result.output)
+
+    @patch('proxy_db.management.create_session')
+    @patch('proxy_db.management.ManualProxy')
+    @patch('proxy_db.management.click.get_binary_stream', return_value=io.BytesIO(b'http://1.2.3.4:999\n'))
+    def test_stdin(self, m, manual_proxy_mock, _):
+        manual_proxy_mock.return_value.bulk_add_proxies.return_value = IngestResult(['http://1.2.3.4:999'], 1, 0)
+        CliRunner().invoke(add_command, ['-'])
+        m.assert_called_once_with('stdin')
+        manual_proxy_mock.return_value.bulk_add_proxies.assert_called_once()
+
+    @patch('proxy_db.management.create_session')
+    @patch('proxy_db.management.ManualProxy')
+    def test_stdin_not_closed(self, manual_proxy_mock, _):
+        manual_proxy_mock.return_value.bulk_add_proxies.return_value = IngestResult(['http://1.2.3.4:999'], 1, 0)
+        for content in [b'http://1.2.3.4:999\n', gzip.compress(b'http://1.2.3.4:999\n')]:
+            stdin = io.BytesIO(content)
+            with patch('proxy_db.management.click.get_binary_stream', return_value=stdin):
+                result = CliRunner().invoke(add_command, ['--file', '-'])
+            gc.collect()
+            self.assertIn('Read 1 proxies.', result.output)
+            self.assertFalse(stdin.closed)
 
-    @patch('proxy_db.management.click.get_text_stream', return_value=[])
-    def test_get_text_stream(self, m):
-        CliRunner().invoke(add_command, [])
-        m.assert_called_once()
+    def test_missing_file(self):
+        result = CliRunner().invoke(add_command, ['--file', '/missing/proxies.txt'])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('does not exist', result.output)
 
     @patch('proxy_db.management.click.echo', return_value=[])
     def test_invalid_proxy(self, m):
@@ -28,6 +64,38 @@ class TestAdd(unittest.TestCase):
         self.assertTrue(m.call_args_list[0][1]['err'])  #  click.echo('...', err=True)
 
 
+class TestAddFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = temporary_directory(self)
+        engine = create_engine('sqlite:///{}'.format(os.path.join(self.directory, 'db.sqlite3')))
+        Base.metadata.create_all(engine)
+        self.session_maker = sessionmaker(bind=engine)
+
+    def add_file(self, path, *args):
+        with patch('proxy_db.management.create_session', side_effect=self.session_maker):
+            return CliRunner().invoke(add_command, ['--file', path] + list(args))
+
+    def test_gzip_chunks(self):
+        path = os.path.join(self.directory, 'proxies.txt.gz')
+        with gzip.open(path, 'wt') as file:
+            file.write('http://1.1.1.1:80\n\ninvalid\nhttp://1.1.1.2:80\nhttp://1.1.1.3:80\n')
+        result = self.add_file(path, '--chunk-size', '2')
+        self.assertIn('Invalid proxies entered: invalid', result.output)
+        self.assertIn('Read 3 proxies. 3 new proxies have been created.', result.output)
+        session = self.session_maker()
+        self.assertEqual(session.query(Proxy).count(), 3)
+        self.assertEqual(session.query(ProviderRequest).one().results, 3)
+
+    def test_update(self):
+        path = os.path.join(self.directory, 'proxies.txt')
+        with open(path, 'w') as file:
+            file.write('http://1.1.1.1:80\n')
+        self.add_file(path)
+        result = self.add_file(path)
+        self.assertIn('Read 1 proxies. 0 new proxies have been created.', result.output)
+        self.assertEqual(self.session_maker().get(Proxy, 'http://1.1.1.1:80').votes, 20)
+
+
 class TestList(unittest.TestCase):
 
     @patch('proxy_db.management.create_session')
@@ -39,14 +107,14 @@ class TestList(unittest.TestCase):
 
     @patch('proxy_db.management.create_session')
     def test_line_format(self, m):
-        m.return_value.query.return_value.all.return_value = [
+        m.return_value.query.return_value = [
             Proxy(created_at=datetime.datetime.now()),
         ]
         CliRunner().invoke(list_command)
 
     @patch('proxy_db.management.create_session')
     def test_json_format(self, m):
-        m.return_value.query.return_value.all.return_value = [
+        m.return_value.query.return_value = [
             Proxy(),
         ]
         CliRunner().invoke(list_command, [
@@ -55,16 +123,87 @@ class TestList(unittest.TestCase):
 
     @patch('proxy_db.management.create_session')
     def test_table_format(self, m):
-        m.return_value.query.return_value.all.return_value = [
+        m.return_value.query.return_value = [
             Proxy(),
         ]
         CliRunner().invoke(list_command, [
             '--format', 'grid-table',
         ])
 
+    @patch('proxy_db.management.create_session')
+    def test_output(self, m):
+        m.return_value.query.return_value = [Proxy(id='http://1.1.1.1:80')]
+        path = os.path.join(temporary_directory(self), 'proxies.csv')
+        CliRunner().invoke(list_command, ['--format', 'csv', '--columns', 'id', '--output', path])
+        with open(path) as file:
+            self.assertEqual(file.read(), 'id\nhttp://1.1.1.1:80\n')
+
     @patch('proxy_db.management.create_session')
     def test_invalid_format(self, m):
         result = CliRunner().invoke(list_command, [
             '--format', 'invalid',
         ])
         self.assertIsInstance(result.exception, UnknownExportFormat)
+
+
+class TestRefresh(unittest.TestCase):
+
+    @patch('proxy_db.management.BackgroundRefresher')
+    def test_refresh(self, m):
+        m.return_value.refresh.return_value = {1: None}
+        result = CliRunner().invoke(refresh_command, ['--margin', '5'])
+        m.assert_called_once_with(60, 5)
+        self.assertIn('1 provider requests refreshed', result.output)
+
+    @patch('proxy_db.management.BackgroundRefresher')
+    def test_daemon(self, m):
+        CliRunner().invoke(refresh_command, ['--daemon'])
+        m.return_value.run.assert_called_once()
+
+
+class TestCheck(unittest.TestCase):
+
+    @patch('proxy_db.management.check_proxies')
+    @patch('proxy_db.management.get_proxies_to_check')
+    @patch('proxy_db.management.create_session')
+    def test_check(self, m1, m2, m3):
+        m3.return_value = [CheckResult('http://1.1.1.1:80', True, 0.1, 0.2, None),
+                           CheckResult('http://2.2.2.2:80', False, None, None, 'error'),
+                           CheckResult('socks5://3.3.3.3:80', None, None, None, 'error')]
+        result = CliRunner().invoke(check_command, ['--country', 'es', '--limit', '10', '--older-than', '60'])
+        self.assertEqual(m2.call_args[0][1:3], ('es', ''))
+        self.assertEqual(m2.call_args[0][5], 10)
+        self.assertIsNotNone(m2.call_args[0][4])
+        m3.assert_called_once()
+        self.assertIn('3 proxies checked: 1 working, 1 failed, 1 skipped.', result.output)
+
+
+class TestServe(unittest.TestCase):
+
+    @patch('proxy_db.management.disable_vote_buffer')
+    @patch('proxy_db.management.enable_vote_buffer')
+    @patch('proxy_db.management.BackgroundRefresher')
+    @patch('proxy_db.management.get_server_address', return_value='unix:///tmp/proxy-db.sock')
+    @patch('proxy_db.management.create_server')
+    def test_serve(self, m1, m2, m3, m4, m5):
+        result = CliRunner().invoke(serve_command, ['--address', 'unix:///tmp/proxy-db.sock'])
+        self.assertEqual(m1.call_args[0][0], 'unix:///tmp/proxy-db.sock')
+        m1.return_value.serve_forever.assert_called_once()
+        m3.return_value.start.assert_called_once()
+        m4.assert_called_once_with(5)
+        m5.assert_called_once()
+        self.assertIn('Listening on unix:///tmp/proxy-db.sock', result.output)
+
+
+class TestGateway(unittest.TestCase):
+
+    @patch('proxy_db.management.disable_vote_buffer')
+    @patch('proxy_db.management.enable_vote_buffer')
+    @patch('proxy_db.management.asyncio.run')
+    @patch('proxy_db.management.Gateway')
+    def test_gateway(self, m1, m2, m3, m4):
+        CliRunner().invoke(gateway_command, ['--port', '8081', '--strategy', 'fastest', '--country', 'es'])
+        m1.assert_called_once_with('es', None, 'http', 'fastest', 3, 10)
+        m1.return_value.serve_forever.assert_called_once_with('127.0.0.1', 8081)
+        m2.assert_called_once()
+        m4.assert_called_once()
@@ -1,7 +1,50 @@
+import os
 import unittest
 
+from sqlalchemy import create_engine, inspect, text
+
 from proxy_db.migrations import MigrateVersion
+from proxy_db.migrations.migration_0_4_0 import Migrate as Migrate040
+from proxy_db.migrations.migration_0_5_0 import Migrate as Migrate050
+from proxy_db.migrations.migration_0_6_0 import Migrate as Migrate060
+from proxy_db.migrations.migration_0_7_0 import Migrate as Migrate070
+from proxy_db.migrations.migration_0_8_0 import Migrate as Migrate080
+from proxy_db.migrations.migration_0_9_0 import Migrate as Migrate090
+from proxy_db.models import Base
 from ._compat import patch
+from ._db import temporary_directory
+
+
+def drop_indexes(names):
+    return ['DROP INDEX IF EXISTS {}'.format(name) for name in names]
+
+
+# The proxies table before the 0.5.0 migration.
+PROXIES_TABLE_040 = [
+    'DROP TABLE proxies',
+    'CREATE TABLE proxies (id VARCHAR(255) PRIMARY KEY, votes INTEGER)',
+    "INSERT INTO proxies (id, votes) VALUES ('http://1.1.1.1:80', 1)",
+]
+# (migration, statements to undo the migration, kind of names, table, names created by the migration)
+SCHEMA_MIGRATIONS = [
+    (Migrate040, drop_indexes(Migrate040.indexes), 'indexes', 'proxies',
+     {'ix_proxies_votes', 'ix_proxies_country_protocol_votes'}),
+    (Migrate050, PROXIES_TABLE_040, 'columns', 'proxies', set(Migrate050.columns)),
+    (Migrate060, drop_indexes(Migrate060.indexes), 'indexes', 'proxies', set(Migrate060.indexes)),
+    (Migrate070, ['DROP TABLE proxy_leases'], 'tables', None, {'proxy_leases'}),
+    (Migrate080, ['ALTER TABLE provider_requests DROP COLUMN fetch_seconds'], 'columns', 'provider_requests',
+     set(Migrate080.columns)),
+    (Migrate090, drop_indexes(Migrate090.indexes), 'indexes', 'proxies', set(Migrate090.indexes)),
+]
+
+
+def get_schema_names(engine, kind, table=None):
+    inspector = inspect(engine)
+    if kind == 'tables':
+        return set(inspector.get_table_names())
+    elif kind == 'indexes':
+        return {index['name'] for index in inspector.get_indexes(table)}
+    return {column['name'] for column in inspector.get_columns(table)}
 
 
 class TestMigrateVersion(unittest.TestCase):
@@ -16,3 +59,35 @@ class TestMigrateVersion(unittest.TestCase):
     def test_migrate_version(self, m):
         MigrateVersion().migrate_version('0.3.0')
         m.assert_called_once()
+
+
+class TestSchemaMigrations(unittest.TestCase):
+    def create_database(self, statements):
+        url = 'sqlite:///{}'.format(os.path.join(temporary_directory(self), 'db.sqlite3'))
+        engine = create_engine(url)
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+        return url, engine
+
+    def test_migrate(self):
+        for migration, statements, kind, table, names in SCHEMA_MIGRATIONS:
+            with self.subTest(version=migration.version):
+                url, engine = self.create_database(statements)
+                # The migrations can run again on a migrated database.
+                migration(db_url=url).migrate()
+                migration(db_url=url).migrate()
+                self.assertLessEqual(names, get_schema_names(engine, kind, table))
+
+    def test_migrate_default_values(self):
+        url, engine = self.create_database(PROXIES_TABLE_040)
+        Migrate050(db_url=url).migrate()
+        with engine.connect() as connection:
+            row = connection.execute(text('SELECT check_successes, latency FROM proxies')).one()
+        self.assertEqual(tuple(row), (0, None))
+
+    def test_all_versions(self):
+        versions = {migration.version for migration, _, _, _, _ in SCHEMA_MIGRATIONS}
+        self.assertEqual(versions, set(MigrateVersion.versions[MigrateVersion.versions.index('0.4.0'):]))
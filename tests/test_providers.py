@@ -4,12 +4,16 @@
 """Tests for `proxy-db` package."""
 import copy
 import datetime
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 import requests_mock
 
 from ._compat import Mock, patch
+from ._db import DatabaseMixin
 
+from proxy_db.models import Proxy, ProviderRequest
 from proxy_db.providers import ProxyNovaCom, Provider, ProviderRequestBase, PROVIDER_REQUIRES_UPDATE_MINUTES, NordVpn, \
     ManualProxy
 
@@ -149,6 +153,13 @@ class TestProviderRequestBase(unittest.TestCase):
         with patch('proxy_db.providers.ProviderRequestBase.get_or_create', return_value=(instance, True)):
             self.assertTrue(self.get_provider_request().requires_update())
 
+    def test_requires_update_margin(self):
+        instance = Mock()
+        instance.updated_at = datetime.datetime.now() - datetime.timedelta(minutes=PROVIDER_REQUIRES_UPDATE_MINUTES - 5)
+        with patch('proxy_db.providers.ProviderRequestBase.get_or_create', return_value=(instance, True)):
+            self.assertFalse(self.get_provider_request().requires_update())
+            self.assertTrue(self.get_provider_request().requires_update(margin_minutes=10))
+
     def test_requires_update_not_exists(self):
         self.assertTrue(self.get_provider_request().requires_update())
 
@@ -169,6 +180,76 @@ class TestProviderRequestBase(unittest.TestCase):
         self.assertEqual(self.get_provider_request().id, 'es-1')
 
 
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Return 503 on the first request and 200 on the next ones."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.client_address)
+        status = 503 if len(self.server.requests) == 1 else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class TestProviderHttpSession(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_keep_alive(self):
+        provider = Provider(self.url)
+        provider.retry_backoff = 0
+        provider_request = ProviderRequestBase(provider, self.url)
+        self.assertEqual(provider_request.make_request().status_code, 200)
+        provider_request.make_request()
+        self.assertEqual(len(self.server.requests), 3)
+        # The same connection is used for all the requests
+        self.assertEqual(len(set(self.server.requests)), 1)
+        self.assertIsNotNone(provider_request.fetch_seconds)
+
+    def test_no_retry_post(self):
+        provider = Provider(self.url)
+        provider.retry_backoff = 0
+        self.assertEqual(provider.get_http_session().post(self.url, data='query=1').status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_get_http_session(self):
+        provider = Provider(self.url)
+        self.assertIs(provider.get_http_session(), provider.get_http_session())
+
+    def test_create_http_session(self):
+        class CustomProvider(Provider):
+            def create_http_session(self):
+                http_session = super(CustomProvider, self).create_http_session()
+                http_session.headers['x-custom'] = 'value'
+                return http_session
+
+        with requests_mock.Mocker() as session_mock:
+            session_mock.post(URL, text='')
+            ProviderRequestBase(CustomProvider(URL), URL, method='POST', data='query=1',
+                                headers={'x-request': 'value'}).make_request()
+        request = session_mock.last_request
+        self.assertEqual(request.headers['x-custom'], 'value')
+        self.assertEqual(request.headers['x-request'], 'value')
+        self.assertEqual(request.body, 'query=1')
+        self.assertEqual(request.timeout, (ProviderRequestBase.connect_timeout, ProviderRequestBase.timeout))
+
+
 class TestProvider(unittest.TestCase):
     url = URL
     proxies = [{'proxy': ('12.131.91.51', '8888')}, {'proxy': ('8.10.81.82', '7171')}]
@@ -192,6 +273,31 @@ class TestProvider(unittest.TestCase):
         mock_session.return_value.commit.assert_called_once()
 
 
+class TestBulkProcessProxies(DatabaseMixin, unittest.TestCase):
+    url = URL
+    proxies = [{'proxy': '12.131.91.51:8888', 'country_code': 'ES'}, {'proxy': '8.10.81.82:7171'},
+               {'proxy': '12.131.91.51:8888', 'country_code': 'ES'}]
+
+    def test_bulk_process_proxies(self):
+        provider = Provider(self.url)
+        result = provider.bulk_process_proxies(self.proxies, self.session, update_votes=2)
+        self.assertEqual((result.created, result.updated), (2, 0))
+        result = provider.bulk_process_proxies(self.proxies[:1], self.session, update_votes=2)
+        self.assertEqual((result.created, result.updated), (0, 1))
+        proxy = self.session.query(Proxy).filter_by(id='http://12.131.91.51:8888').one()
+        self.assertEqual((proxy.votes, proxy.country), (4, 'ES'))
+        self.assertEqual(self.session.query(Proxy).count(), 2)
+
+    def test_bulk_add_proxies(self):
+        provider_request = ProviderRequestBase(Provider(self.url), self.url)
+        provider_request.bulk_add_proxies(self.proxies, self.session)
+        result = provider_request.bulk_add_proxies(self.proxies, self.session)
+        self.assertEqual(result.ids, ['http://12.131.91.51:8888', 'http://8.10.81.82:7171'])
+        instance = self.session.query(ProviderRequest).one()
+        self.assertEqual(instance.results, 3)
+        self.assertEqual(len(instance.proxies), 2)
+
+
 class TestProxyNovaCom(unittest.TestCase):
     url = 'https://domain.com/'
 
@@ -294,3 +400,14 @@ class TestManualProvider(unittest.TestCase):
     @patch('proxy_db.providers.create_session')
     def test_add_proxies(self, m):
         ManualProxy('manual').add_proxies([{'protocol': 'http', 'proxy': '1.2.3.4:999'}])
+
+    @patch('proxy_db.providers.create_session')
+    def test_bulk_add_proxies(self, m):
+        result = ManualProxy('manual').bulk_add_proxies([{'protocol': 'http', 'proxy': '1.2.3.4:999'}])
+        self.assertEqual(result.created, 1)
+        m.return_value.commit.assert_called_once()
+
+    def test_bulk_add_proxies_arguments(self):
+        with patch('proxy_db.providers.ProviderRequestBase.bulk_add_proxies') as m:
+            ManualProxy('manual').bulk_add_proxies([], 'session', 5, 2)
+        m.assert_called_once_with([], 'session', 5, 2)
@@ -1,9 +1,17 @@
+import re
 import unittest
 
+from sqlalchemy import event, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from proxy_db.exceptions import NoProvidersAvailable
+from proxy_db.models import Proxy, ProviderRequest, association_table
 from proxy_db.providers import ProxyNovaCom, PROVIDERS
 from ._compat import patch, Mock
+from ._db import DatabaseMixin
 
-from proxy_db.proxies import ProxiesList, RandomListingStrategy
+from proxy_db.proxies import ProxiesList, RandomListingStrategy, ProxyPrefetcher, VotesListingStrategy, \
+    ListingStrategy, WeightedRandomListingStrategy, RoundRobinListingStrategy, FastestListingStrategy
 
 
 class TestProxiesList(unittest.TestCase):
@@ -21,7 +29,7 @@ class TestProxiesList(unittest.TestCase):
 
     @patch('proxy_db.proxies.create_session')
     def test_find_db_proxy(self, m):
-        m.return_value.query.return_value.join.return_value.filter\
+        m.return_value.query.return_value.options.return_value.join.return_value.filter\
             .return_value.session.get_bind.return_value.name = 'sqlite'
         ProxiesList(strategy=RandomListingStrategy).find_db_proxy()
         m.assert_called_once()
@@ -48,3 +56,395 @@ class TestProxiesList(unittest.TestCase):
         p._proxies = None
         p2 = iter(p)
         self.assertEqual(p2._proxies, set())
+
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxies', return_value=[])
+    def test_prefetch_find_db_proxy(self, m):
+        p = ProxiesList(prefetch=10)
+        self.assertIsNone(p.find_db_proxy())
+        m.assert_called_once_with(10)
+
+    @patch('proxy_db.proxies.ProxiesList.reload_provider_without_error')
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxies', side_effect=[[1, 2], [3]])
+    def test_take(self, m1, m2):
+        self.assertEqual(ProxiesList().take(4), [1, 2, 3])
+        m1.assert_called_with(2)
+        m2.assert_called_once()
+
+    @patch('proxy_db.proxies.ProxiesList.reload_provider_without_error')
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxies', return_value=[1, 2])
+    def test_take_enough(self, m1, m2):
+        self.assertEqual(ProxiesList().get_many(2), [1, 2])
+        m2.assert_not_called()
+
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxies', side_effect=[[1, 2, 3, 4], [5]])
+    def test_take_prefetch(self, m):
+        p = ProxiesList(prefetch=4, prefetch_watermark=0)
+        self.assertEqual(next(p), 1)
+        self.assertEqual(p.take(4), [2, 3, 4, 5])
+
+    @patch('proxy_db.proxies.ProxyPrefetcher.reset')
+    @patch('proxy_db.proxies.ProxiesList.find_provider', side_effect=[Mock(), NoProvidersAvailable])
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxies', side_effect=[[1], [], [2, 3], [], [], []])
+    def test_prefetch_reload(self, m1, m2, m3):
+        p = ProxiesList(prefetch=2, prefetch_watermark=0)
+        self.assertEqual(list(p), [1, 2, 3])
+        m3.assert_called_once_with()
+
+    @patch('proxy_db.proxies.refresh_provider_requests')
+    @patch('proxy_db.proxies.ProxiesList.available_providers')
+    def test_parallel_refresh(self, m1, m2):
+        providers = [Mock(), Mock(), Mock()]
+        providers[1].request.return_value.requires_update.return_value = False
+        m1.return_value = providers
+        ProxiesList(parallel_refresh=True).reload_provider()
+        m2.assert_called_once_with([providers[0].request.return_value, providers[2].request.return_value],
+                                   timeout=None)
+
+    @patch('proxy_db.proxies.ProxiesList.available_providers', return_value=[])
+    def test_parallel_refresh_no_providers(self, m):
+        with self.assertRaises(NoProvidersAvailable):
+            ProxiesList().reload_providers()
+
+    @patch('proxy_db.proxies.ProxiesList.available_providers')
+    def test_refresher_watch(self, m):
+        provider = Mock()
+        m.return_value = [provider]
+        refresher = Mock()
+        ProxiesList('es', refresher=refresher)
+        refresher.watch.assert_called_once_with(provider, country='ES', protocol=None)
+
+    @patch('proxy_db.proxies.ProxiesList.has_db_proxies', return_value=True)
+    @patch('proxy_db.proxies.ProxiesList.reload_provider_without_error')
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxy', return_value=None)
+    def test_refresher_no_reload(self, m1, m2, m3):
+        with patch('proxy_db.proxies.ProxiesList.available_providers', return_value=[]):
+            p = ProxiesList(refresher=Mock())
+        with self.assertRaises(StopIteration):
+            next(p)
+        self.assertEqual(p.take(2), [])
+        m1.assert_called()
+        m2.assert_not_called()
+
+    @patch('proxy_db.proxies.ProxiesList.has_db_proxies', return_value=False)
+    @patch('proxy_db.proxies.ProxiesList.reload_provider_without_error')
+    @patch('proxy_db.proxies.ProxiesList.find_db_proxy', side_effect=[None, 'proxy'])
+    def test_refresher_empty_pool(self, m1, m2, m3):
+        with patch('proxy_db.proxies.ProxiesList.available_providers', return_value=[]):
+            p = ProxiesList(refresher=Mock())
+        self.assertEqual(next(p), 'proxy')
+        m2.assert_called_once()
+
+
+class TestListingStrategy(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestListingStrategy, self).setUp()
+        self.session.add_all([Proxy(id='http://1.1.1.{}:80'.format(i), votes=i % 3) for i in range(6)])
+        self.session.commit()
+
+    def test_no_repeat(self):
+        strategy = VotesListingStrategy()
+        proxies = [strategy.next(self.session.query(Proxy)) for _ in range(6)]
+        self.assertEqual([proxy.votes for proxy in proxies], [2, 2, 1, 1, 0, 0])
+        self.assertEqual(len(set(proxies)), 6)
+        self.assertIsNone(strategy.next(self.session.query(Proxy)))
+        self.assertEqual(strategy._proxies, {proxy.id for proxy in proxies})
+
+    def test_new_proxies(self):
+        strategy = VotesListingStrategy()
+        strategy.next_many(self.session.query(Proxy), 6)
+        self.session.add(Proxy(id='http://2.2.2.2:80', votes=10))
+        self.session.commit()
+        self.assertIsNone(strategy.next(self.session.query(Proxy)))
+        strategy.rescan()
+        self.assertEqual(strategy.next(self.session.query(Proxy)).id, 'http://2.2.2.2:80')
+
+    def test_changed_votes(self):
+        strategy = VotesListingStrategy()
+        proxy = strategy.next(self.session.query(Proxy))
+        proxy.votes = -1
+        self.session.commit()
+        proxies = strategy.next_many(self.session.query(Proxy), 10)
+        self.assertEqual(len(proxies), 5)
+        self.assertNotIn(proxy, proxies)
+
+    def test_exhausted_queries(self):
+        self.session.add_all([Proxy(id='http://2.2.{}.{}:80'.format(i // 256, i % 256)) for i in range(500)])
+        self.session.commit()
+        strategy = VotesListingStrategy()
+        self.assertEqual(len(strategy.next_many(self.session.query(Proxy), 1000)), 506)
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        # Only the query after the cursor
+        self.assertIsNone(strategy.next(self.session.query(Proxy)))
+        self.assertEqual(len(statements), 1)
+        # The query after the cursor and the pages of the proxies already returned.
+        strategy.rescan()
+        self.assertIsNone(strategy.next(self.session.query(Proxy)))
+        self.assertEqual(len(statements), 1 + 1 + 7)
+
+    def test_page_limit(self):
+        strategy = VotesListingStrategy()
+        limits = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            if 'FROM proxies' in statement:
+                limits.append(parameters[-2])
+
+        event.listen(self.engine, 'before_cursor_execute', before_cursor_execute)
+        strategy.next(self.session.query(Proxy))
+        strategy._cursor = None
+        strategy.next(self.session.query(Proxy))
+        # The first page is the limit. The next one is bigger to skip the returned proxy.
+        self.assertEqual(limits, [1, 1, 100])
+
+    def test_date_cursor(self):
+        # The proxies are created in the same second. The cursor is after the returned proxy.
+        strategy = ListingStrategy()
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        proxies = [strategy.next(self.session.query(Proxy)) for _ in range(6)]
+        self.assertEqual(len({proxy.id for proxy in proxies}), 6)
+        self.assertEqual(len([statement for statement in statements if 'FROM proxies' in statement]), 6)
+
+    def test_keyset_direction(self):
+        strategy = VotesListingStrategy()
+        query = strategy.get_query(self.session.query(Proxy), strategy.get_keyset_columns(self.session.query(Proxy)))
+        self.assertIn('ORDER BY proxies.votes DESC, proxies.id DESC', str(query.statement))
+        self.assertEqual([proxy.id for proxy in strategy.next_many(self.session.query(Proxy), 3)],
+                         ['http://1.1.1.5:80', 'http://1.1.1.2:80', 'http://1.1.1.4:80'])
+
+    def test_repeat(self):
+        strategy = ListingStrategy(no_repeat=False)
+        proxy = strategy.next(self.session.query(Proxy))
+        self.assertEqual(strategy.next(self.session.query(Proxy)), proxy)
+
+
+class TestFastestListingStrategy(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestFastestListingStrategy, self).setUp()
+        self.session.add_all([
+            Proxy(id='http://1.1.1.1:80', latency_ewma=0.5, check_successes=1, check_failures=3),
+            Proxy(id='http://2.2.2.2:80', latency_ewma=0.8, check_successes=4, check_failures=0),
+            Proxy(id='http://3.3.3.3:80', latency_ewma=3.0, check_successes=2, check_failures=0),
+            Proxy(id='http://4.4.4.4:80'),
+        ])
+        self.session.commit()
+
+    def get_ids(self, strategy):
+        return [proxy.id for proxy in strategy.next_many(self.session.query(Proxy), 10)]
+
+    def test_order(self):
+        self.assertEqual(self.get_ids(FastestListingStrategy()),
+                         ['http://1.1.1.1:80', 'http://2.2.2.2:80', 'http://3.3.3.3:80'])
+
+    def test_cut_offs(self):
+        strategy = FastestListingStrategy(min_success_rate=0.5, max_latency=1)
+        self.assertEqual(self.get_ids(strategy), ['http://2.2.2.2:80'])
+
+
+class TestRandomListingStrategy(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestRandomListingStrategy, self).setUp()
+        self.session.add_all([Proxy(id='http://1.1.1.{}:80'.format(i), votes=i % 3,
+                                    country='ES' if i % 2 else 'US') for i in range(6)])
+        self.session.commit()
+
+    def test_no_repeat(self):
+        strategy = RandomListingStrategy()
+        proxies = [strategy.next(self.session.query(Proxy)) for _ in range(6)]
+        self.assertEqual(len(set(proxies)), 6)
+        self.assertIsNone(strategy.next(self.session.query(Proxy)))
+
+    def test_filters(self):
+        strategy = RandomListingStrategy([Proxy.votes > 0])
+        proxies = strategy.next_many(self.session.query(Proxy).filter(Proxy.country == 'ES'), 10)
+        self.assertEqual({proxy.id for proxy in proxies}, {'http://1.1.1.1:80', 'http://1.1.1.5:80'})
+
+    def test_changed_filters(self):
+        strategy = RandomListingStrategy()
+        strategy.next(self.session.query(Proxy).filter(Proxy.country == 'ES'))
+        proxies = strategy.next_many(self.session.query(Proxy).filter(Proxy.country == 'US'), 10)
+        self.assertEqual({proxy.country for proxy in proxies}, {'US'})
+
+    def test_new_proxies(self):
+        strategy = RandomListingStrategy(refresh_seconds=0)
+        strategy.next(self.session.query(Proxy))
+        self.session.add(Proxy(id='http://2.2.2.2:80', votes=10))
+        self.session.commit()
+        proxies = strategy.next_many(self.session.query(Proxy), 10)
+        self.assertEqual(len(proxies), 6)
+        self.assertIn('http://2.2.2.2:80', {proxy.id for proxy in proxies})
+
+    def test_repeat(self):
+        strategy = RandomListingStrategy(no_repeat=False)
+        proxies = strategy.next_many(self.session.query(Proxy), 6) + strategy.next_many(self.session.query(Proxy), 6)
+        self.assertEqual(len(set(proxies)), 6)
+        self.assertEqual(len(proxies), 12)
+
+    def test_cached_ids(self):
+        strategy = RandomListingStrategy()
+        with patch.object(strategy, 'load_ids', wraps=strategy.load_ids) as load_mock:
+            self.assertEqual(len(strategy.next_many(self.session.query(Proxy), 10)), 6)
+            self.assertEqual(strategy.next_many(self.session.query(Proxy), 10), [])
+            self.assertEqual(load_mock.call_count, 1)
+            self.session.add(Proxy(id='http://2.2.2.2:80'))
+            self.session.commit()
+            strategy.rescan()
+            proxies = strategy.next_many(self.session.query(Proxy), 10)
+        self.assertEqual([proxy.id for proxy in proxies], ['http://2.2.2.2:80'])
+        self.assertEqual(load_mock.call_count, 2)
+
+    def test_repeat_cached_ids(self):
+        strategy = RandomListingStrategy(no_repeat=False)
+        with patch.object(strategy, 'load_ids', wraps=strategy.load_ids) as load_mock:
+            for _ in range(3):
+                self.assertEqual(len(strategy.next_many(self.session.query(Proxy), 6)), 6)
+        load_mock.assert_called_once()
+
+
+class TestWeightedRandomListingStrategy(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestWeightedRandomListingStrategy, self).setUp()
+        self.session.add_all([Proxy(id='http://1.1.1.1:80', votes=0), Proxy(id='http://1.1.1.2:80', votes=9),
+                              Proxy(id='http://1.1.1.3:80', votes=-5)])
+        self.session.commit()
+
+    def test_weights(self):
+        strategy = WeightedRandomListingStrategy()
+        proxies = [strategy.next(self.session.query(Proxy)).id for _ in range(500)]
+        self.assertAlmostEqual(proxies.count('http://1.1.1.2:80') / 500.0, 10 / 12.0, delta=0.08)
+
+    def test_weight_function(self):
+        strategy = WeightedRandomListingStrategy(weight=lambda votes: 1 if votes < 0 else 0)
+        self.assertEqual(strategy.next(self.session.query(Proxy)).id, 'http://1.1.1.3:80')
+
+    def test_no_repeat(self):
+        strategy = WeightedRandomListingStrategy(no_repeat=True)
+        proxies = strategy.next_many(self.session.query(Proxy), 2) + strategy.next_many(self.session.query(Proxy), 2)
+        self.assertEqual(len(set(proxies)), 3)
+
+    def test_rebuild(self):
+        strategy = WeightedRandomListingStrategy(refresh_seconds=0, weight=lambda votes: int(votes > 5))
+        self.assertEqual(strategy.next(self.session.query(Proxy)).id, 'http://1.1.1.2:80')
+        self.session.query(Proxy).update({Proxy.votes: 10 - Proxy.votes})
+        self.session.commit()
+        self.assertIn(strategy.next(self.session.query(Proxy)).id, {'http://1.1.1.1:80', 'http://1.1.1.3:80'})
+
+
+class TestRoundRobinListingStrategy(DatabaseMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestRoundRobinListingStrategy, self).setUp()
+        self.session.add_all([Proxy(id='http://1.1.1.{}:80'.format(i), votes=i % 3) for i in range(5)])
+        self.session.commit()
+
+    def test_round_robin(self):
+        strategy = RoundRobinListingStrategy(page_size=2)
+        proxies = [strategy.next(self.session.query(Proxy)).id for _ in range(7)]
+        self.assertEqual(proxies, [
+            'http://1.1.1.2:80', 'http://1.1.1.4:80', 'http://1.1.1.1:80', 'http://1.1.1.3:80',
+            'http://1.1.1.0:80', 'http://1.1.1.2:80', 'http://1.1.1.4:80',
+        ])
+
+    def test_limit(self):
+        strategy = RoundRobinListingStrategy(page_size=2)
+        self.assertEqual(len(strategy.next_many(self.session.query(Proxy), 3)), 3)
+        self.assertEqual(len(strategy.next_many(self.session.query(Proxy), 10)), 5)
+
+    def test_limit_new_session(self):
+        strategy = RoundRobinListingStrategy(page_size=4)
+        strategy.next(self.session.query(Proxy))
+        # The rest of the page was loaded in the previous session
+        session = sessionmaker(bind=self.session.get_bind())()
+        proxies = strategy.next_many(session.query(Proxy), 10)
+        self.assertEqual(len({proxy.id for proxy in proxies}), len(proxies))
+        self.assertEqual(len(proxies), 5)
+
+    def test_empty(self):
+        strategy = RoundRobinListingStrategy()
+        self.assertIsNone(strategy.next(self.session.query(Proxy).filter(Proxy.votes > 10)))
+
+
+class TestQueryPlan(DatabaseMixin, unittest.TestCase):
+    """The proxies selection query must be sorted using the indexes, without full
+    table scans or temporary b-trees, in a database with statistics (ANALYZE).
+    """
+    size = 5000
+
+    def setUp(self):
+        super(TestQueryPlan, self).setUp()
+        countries = ['ES', 'US', 'FR', 'DE']
+        with self.engine.begin() as connection:
+            connection.execute(insert(ProviderRequest.__table__), [
+                {'id': i, 'provider': provider.name, 'request_id': str(i)} for i, provider in enumerate(PROVIDERS, 1)
+            ])
+            proxies = [{'id': 'http://1.1.{}.{}:80'.format(i // 256, i % 256), 'votes': i % 20 - 5,
+                        'country': countries[i % len(countries)], 'protocol': ['http', 'https'][i % 2],
+                        'latency_ewma': (i % 50) / 10.0} for i in range(self.size)]
+            connection.execute(insert(Proxy.__table__), proxies)
+            connection.execute(insert(association_table), [
+                {'proxy_id': proxy['id'], 'provider_request_id': i % len(PROVIDERS) + 1}
+                for i, proxy in enumerate(proxies)
+            ])
+            connection.execute(text('ANALYZE'))
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, *args):
+        if statement.startswith('SELECT proxies.'):
+            self.statements.append((statement, parameters))
+
+    def get_query_plan(self, strategy, **request_options):
+        with patch('proxy_db.proxies.create_session', return_value=self.session), \
+                patch('proxy_db.proxies.ProxiesList.available_providers', return_value=PROVIDERS):
+            proxies_list = ProxiesList(strategy=strategy, **request_options)
+            # The second query uses the cursor
+            proxies_list.find_db_proxies(1)
+            proxies_list.find_db_proxies(1)
+        statement, parameters = self.statements[-1]
+        with self.engine.connect() as connection:
+            plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN {}'.format(statement), parameters)
+            return [row[-1] for row in plan]
+
+    def test_query_plan(self):
+        for request_options in [{}, {'country': 'ES'}, {'protocol': 'http'}, {'country': 'ES', 'protocol': 'http'}]:
+            for strategy in [VotesListingStrategy(), ListingStrategy(), FastestListingStrategy(max_latency=2)]:
+                plan = self.get_query_plan(strategy, **request_options)
+                full_scans = [detail for detail in plan if re.match(r'SCAN (TABLE )?\w+', detail)]
+                self.assertEqual(full_scans, [], plan)
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+
+class TestProxyPrefetcher(unittest.TestCase):
+    def test_pop(self):
+        fetch = Mock(return_value=[1, 2, 3, 4])
+        prefetcher = ProxyPrefetcher(fetch, 4, 0)
+        self.assertEqual([prefetcher.pop() for _ in range(3)], [1, 2, 3])
+        fetch.assert_called_once_with(4)
+
+    def test_refill_background(self):
+        fetch = Mock(side_effect=[[1, 2, 3, 4], [5, 6]])
+        prefetcher = ProxyPrefetcher(fetch, 4, 2)
+        self.assertEqual(prefetcher.pop(), 1)
+        self.assertEqual(prefetcher.pop(), 2)
+        prefetcher.wait()
+        fetch.assert_called_with(2)
+        self.assertEqual(len(prefetcher), 4)
+
+    def test_exhausted(self):
+        fetch = Mock(return_value=[1])
+        prefetcher = ProxyPrefetcher(fetch, 4)
+        self.assertEqual(prefetcher.pop(), 1)
+        prefetcher.wait()
+        fetch.assert_called_once_with(4)
+        fetch.return_value = []
+        self.assertIsNone(prefetcher.pop())
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_reset(self):
+        fetch = Mock(side_effect=[[1, 2], [], [3]])
+        prefetcher = ProxyPrefetcher(fetch, 4, 0)
+        self.assertEqual(prefetcher.pop(), 1)
+        prefetcher.wait()
+        prefetcher.reset()
+        # The buffered proxies are returned before the new ones.
+        self.assertEqual([prefetcher.pop(), prefetcher.pop()], [2, 3])
@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+
+from proxy_db.refresh import refresh_provider_requests, BackgroundRefresher
+from ._compat import Mock, patch
+
+
+class TestRefreshProviderRequests(unittest.TestCase):
+    def test_concurrent(self):
+        barrier = threading.Barrier(3, timeout=5)
+        provider_requests = [Mock(**{'now.side_effect': lambda i=i: barrier.wait() and i}) for i in range(3)]
+        results = refresh_provider_requests(provider_requests)
+        self.assertEqual(len(results), 3)
+
+    def test_error(self):
+        provider_request = Mock(**{'now.side_effect': ValueError})
+        self.assertEqual(refresh_provider_requests([provider_request]), {provider_request: None})
+
+    def test_timeout(self):
+        slow = Mock(**{'now.side_effect': lambda: time.sleep(0.5)})
+        fast = Mock(**{'now.return_value': 'result'})
+        self.assertEqual(refresh_provider_requests([slow, fast], timeout=0.1), {fast: 'result'})
+
+    def test_empty(self):
+        self.assertEqual(refresh_provider_requests([]), {})
+
+
+class TestBackgroundRefresher(unittest.TestCase):
+    def get_provider(self, name='provider'):
+        provider = Mock(**{'is_available.return_value': True})
+        provider.name = name
+        provider.request.side_effect = lambda country=None, protocol=None: Mock(
+            options=(name, country, protocol), **{'requires_update.return_value': country != 'FR'})
+        return provider
+
+    @patch('proxy_db.refresh.BackgroundRefresher.get_db_options', return_value=[('provider', 'FR', 'http')])
+    def test_get_provider_requests(self, m):
+        refresher = BackgroundRefresher(providers=[self.get_provider()])
+        refresher.watch(refresher.providers[0], 'ES')
+        options = {provider_request.options for provider_request in refresher.get_provider_requests()}
+        self.assertEqual(options, {('provider', None, None), ('provider', 'ES', None), ('provider', 'FR', 'http')})
+
+    @patch('proxy_db.refresh.BackgroundRefresher.get_db_options', return_value=[('provider', 'FR', None)])
+    def test_get_expiring_requests(self, m):
+        refresher = BackgroundRefresher(margin_minutes=5, providers=[self.get_provider()])
+        provider_requests = refresher.get_expiring_requests()
+        self.assertEqual([provider_request.options for provider_request in provider_requests],
+                         [('provider', None, None)])
+        provider_requests[0].requires_update.assert_called_once_with(5)
+
+    @patch('proxy_db.refresh.BackgroundRefresher.get_db_options', return_value=[('other', 'ES', None)])
+    def test_unavailable_provider(self, m):
+        refresher = BackgroundRefresher(providers=[self.get_provider()])
+        self.assertEqual(len(refresher.get_provider_requests()), 1)
+
+    @patch('proxy_db.models.create_session')
+    def test_get_db_options(self, m):
+        m.return_value.query.return_value.all.return_value = [('provider', 'ES-None'), ('provider', 'None-http')]
+        self.assertEqual(list(BackgroundRefresher().get_db_options()),
+                         [('provider', 'ES', None), ('provider', None, 'http')])
+
+    def test_start_stop(self):
+        event = threading.Event()
+        refresher = BackgroundRefresher(interval=10)
+        with patch.object(refresher, 'refresh', side_effect=lambda: event.set()) as m:
+            refresher.start()
+            self.assertTrue(event.wait(5))
+            refresher.stop()
+        self.assertFalse(refresher.is_alive())
+        m.assert_called_once()
+
+    def test_run_error(self):
+        refresher = BackgroundRefresher(interval=0)
+
+        def refresh():
+            if m.call_count == 1:
+                raise ValueError
+            refresher.stop(wait=False)
+
+        with patch.object(refresher, 'refresh', side_effect=refresh) as m:
+            refresher.run()
+        self.assertEqual(m.call_count, 2)
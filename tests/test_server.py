@@ -0,0 +1,139 @@
+import os
+import socket
+import threading
+import unittest
+from http.client import HTTPConnection
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from proxy_db.client import RemoteProxiesList, Client
+from proxy_db.exceptions import ServerError, NoProxiesAvailable
+from proxy_db.models import Base, Proxy, ProviderRequest, ProxyLease
+from proxy_db.server import create_server, get_server_address, ProxyDBService
+from ._compat import patch
+from ._db import temporary_directory
+
+
+class ServerMixin(object):
+    address = 'http://127.0.0.1:0'
+
+    def setUp(self):
+        self.directory = temporary_directory(self)
+        engine = create_engine('sqlite:///{}'.format(os.path.join(self.directory, 'db.sqlite3')))
+        Base.metadata.create_all(engine)
+        self.session_maker = sessionmaker(bind=engine)
+        session = self.session_maker()
+        proxies = [Proxy(id='http://1.1.1.{}:80'.format(i), votes=i, country='ES', protocol='http')
+                   for i in range(1, 4)]
+        session.add_all(proxies)
+        session.add(ProviderRequest(provider='manual', request_id='None-None', proxies=proxies))
+        session.commit()
+        self.patches = [patch('proxy_db.{}.create_session'.format(module), side_effect=self.session_maker)
+                        for module in ['proxies', 'leases', 'votes']]
+        for p in self.patches:
+            p.start()
+        self.server = create_server(self.address.format(directory=self.directory), ProxyDBService(prefetch=2))
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.client = Client(get_server_address(self.server))
+        self.proxies_list = RemoteProxiesList(provider='manual', client=self.client)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        for p in self.patches:
+            p.stop()
+
+    def get_votes(self, proxy_id):
+        return self.session_maker().get(Proxy, proxy_id).votes
+
+
+class TestServer(ServerMixin, unittest.TestCase):
+    def test_next(self):
+        proxies = [next(self.proxies_list) for _ in range(4)]
+        self.assertEqual([proxy.id for proxy in proxies],
+                         ['http://1.1.1.3:80', 'http://1.1.1.2:80', 'http://1.1.1.1:80', 'http://1.1.1.3:80'])
+        self.assertEqual(proxies[0]['https'], 'http://1.1.1.3:80')
+        self.assertEqual(proxies[0].providers, {'manual'})
+
+    def test_shared_list(self):
+        other_list = RemoteProxiesList(provider='manual', client=Client(get_server_address(self.server)))
+        self.assertNotEqual(next(self.proxies_list).id, next(other_list).id)
+
+    def test_take(self):
+        self.assertEqual(len(self.proxies_list.take(2)), 2)
+
+    def test_vote(self):
+        next(self.proxies_list).positive()
+        self.assertEqual(self.get_votes('http://1.1.1.3:80'), 4)
+
+    def test_acquire_release(self):
+        proxy = self.proxies_list.acquire(ttl=60)
+        self.assertEqual(proxy.id, 'http://1.1.1.3:80')
+        self.assertEqual(self.proxies_list.acquire().id, 'http://1.1.1.2:80')
+        self.assertTrue(self.proxies_list.release(proxy, success=False))
+        self.assertIsNone(proxy.lease)
+        self.assertEqual(self.get_votes(proxy.id), 2)
+        self.assertEqual(self.session_maker().query(ProxyLease).count(), 1)
+
+    def test_no_proxies(self):
+        proxies_list = RemoteProxiesList(country='us', provider='manual', client=self.client)
+        with self.assertRaises(StopIteration):
+            next(proxies_list)
+        with self.assertRaises(NoProxiesAvailable):
+            proxies_list.acquire()
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(ServerError):
+            next(RemoteProxiesList(provider='manual', strategy='foo', client=self.client))
+
+    def test_strategy(self):
+        proxies_list = RemoteProxiesList(provider='manual', strategy='newest', client=self.client)
+        self.assertEqual(len(proxies_list.take(3)), 3)
+
+    def test_reconnect(self):
+        next(self.proxies_list)
+        # Stale keep-alive connection: the request cannot be sent.
+        self.client.get_connection().sock.shutdown(socket.SHUT_WR)
+        self.assertIsNotNone(next(self.proxies_list))
+
+    def test_reconnect_reset(self):
+        next(self.proxies_list)
+        getresponse = HTTPConnection.getresponse
+        connections = []
+
+        def reset_once(connection):
+            # Stale keep-alive connection reset by the server.
+            connections.append(connection)
+            if len(connections) == 1:
+                raise ConnectionResetError
+            return getresponse(connection)
+
+        with patch('http.client.HTTPConnection.getresponse', autospec=True, side_effect=reset_once):
+            self.assertIsNotNone(next(self.proxies_list))
+        self.assertEqual(len(connections), 2)
+        self.assertIsNot(connections[0], connections[1])
+
+    def test_reset_new_connection(self):
+        with patch('http.client.HTTPConnection.getresponse', side_effect=ConnectionResetError) as m:
+            with self.assertRaises(ConnectionResetError):
+                next(self.proxies_list)
+        m.assert_called_once()
+
+    def test_no_retry(self):
+        next(self.proxies_list)
+        with patch('http.client.HTTPConnection.getresponse', side_effect=socket.timeout) as m:
+            with self.assertRaises(socket.timeout):
+                next(self.proxies_list).positive()
+        m.assert_called_once()
+        self.assertIsNone(self.client.get_connection().sock)
+
+
+class TestUnixServer(ServerMixin, unittest.TestCase):
+    address = 'unix://{directory}/proxy-db.sock'
+
+    def test_next(self):
+        self.assertEqual(next(self.proxies_list).id, 'http://1.1.1.3:80')
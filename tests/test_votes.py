@@ -0,0 +1,74 @@
+import time
+import unittest
+
+from proxy_db.models import Proxy
+from proxy_db.votes import VoteBuffer, apply_votes, enable_vote_buffer, disable_vote_buffer, get_vote_buffer, \
+    add_vote
+from ._compat import patch
+from ._db import DatabaseMixin
+
+
+class TestApplyVotes(DatabaseMixin, unittest.TestCase):
+    def test_apply_votes(self):
+        self.session.add_all([Proxy(id='http://1.1.1.1:80', votes=1), Proxy(id='http://2.2.2.2:80', votes=1)])
+        self.session.commit()
+        apply_votes({'http://1.1.1.1:80': 2, 'http://2.2.2.2:80': -1}, self.session)
+        self.assertEqual(dict(self.session.query(Proxy.id, Proxy.votes)), {
+            'http://1.1.1.1:80': 3, 'http://2.2.2.2:80': 0,
+        })
+
+    @patch('proxy_db.votes.create_session')
+    def test_empty_votes(self, m):
+        apply_votes({'http://1.1.1.1:80': 0})
+        m.assert_not_called()
+
+
+class TestVoteBuffer(unittest.TestCase):
+    @patch('proxy_db.votes.apply_votes')
+    def test_flush(self, m):
+        vote_buffer = VoteBuffer(60, 10)
+        vote_buffer.add('http://1.1.1.1:80', 1)
+        vote_buffer.add('http://1.1.1.1:80', 1)
+        vote_buffer.add('http://2.2.2.2:80', -1)
+        m.assert_not_called()
+        vote_buffer.flush()
+        m.assert_called_once_with({'http://1.1.1.1:80': 2, 'http://2.2.2.2:80': -1})
+        self.assertEqual(len(vote_buffer), 0)
+
+    @patch('proxy_db.votes.apply_votes')
+    def test_max_size(self, m):
+        vote_buffer = VoteBuffer(60, 2)
+        vote_buffer.add('http://1.1.1.1:80', 1)
+        vote_buffer.add('http://2.2.2.2:80', 1)
+        m.assert_called_once_with({'http://1.1.1.1:80': 1, 'http://2.2.2.2:80': 1})
+
+    @patch('proxy_db.votes.apply_votes', side_effect=ValueError)
+    def test_flush_error(self, m):
+        vote_buffer = VoteBuffer(60, 10)
+        vote_buffer.add('http://1.1.1.1:80', 1)
+        with self.assertRaises(ValueError):
+            vote_buffer.flush()
+        self.assertEqual(len(vote_buffer), 1)
+
+    @patch('proxy_db.votes.logger')
+    @patch('proxy_db.votes.apply_votes', side_effect=[ValueError, None])
+    def test_timer_flush_error(self, m1, m2):
+        vote_buffer = VoteBuffer(0.01, 10)
+        vote_buffer.add('http://1.1.1.1:80', 1)
+        for _ in range(100):
+            if m1.call_count == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(m1.call_count, 2)
+        m1.assert_called_with({'http://1.1.1.1:80': 1})
+        m2.exception.assert_called_once()
+        self.assertEqual(len(vote_buffer), 0)
+
+    @patch('proxy_db.votes.apply_votes')
+    def test_enable_vote_buffer(self, m):
+        vote_buffer = enable_vote_buffer(60)
+        add_vote('http://1.1.1.1:80', 1)
+        self.assertEqual(get_vote_buffer(), vote_buffer)
+        disable_vote_buffer()
+        self.assertIsNone(get_vote_buffer())
+        m.assert_called_once_with({'http://1.1.1.1:80': 1})